@@ -9,6 +9,7 @@ from scipy.stats import entropy
 
 sys.path.append(os.path.abspath("ml_pipeline"))
 from dip_module import apply_dip_pipeline
+from dataset_cache import list_split, split_exists
 from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
 
 def get_last_conv_layer(model):
@@ -61,9 +62,12 @@ def perform_attention_analysis():
     # Pick a random infected leaf image
     test_image_path = "data_split/val/Tomato___Early_blight/0012b9d2-2130-4a06-a834-b1f3af34f57e___RS_Erly.B 8389.JPG"
     if not os.path.exists(test_image_path):
-        # Fallback to any file
-        import glob
-        test_image_path = glob.glob("data_split/val/*/*")[0]
+        # Fallback to any validation file (split manifest or materialized directory)
+        val_paths = list_split("data_split/val")[0] if split_exists("data_split/val") else []
+        if not val_paths:
+            print("No validation images found, run ml_pipeline/data_prep.py first.")
+            return
+        test_image_path = val_paths[0]
         
     print(f"Executing Attention Analysis on: {test_image_path}")
     
@@ -0,0 +1,32 @@
+import re
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+from .predict import artifact_store
+
+router = APIRouter()
+
+ARTIFACT_KEY = re.compile(r"^[0-9a-f]{64}$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@router.get("/artifacts/{key}")
+async def get_artifact(key: str, request: Request):
+    """
+    Diagnostic preview by content hash. The hash covers the pixels and the encoding, so
+    the bytes behind a URL never change and clients/CDNs may cache them indefinitely.
+    Unauthenticated on purpose (<img> tags cannot send the bearer token); the 256-bit
+    hash is not guessable.
+    """
+    if not ARTIFACT_KEY.match(key):
+        raise HTTPException(status_code=404, detail="Artifact not found.")
+    etag = f'"{key}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": IMMUTABLE})
+
+    artifact = await run_in_threadpool(artifact_store.get, key)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Artifact not found.")
+    data, media_type = artifact
+    return Response(content=data, media_type=media_type, headers={"ETag": etag, "Cache-Control": IMMUTABLE})
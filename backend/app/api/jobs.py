@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+
+from fastapi import APIRouter, File, UploadFile, Depends, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from ..db.session import get_db, SessionLocal
+from ..db.models import User, BulkJob
+from ..core.dependencies import get_current_user
+from ..services import bulk_jobs
+from ..services.worker_pool import BoundedWorkerPool
+from .predict import predict_pool
+from .predict_batch import MAX_FILE_BYTES, BAD_ARCHIVE_ERRORS, _iter_upload, _predict_batch_admitted
+
+router = APIRouter()
+
+BULK_JOB_MAX_FILES = int(os.getenv("BULK_JOB_MAX_FILES", "10000"))
+# Run a worker inside the API process; set false when running scripts/bulk_worker.py instead
+BULK_JOB_IN_PROCESS = os.getenv("BULK_JOB_IN_PROCESS", "true").lower() in ("1", "true", "yes")
+BULK_JOB_THREADS = int(os.getenv("BULK_JOB_THREADS", "2"))
+
+# Bulk work gets its own small pool so interactive /predict stages never queue behind it
+bulk_pool = BoundedWorkerPool(max_workers=BULK_JOB_THREADS, max_queue=0, name="bulk")
+
+
+def _stage_upload(job_id, filename, contents, start, limit=BULK_JOB_MAX_FILES):
+    """
+    Stage one upload (or each image of a .zip) as job items numbered from `start`, writing
+    every member out before the next one is decompressed. Returns the new (filename, path,
+    error) items, and whether the upload held more images than fit under `limit`.
+    """
+    items = []
+    for name, data in _iter_upload(filename, contents):
+        if start + len(items) >= limit:
+            return items, True
+        if data is None:
+            items.append((name, None, f"File too large (max {MAX_FILE_BYTES // (1024 * 1024)}MB)."))
+            continue
+        items.append((name, bulk_jobs.stage_item(job_id, start + len(items), data), None))
+    return items, False
+
+def _read_staged(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+async def process_chunk(job, items):
+    """Run a claimed chunk through the /predict-batch stages; one result dict per item."""
+    contents = await run_in_threadpool(lambda: [(filename, _read_staged(path)) for _, filename, path in items])
+    db = SessionLocal()
+    try:
+        user = db.get(User, job["user_id"])
+        response = await _predict_batch_admitted(
+            contents, job["latitude"], job["longitude"], job["force_dip"], user, db, time.time(), pool=bulk_pool
+        )
+        return response["results"]
+    finally:
+        db.close()
+
+def interactive_busy():
+    """True while /predict or /predict-batch requests are in flight in this process."""
+    return predict_pool.stats()["in_flight"] > 0
+
+async def run_worker(stop: asyncio.Event, should_yield=interactive_busy):
+    await bulk_jobs.run_worker(process_chunk, stop, should_yield=should_yield)
+
+
+def _get_job(db: Session, job_id: str, user: User) -> BulkJob:
+    job = db.get(BulkJob, job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@router.post("/jobs", status_code=202)
+async def submit_job(
+    files: list[UploadFile] = File(...),
+    latitude: float = Form(None),
+    longitude: float = Form(None),
+    force_dip_ui: bool = Form(False),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Queue a bulk diagnosis job (many files and/or .zip archives). Images are staged on disk
+    and recorded in the bulk_jobs tables, then processed in chunks by the job workers.
+    More than BULK_JOB_MAX_FILES images (zip contents included) is refused with 413.
+    Poll GET /jobs/{id} for progress and stream GET /jobs/{id}/results for per-image results.
+    """
+    job_id = uuid.uuid4().hex
+    items = []
+    for upload in files:
+        # One upload in memory at a time, unpacked off the event loop one member at a time
+        try:
+            staged, too_many = await run_in_threadpool(
+                _stage_upload, job_id, upload.filename, await upload.read(), len(items)
+            )
+        except BAD_ARCHIVE_ERRORS:
+            await run_in_threadpool(bulk_jobs.discard_staging, job_id)
+            raise HTTPException(status_code=400, detail=f"Invalid or corrupt zip archive: {upload.filename}")
+        if too_many:
+            # Same answer as /predict-batch: never queue a silently truncated job
+            await run_in_threadpool(bulk_jobs.discard_staging, job_id)
+            raise HTTPException(status_code=413, detail=f"Too many images (max {BULK_JOB_MAX_FILES}).")
+        items += staged
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in upload.")
+
+    await run_in_threadpool(
+        bulk_jobs.create_job, job_id, current_user.id, items, latitude, longitude, force_dip_ui
+    )
+    return {"job_id": job_id, "status": "queued", "total": len(items)}
+
+@router.get("/jobs")
+def list_jobs(
+    skip: int = 0, limit: int = 20,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    jobs = db.query(BulkJob).filter(BulkJob.user_id == current_user.id).order_by(BulkJob.created_at.desc()).offset(skip).limit(limit).all()
+    return [bulk_jobs.job_status(job) for job in jobs]
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return bulk_jobs.job_status(_get_job(db, job_id, current_user))
+
+@router.get("/jobs/{job_id}/results")
+def stream_job_results(
+    job_id: str,
+    after: int = 0,
+    follow: bool = True,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    NDJSON stream of per-image results in completion order, one line per image:
+    {"seq", "index", "filename", ...}. `seq` is dense per job, so a dropped client resumes
+    with ?after=<last seq>. With follow=true the stream stays open until the job finishes.
+    """
+    _get_job(db, job_id, current_user)
+
+    async def lines():
+        last_seq = after
+        while True:
+            rows, finished = await run_in_threadpool(bulk_jobs.fetch_results, job_id, last_seq)
+            for result_seq, index, result in rows:
+                last_seq = result_seq
+                yield json.dumps({"seq": result_seq, "index": index, **result}, default=str) + "\n"
+            if rows:
+                continue
+            if finished or not follow:
+                return
+            await asyncio.sleep(bulk_jobs.BULK_JOB_POLL_S)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Cancel the unprocessed remainder of a job; results already produced stay available."""
+    _get_job(db, job_id, current_user)
+    bulk_jobs.cancel_job(job_id)
+    db.expire_all()
+    return bulk_jobs.job_status(_get_job(db, job_id, current_user))
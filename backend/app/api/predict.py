@@ -1,14 +1,17 @@
 import time
+import asyncio
 import cv2
 import traceback
-import base64
-from io import BytesIO
-from PIL import Image as PILImage
 from datetime import datetime
 import uuid
 import os
+import copy
+import hashlib
+import logging
+import threading
 
 from fastapi import APIRouter, File, UploadFile, Depends, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 import numpy as np
 
@@ -17,22 +20,62 @@ from ..db.models import Detection, User
 from ..core.dependencies import get_current_user
 from ..services.weather import get_spread_risk
 from ..services.remedies import get_remedy_for_disease
+from ..services.ingest import decode_upload
+from ..services.inference import InferenceScheduler, INFERENCE_MAX_BATCH_SIZE
+from ..services.engines import load_engine, DualHeadEngine, HeadView, INFERENCE_DUAL_HEAD
+from ..services.worker_pool import BoundedWorkerPool, QueueFullError
+from ..services.result_cache import PredictionCache, make_cache_key
+from ..services.near_duplicate import NearDuplicateIndex
+from ..services.quality import assess_quality
+from ..services.artifacts import ArtifactStore
+from ..services.sidecar import SidecarEngine, INFERENCE_SIDECAR
 
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../ml_pipeline")))
-import tensorflow as tf
-from dip_module import apply_production_dip, resize_image
+from dip_module import apply_production_dip
 
 router = APIRouter()
+logger = logging.getLogger("cropsense.predict")
 
 # Global Model Cache
 models_cache = {
     "raw": None,
-    "dip": None
+    "dip": None,
+    "dual": None
+}
+# Serialises load_models(): the startup warmup thread and early requests must not load twice
+_models_lock = threading.Lock()
+
+WARMUP_BATCH_SIZES = sorted({1, INFERENCE_MAX_BATCH_SIZE} | {
+    int(b) for b in os.getenv("WARMUP_BATCH_SIZES", "").split(",") if b.strip()
+})
+
+# Micro-batches concurrent raw/DIP requests into single forward passes
+inference_scheduler = InferenceScheduler(models_cache)
+
+# Dedicated executor for the CPU-bound image stages, with bounded admission
+predict_pool = BoundedWorkerPool()
+
+# Content-addressed cache of finished predictions (retries / re-submitted photos)
+prediction_cache = PredictionCache()
+
+# Perceptual-hash index of recent classifications for near-identical photos
+near_duplicates = NearDuplicateIndex()
+
+# DIP previews are served by URL from here (GET /api/artifacts/{hash}), encoded on first fetch
+artifact_store = ArtifactStore()
+# Default for the inline_previews form flag: base64 previews inside the JSON, for old clients
+PREDICT_INLINE_PREVIEWS = os.getenv("PREDICT_INLINE_PREVIEWS", "false").lower() in ("1", "true", "yes")
+PREVIEW_FIELDS = {
+    "mask": ("mask_preview_url", "mask_preview_base64"),
+    "gli": ("gli_mask_url", "gli_mask_base64"),
+    "lab": ("lab_mask_url", "lab_mask_base64"),
+    "combined": ("combined_mask_url", "combined_mask_base64"),
 }
 
 NODIP_MODEL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../ml_pipeline/model_nodip.keras"))
 DIP_MODEL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../ml_pipeline/model_with_dip.keras"))
+DUAL_MODEL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../ml_pipeline/model_dual_head.keras"))
 
 CLASS_NAMES = [
     'Apple___Apple_scab', 'Apple___Black_rot', 'Apple___Cedar_apple_rust', 'Apple___healthy',
@@ -49,11 +92,95 @@ CLASS_NAMES = [
     'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus', 'Tomato___healthy'
 ]
 
-def load_models():
-    if models_cache["raw"] is None and os.path.exists(NODIP_MODEL_PATH):
-        models_cache["raw"] = tf.keras.models.load_model(NODIP_MODEL_PATH)
-    if models_cache["dip"] is None and os.path.exists(DIP_MODEL_PATH):
-        models_cache["dip"] = tf.keras.models.load_model(DIP_MODEL_PATH)
+def load_models(use_sidecar=True):
+    """
+    Fill models_cache with the configured engines. Safe to call from any thread: loads are
+    serialised and every entry is checked again under the lock, so each model loads once.
+    """
+    if models_cache["raw"] is not None and models_cache["dip"] is not None:
+        return
+    with _models_lock:
+        _load_models_locked(use_sidecar)
+
+def _load_models_locked(use_sidecar):
+    # One inference process per node (scripts/inference_sidecar.py): workers hold no model weights
+    if INFERENCE_SIDECAR and use_sidecar:
+        for key in ("raw", "dip"):
+            if models_cache[key] is None:
+                models_cache[key] = SidecarEngine(key)
+        return
+    # Shared-trunk model: one copy of the backbone, raw/dip are views onto its two heads
+    if INFERENCE_DUAL_HEAD and models_cache["dual"] is None and os.path.exists(DUAL_MODEL_PATH):
+        models_cache["dual"] = DualHeadEngine(DUAL_MODEL_PATH)
+        models_cache["raw"] = HeadView(models_cache["dual"], 0)
+        models_cache["dip"] = HeadView(models_cache["dual"], 1)
+    # Engines expose predict_on_batch(); Keras or TFLite is picked by INFERENCE_BACKEND
+    if models_cache["raw"] is None:
+        models_cache["raw"] = load_engine(NODIP_MODEL_PATH)
+    if models_cache["dip"] is None:
+        models_cache["dip"] = load_engine(DIP_MODEL_PATH)
+
+# Populated by warmup_models() at startup; served by the /ready endpoint
+model_status = {
+    "ready": False,
+    "models_loaded": False,
+    "load_ms": None,
+    "warmup_ms": {},
+    "error": None,
+}
+
+def warmup_models(batch_sizes=None, use_sidecar=True, stop=None):
+    """
+    Preload both models and push warmup batches through the raw and DIP paths,
+    so graph tracing / allocation happens before the first farmer's request.
+    `stop` (a threading.Event) is checked between steps so shutdown can end a warmup
+    already running in the threadpool. Ready only once both models are loaded and warm.
+    """
+    batch_sizes = batch_sizes or WARMUP_BATCH_SIZES
+    stopping = stop.is_set if stop is not None else lambda: False
+    try:
+        t0 = time.time()
+        load_models(use_sidecar)
+        model_status["load_ms"] = round((time.time() - t0) * 1000, 2)
+        model_status["models_loaded"] = bool(models_cache["raw"] and models_cache["dip"])
+        if not model_status["models_loaded"]:
+            logger.warning("Model files not found: serving mock results, /ready stays 503.")
+            return model_status
+
+        # Leaf-like synthetic frame (same recipe as data_prep.generate_synthetic_data)
+        rng = np.random.default_rng(0)
+        img_bgr = rng.integers(0, 150, (224, 224, 3), dtype=np.uint8)
+        img_bgr[:, :, 1] = rng.integers(50, 255, (224, 224), dtype=np.uint8)
+
+        for key, prepare in (("raw", _raw_model_input), ("dip", lambda img: _dip_model_input(img)[1])):
+            t0 = time.time()
+            x = prepare(img_bgr)
+            for batch_size in batch_sizes:
+                if stopping():
+                    logger.info("Shutting down: model warmup stopped.")
+                    return model_status
+                models_cache[key].predict_on_batch(np.stack([x] * batch_size))
+            model_status["warmup_ms"][key] = round((time.time() - t0) * 1000, 2)
+
+        model_status["ready"] = True
+        logger.info(f"Models warm: load {model_status['load_ms']} ms, warmup {model_status['warmup_ms']} (batch sizes {batch_sizes})")
+    except Exception as e:
+        model_status["error"] = str(e)
+        logger.error(f"Model warmup failed: {e}")
+    return model_status
+
+def model_fingerprint():
+    """Short hash of the loaded model artifacts (path, size, mtime); 'mock' entries when absent."""
+    parts = []
+    for key in ("raw", "dip"):
+        engine = models_cache[key]
+        path = getattr(getattr(engine, "engine", engine), "path", None)
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            parts.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+        else:
+            parts.append(f"{key}:mock")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:12]
 
 def get_class_name(index):
     if 0 <= index < len(CLASS_NAMES):
@@ -65,27 +192,66 @@ def determine_severity(confidence):
     if confidence > 0.75: return "Moderate"
     return "Mild"
 
-def _numpy_to_base64_rgb(img_rgb) -> str:
-    """Convert an RGB numpy array to a JPEG base64 string."""
-    try:
-        pil_img = PILImage.fromarray(img_rgb.astype(np.uint8))
-        buffered = BytesIO()
-        pil_img.save(buffered, format="JPEG", quality=85)
-        return "data:image/jpeg;base64," + base64.b64encode(buffered.getvalue()).decode()
-    except Exception as e:
-        print(f"Base64 error: {e}")
-        return ""
+def _decode_and_gate(contents: bytes):
+    """CPU stage: in-memory decode plus the blur/lighting and leaf (OOD) quality gates."""
+    # img_bgr is the shared 224x224 buffer reused by the gate, raw and DIP paths
+    img_bgr, ingest_info = decode_upload(contents, size=(224, 224))
+    if img_bgr is None:
+        raise HTTPException(status_code=400, detail="Invalid image file.")
+    gate = assess_quality(img_bgr)
+    return img_bgr, ingest_info, gate
 
-def _numpy_to_base64_gray(img_gray) -> str:
-    """Convert a grayscale numpy array to a JPEG base64 string."""
-    try:
-        pil_img = PILImage.fromarray(img_gray.astype(np.uint8), mode="L")
-        buffered = BytesIO()
-        pil_img.save(buffered, format="JPEG", quality=85)
-        return "data:image/jpeg;base64," + base64.b64encode(buffered.getvalue()).decode()
-    except Exception as e:
-        print(f"Base64 error: {e}")
-        return ""
+def _raw_model_input(img_bgr):
+    from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
+    img_rgb_raw = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+    return preprocess_input(img_rgb_raw.astype(np.float32))
+
+def _dip_model_input(img_bgr):
+    from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
+    segmented_rgb, final_mask, dip_prep_time, intermediate_masks = apply_production_dip(img_bgr)
+    dip_input = preprocess_input(segmented_rgb.astype(np.float32))
+    return segmented_rgb, dip_input, dip_prep_time, intermediate_masks
+
+async def _infer(head: str, x):
+    """Route through the dual-head model when loaded so raw and DIP inputs share one batch."""
+    if models_cache["dual"] is not None:
+        return (await inference_scheduler.predict("dual", x))[0 if head == "raw" else 1]
+    return await inference_scheduler.predict(head, x)
+
+async def _timed_infer(head: str, x):
+    """_infer plus its wall time in ms."""
+    t0 = time.time()
+    preds = await _infer(head, x)
+    return preds, (time.time() - t0) * 1000
+
+def _save_detection(db: Session, detection: Detection):
+    db.add(detection)
+    db.commit()
+    db.refresh(detection)
+    return detection
+
+def _replay_cached(cached, current_user, latitude, longitude, db: Session, request_start):
+    """Serve a cache hit: no image/model work, but the user still gets their own Detection row."""
+    response = copy.deepcopy(cached)
+    diagnostics = response["diagnostics"]
+    if diagnostics["inference_mode"] in ("NON_LEAF_REJECT", "LOW_CONFIDENCE_REJECT"):
+        response["id"] = str(uuid.uuid4())
+    else:
+        detection = _save_detection(db, Detection(
+            user_id=current_user.id,
+            disease_name=response["disease_name"],
+            confidence=response["confidence"],
+            latitude=latitude,
+            longitude=longitude,
+            spread_risk=response["spread_risk"],
+            severity=response["severity"],
+            timestamp=datetime.now()
+        ))
+        response["id"] = detection.id
+    response["user_id"] = current_user.id
+    diagnostics["cache_hit"] = True
+    diagnostics["latency_ms"] = {"total": round((time.time() - request_start) * 1000, 2)}
+    return response
 
 
 @router.post("/predict")
@@ -94,6 +260,7 @@ async def predict_adaptive(
     latitude: float = Form(None),
     longitude: float = Form(None),
     force_dip_ui: bool = Form(False),
+    inline_previews: bool = Form(PREDICT_INLINE_PREVIEWS),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -103,255 +270,357 @@ async def predict_adaptive(
     2. Suggests DIP if blurry or very poor lighting.
     3. Runs model_nodip. If confidence >= 0.75, accept.
     4. Else, runs optimized DIP pipeline + model_with_dip. Takes the best.
+    CPU-bound stages run on predict_pool; blocking I/O on the default threadpool.
+    DIP previews come back as /api/artifacts URLs; inline_previews=true also inlines them as base64.
     """
     request_start = time.time()
-    temp_file = f"temp_predict_{uuid.uuid4()}.jpg"
     
     try:
         contents = await file.read()
         if len(contents) > 10 * 1024 * 1024:
             raise HTTPException(status_code=413, detail="File too large.")
-        with open(temp_file, "wb") as buffer:
-            buffer.write(contents)
 
-        load_models()
-        raw_model = models_cache["raw"]
-        dip_model = models_cache["dip"]
-        
-        # 1. Read & Basic Checks
-        prep_t0 = time.time()
-        img_bgr = cv2.imread(temp_file)
-        if img_bgr is None:
-            raise HTTPException(status_code=400, detail="Invalid image file.")
+        async with predict_pool.admit():
+            # Model load and cache lookup only after admission: a saturated server answers
+            # 503 + Retry-After straight away instead of queueing for a pool worker first
+            if models_cache["raw"] is None or models_cache["dip"] is None:
+                await predict_pool.run(load_models)
+            cache_key = make_cache_key(
+                contents, model_fingerprint(),
+                force_dip_ui=force_dip_ui, latitude=latitude, longitude=longitude,
+                inline_previews=inline_previews,
+            )
+            cached = await run_in_threadpool(prediction_cache.get, cache_key)
+            if cached is None:
+                response = await _predict_admitted(
+                    contents, latitude, longitude, force_dip_ui, current_user, db, request_start, inline_previews
+                )
+        if cached is not None:
+            return await run_in_threadpool(
+                _replay_cached, cached, current_user, latitude, longitude, db, request_start
+            )
+        prediction_cache.put(cache_key, response)
+        return response
             
-        gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-        blur_variance = cv2.Laplacian(gray, cv2.CV_64F).var()
-        
-        # Calculate extreme pixels for brightness check
-        total_pixels = gray.size
-        dark_pixels = np.sum(gray < 40)
-        bright_pixels = np.sum(gray > 215)
-        perc_dark = (dark_pixels / total_pixels) * 100
-        perc_bright = (bright_pixels / total_pixels) * 100
-        
-        brightness = np.mean(gray) # keep for logging/diagnostics
-        
-        is_blurry = blur_variance < 100 # Adjust this based on validation dataset percentiles
-        is_bad_lighting = perc_dark > 20 or perc_bright > 20
-        force_dip = force_dip_ui or is_blurry or is_bad_lighting
-        
-        # Leaf Validation Stage (OOD Protection)
-        # Compute GLI-based green ratio on a small version of the image
-        small_img = resize_image(img_bgr, (64, 64))
-        b, g, r = cv2.split(small_img)
-        g_16 = g.astype(np.int16)
-        r_16 = r.astype(np.int16)
-        b_16 = b.astype(np.int16)
-        exg_small = 2 * g_16 - r_16 - b_16
-        green_pixels = np.sum(exg_small > 20)
-        green_ratio = green_pixels / (64 * 64)
-        
-        if green_ratio < 0.15:
-            # Graceful OOD Rejection
-            return {
-                "id": str(uuid.uuid4()),
-                "user_id": current_user.id,
-                "disease_name": "Non-Leaf Image",
-                "confidence": 0.0,
-                "latitude": latitude,
-                "longitude": longitude,
-                "spread_risk": "UNKNOWN",
-                "severity": "Unknown",
-                "treatment": "Image does not appear to contain a plant leaf. Please upload a clear photo of a leaf.",
-                "remedies": None,
-                "grad_cam_base64": None,
-                "diagnostics": {
-                    "inference_mode": "NON_LEAF_REJECT",
-                    "green_ratio": round(float(green_ratio), 4),
-                    "message": "Image does not appear to contain a plant leaf.",
-                    "latency_ms": {
-                        "total": round((time.time() - request_start) * 1000, 2)
-                    }
-                }
-            }
-        
-        from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
-
-        final_disease = "Unknown"
-        final_conf = 0.0
-        mode = "RAW_CONFIDENT"
-        mask_b64 = None
-        gli_b64 = None
-        lab_b64 = None
-        combined_b64 = None
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing other images. Please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        with open("error_log.txt", "w") as f:
+            f.write(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _resolve(raw_preds, dip_preds=None):
+    """
+    Decision logic shared by /predict and /predict-batch.
+    dip_preds is None when the DIP path was not needed.
+    """
+    raw_idx = np.argmax(raw_preds)
+    raw_conf = float(raw_preds[raw_idx])
+    
+    final_disease = get_class_name(raw_idx)
+    final_conf = raw_conf
+    mode = "RAW_CONFIDENT"
+    previews = None
+    dip_conf = 0.0
+    improvement = 0.0
+    
+    if dip_preds is not None:
+        dip_idx = np.argmax(dip_preds)
+        dip_conf = float(dip_preds[dip_idx])
+        dip_disease = get_class_name(dip_idx)
         
-        raw_idx = -1
-        raw_conf = 0.0
-        raw_disease = "Unknown"
-        raw_time = 0
-        dip_time = 0
-        dip_inf_time = 0
-        dip_conf = 0.0
-        improvement = 0.0
+        improvement = dip_conf - raw_conf
         
-        # If models missing, return mock
-        if not raw_model or not dip_model:
-            final_disease = "Tomato___Early_blight"
-            final_conf = 0.92
-            mode = "MOCK MODE (MODELS NOT FOUND)"
-            raw_conf = 0.85
+        if dip_conf > raw_conf + 0.10:
+            final_disease = dip_disease
+            final_conf = dip_conf
+            mode = "DIP_RECOVERY"
+            previews = "all"
+        elif dip_conf > raw_conf:
+            final_disease = dip_disease
+            final_conf = dip_conf
+            mode = "MINOR_IMPROVEMENT"
+            previews = "segmented"
         else:
-            # 2. Raw Inference
-            img_rgb_raw = resize_image(img_bgr, size=(224, 224))
-            img_rgb_raw = cv2.cvtColor(img_rgb_raw, cv2.COLOR_BGR2RGB)
-            raw_input = preprocess_input(img_rgb_raw.astype(np.float32))
-            raw_batch = np.expand_dims(raw_input, axis=0)
-            
-            inf_t0 = time.time()
-            raw_preds = raw_model.predict(raw_batch, verbose=0)[0]
-            raw_time = (time.time() - inf_t0) * 1000
-            
-            raw_idx = np.argmax(raw_preds)
-            raw_conf = float(raw_preds[raw_idx])
-            raw_disease = get_class_name(raw_idx)
-            
-            final_disease = raw_disease
-            final_conf = raw_conf
-            
-            # 3. Decision Logic -> Trigger DIP if needed
-            if force_dip or raw_conf < 0.75:
-                # Run highly-optimized DIP
-                segmented_rgb, final_mask, dip_prep_time, intermediate_masks = apply_production_dip(img_bgr)
-                dip_time = dip_prep_time
-                
-                dip_input = preprocess_input(segmented_rgb.astype(np.float32))
-                dip_batch = np.expand_dims(dip_input, axis=0)
-                
-                inf_t1 = time.time()
-                dip_preds = dip_model.predict(dip_batch, verbose=0)[0]
-                dip_inf_time = (time.time() - inf_t1) * 1000
-                
-                dip_idx = np.argmax(dip_preds)
-                dip_conf = float(dip_preds[dip_idx])
-                dip_disease = get_class_name(dip_idx)
-                
-                improvement = dip_conf - raw_conf
-                
-                if dip_conf > raw_conf + 0.10:
-                    final_disease = dip_disease
-                    final_conf = dip_conf
-                    mode = "DIP_RECOVERY"
-                    mask_b64 = _numpy_to_base64_rgb(segmented_rgb)
-                    gli_b64 = _numpy_to_base64_gray(intermediate_masks["gli"])
-                    lab_b64 = _numpy_to_base64_gray(intermediate_masks["lab"])
-                    combined_b64 = _numpy_to_base64_gray(intermediate_masks["combined"])
-                elif dip_conf > raw_conf:
-                    final_disease = dip_disease
-                    final_conf = dip_conf
-                    mode = "MINOR_IMPROVEMENT"
-                    mask_b64 = _numpy_to_base64_rgb(segmented_rgb)
-                else:
-                    mode = "RAW_BETTER" # Keep raw
-
-            # Case D: Both low confidence
-            if final_conf < 0.55:
-                mode = "LOW_CONFIDENCE_REJECT"
-                
-        prep_time = (time.time() - prep_t0) * 1000
-
-        # Create DB record (if not rejected)
-        risk = "UNKNOWN"
-        weather_insights = {
-            "risk_level": "UNKNOWN",
-            "temperature": 0.0,
-            "humidity": 0.0,
-            "condition_explanation": "Weather data unavailable."
+            mode = "RAW_BETTER" # Keep raw
+
+    # Case D: Both low confidence
+    if final_conf < 0.55:
+        mode = "LOW_CONFIDENCE_REJECT"
+
+    return {
+        "final_disease": final_disease,
+        "final_conf": final_conf,
+        "mode": mode,
+        "previews": previews,
+        "raw_conf": raw_conf,
+        "dip_conf": dip_conf,
+        "improvement": improvement,
+    }
+
+def _mock_result():
+    # If models missing, return mock
+    return {
+        "final_disease": "Tomato___Early_blight",
+        "final_conf": 0.92,
+        "mode": "MOCK MODE (MODELS NOT FOUND)",
+        "previews": None,
+        "raw_conf": 0.85,
+        "dip_conf": 0.0,
+        "improvement": 0.0,
+    }
+
+def _store_previews(previews, segmented_rgb, intermediate_masks):
+    """Artifact hashes of the DIP previews the mode shows. Nothing is encoded here."""
+    if previews == "all":
+        return {
+            "mask": artifact_store.put(segmented_rgb),
+            "gli": artifact_store.put(intermediate_masks["gli"]),
+            "lab": artifact_store.put(intermediate_masks["lab"]),
+            "combined": artifact_store.put(intermediate_masks["combined"]),
         }
-        if latitude is not None and longitude is not None:
-            crop_name = final_disease.split("___")[0].replace("_", " ") if "___" in final_disease else "Plant"
-            weather_insights = get_spread_risk(latitude, longitude, crop_name, final_disease)
-            risk = weather_insights.get("risk_level", "UNKNOWN")
-            
-        severity = determine_severity(final_conf)
-        
-        # Override values if low confidence reject
-        if mode == "LOW_CONFIDENCE_REJECT":
-            final_disease = "Low Confidence"
-            treatment_text = "Image quality too low for reliable diagnosis. Please retake photo with better lighting and focus."
-            remedy_data = None
-            detection_id = str(uuid.uuid4())
-        else:
-            detection = Detection(
-                user_id=current_user.id,
-                disease_name=final_disease,
-                confidence=final_conf,
-                latitude=latitude,
-                longitude=longitude,
-                spread_risk=risk,
-                severity=severity,
-                timestamp=datetime.now()
+    if previews == "segmented":
+        return {"mask": artifact_store.put(segmented_rgb)}
+    return {}
+
+def _inline_previews(artifacts):
+    """base64 data URIs of a result's previews, for clients that ask for inline_previews."""
+    return dict(zip(artifacts, artifact_store.data_uris(list(artifacts.values()))))
+
+def _preview_fields(artifacts, inline=None):
+    fields = {}
+    for name, (url_field, base64_field) in PREVIEW_FIELDS.items():
+        key = artifacts.get(name)
+        fields[url_field] = f"/api/artifacts/{key}" if key else None
+        fields[base64_field] = (inline or {}).get(name)
+    return fields
+
+async def _classify(img_bgr, force_dip):
+    """Raw model, then (if needed) DIP + DIP model. Returns the image-dependent result fields."""
+    raw_time = 0
+    dip_time = 0
+    dip_inf_time = 0
+    
+    if not models_cache["raw"] or not models_cache["dip"]:
+        result = _mock_result()
+    else:
+        # 2. Raw Inference
+        dip_stage = None
+        dip_preds = None
+        if force_dip:
+            # DIP is needed regardless of raw confidence: prepare both inputs and send them
+            # together (one batch of two through the shared trunk in dual-head mode)
+            raw_input, dip_stage = await asyncio.gather(
+                predict_pool.run(_raw_model_input, img_bgr),
+                predict_pool.run(_dip_model_input, img_bgr),
+            )
+            # Each time runs from the shared start to that model's own result
+            (raw_preds, raw_time), (dip_preds, dip_inf_time) = await asyncio.gather(
+                _timed_infer("raw", raw_input), _timed_infer("dip", dip_stage[1])
             )
-            db.add(detection)
-            db.commit()
-            db.refresh(detection)
-            detection_id = detection.id
-            remedy_data = get_remedy_for_disease(detection.disease_name)
-            treatment_text = " ".join(remedy_data["EN"]["treatment_steps"])
+        else:
+            raw_input = await predict_pool.run(_raw_model_input, img_bgr)
+            raw_preds, raw_time = await _timed_infer("raw", raw_input)
         
-        try:
-            total_latency = (time.time() - request_start) * 1000
-
-            return {
-                "id": detection_id,
-                "user_id": current_user.id,
-                "disease_name": final_disease,
-                "confidence": final_conf,
-                "latitude": latitude,
-                "longitude": longitude,
-                "spread_risk": risk,
-                "severity": severity,
-                "treatment": treatment_text,
-                "remedies": remedy_data,
-                "weather_insights": weather_insights,
-                "grad_cam_base64": "MOCKED_BASE64_FOR_DEMO",
-                # New Diagnostic Meta
-                "diagnostics": {
-                    "inference_mode": mode,
-                    "blur_variance": round(float(blur_variance), 2),
-                    "brightness": round(float(brightness), 2),
-                    "green_ratio": round(float(green_ratio), 4),
-                    "raw_confidence": round(float(raw_conf), 4),
-                    "dip_confidence": round(float(dip_conf), 4),
-                    "improvement_percent": round(float(improvement) * 100, 2),
-                    "mask_preview_base64": mask_b64,
-                    "gli_mask_base64": gli_b64,
-                    "lab_mask_base64": lab_b64,
-                    "combined_mask_base64": combined_b64,
-                    "latency_ms": {
-                        "preprocessing": round(float(prep_time), 2),
-                        "raw_inference": round(float(raw_time), 2),
-                        "dip_preprocessing": round(float(dip_time), 2),
-                        "dip_inference": round(float(dip_inf_time), 2),
-                        "total": round(float(total_latency), 2)
-                    }
-                }
+        # 3. Decision Logic -> Trigger DIP if needed
+        if dip_stage is None and float(np.max(raw_preds)) < 0.75:
+            # Run highly-optimized DIP
+            dip_stage = await predict_pool.run(_dip_model_input, img_bgr)
+            dip_preds, dip_inf_time = await _timed_infer("dip", dip_stage[1])
+
+        result = _resolve(raw_preds, dip_preds)
+        if dip_stage is not None:
+            segmented_rgb, _, dip_time, intermediate_masks = dip_stage
+            if result["previews"]:
+                result["artifacts"] = await predict_pool.run(
+                    _store_previews, result["previews"], segmented_rgb, intermediate_masks
+                )
+
+    result.update(raw_time=raw_time, dip_time=dip_time, dip_inf_time=dip_inf_time)
+    return result
+
+def _non_leaf_response(user_id, latitude, longitude, green_ratio, request_start):
+    # Graceful OOD Rejection
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "disease_name": "Non-Leaf Image",
+        "confidence": 0.0,
+        "latitude": latitude,
+        "longitude": longitude,
+        "spread_risk": "UNKNOWN",
+        "severity": "Unknown",
+        "treatment": "Image does not appear to contain a plant leaf. Please upload a clear photo of a leaf.",
+        "remedies": None,
+        "grad_cam_base64": None,
+        "diagnostics": {
+            "inference_mode": "NON_LEAF_REJECT",
+            "green_ratio": round(float(green_ratio), 4),
+            "message": "Image does not appear to contain a plant leaf.",
+            "latency_ms": {
+                "total": round((time.time() - request_start) * 1000, 2)
             }
-        except Exception as inner_e:
-            with open("error_log.txt", "w") as f:
-                import traceback
-                f.write(traceback.format_exc())
-            raise inner_e
+        }
+    }
+
+def _default_weather():
+    return {
+        "risk_level": "UNKNOWN",
+        "temperature": 0.0,
+        "humidity": 0.0,
+        "condition_explanation": "Weather data unavailable."
+    }
+
+def _crop_name(final_disease):
+    return final_disease.split("___")[0].replace("_", " ") if "___" in final_disease else "Plant"
+
+def _detection_outcome(result, current_user, latitude, longitude, risk):
+    """
+    Display name, severity, treatment and remedies for a result, plus the Detection row to
+    persist (None for low-confidence rejects, which are not recorded).
+    """
+    final_disease = result["final_disease"]
+    final_conf = result["final_conf"]
+    severity = determine_severity(final_conf)
+    
+    # Override values if low confidence reject
+    if result["mode"] == "LOW_CONFIDENCE_REJECT":
+        treatment_text = "Image quality too low for reliable diagnosis. Please retake photo with better lighting and focus."
+        return "Low Confidence", severity, treatment_text, None, None
+
+    detection = Detection(
+        user_id=current_user.id,
+        disease_name=final_disease,
+        confidence=final_conf,
+        latitude=latitude,
+        longitude=longitude,
+        spread_risk=risk,
+        severity=severity,
+        timestamp=datetime.now()
+    )
+    remedy_data = get_remedy_for_disease(final_disease)
+    treatment_text = " ".join(remedy_data["EN"]["treatment_steps"])
+    return final_disease, severity, treatment_text, remedy_data, detection
+
+def _build_response(detection_id, current_user, latitude, longitude, result, gate, outcome,
+                    risk, weather_insights, latency_ms, near_dup_distance=None, inline_previews=None):
+    display_disease, severity, treatment_text, remedy_data, _ = outcome
+    return {
+        "id": detection_id,
+        "user_id": current_user.id,
+        "disease_name": display_disease,
+        "confidence": result["final_conf"],
+        "latitude": latitude,
+        "longitude": longitude,
+        "spread_risk": risk,
+        "severity": severity,
+        "treatment": treatment_text,
+        "remedies": remedy_data,
+        "weather_insights": weather_insights,
+        "grad_cam_base64": "MOCKED_BASE64_FOR_DEMO",
+        # New Diagnostic Meta
+        "diagnostics": {
+            "inference_mode": result["mode"],
+            "blur_variance": round(float(gate["blur_variance"]), 2),
+            "brightness": round(float(gate["brightness"]), 2),
+            "green_ratio": round(float(gate["green_ratio"]), 4),
+            "raw_confidence": round(float(result["raw_conf"]), 4),
+            "dip_confidence": round(float(result["dip_conf"]), 4),
+            "improvement_percent": round(float(result["improvement"]) * 100, 2),
+            **_preview_fields(result.get("artifacts", {}), inline_previews),
+            "near_duplicate_distance": near_dup_distance,
+            "latency_ms": latency_ms
+        }
+    }
+
+def _latency_ms(ingest_info, prep_time, result, request_start):
+    return {
+        "decode": round(float(ingest_info["decode_ms"]), 2),
+        "preprocessing": round(float(prep_time), 2),
+        "raw_inference": round(float(result["raw_time"]), 2),
+        "dip_preprocessing": round(float(result["dip_time"]), 2),
+        "dip_inference": round(float(result["dip_inf_time"]), 2),
+        "total": round(float((time.time() - request_start) * 1000), 2)
+    }
+
+
+async def _predict_admitted(contents, latitude, longitude, force_dip_ui, current_user, db, request_start,
+                            inline_previews=False):
+    # 1. Decode once (in memory, reduced scale) & Basic Checks
+    prep_t0 = time.time()
+    img_bgr, ingest_info, gate = await predict_pool.run(_decode_and_gate, contents)
+    force_dip = force_dip_ui or gate["is_blurry"] or gate["is_bad_lighting"]
+    
+    if not gate["is_leaf"]:
+        return _non_leaf_response(current_user.id, latitude, longitude, gate["green_ratio"], request_start)
+
+    # Near-duplicate of this user's recent upload (recompressed / burst shot)? Reuse its result.
+    # Scoped per user: a hash match alone never hands one farmer's diagnosis to another
+    near_dup_distance = None
+    tag = (current_user.id, model_fingerprint(), bool(force_dip_ui))
+    # A hit whose previews have been evicted from the artifact store would answer with 404 URLs
+    match = await predict_pool.run(
+        near_duplicates.lookup, gate["dhash"], tag=tag,
+        accept=lambda cached: artifact_store.has_all(list(cached.get("artifacts", {}).values())),
+    )
+    if match is not None:
+        result, near_dup_distance = match
+        result.update(raw_time=0, dip_time=0, dip_inf_time=0)
+    else:
+        result = await _classify(img_bgr, force_dip)
+        near_duplicates.add(gate["dhash"], result, tag=tag)
             
-    except HTTPException:
-        raise
-    except Exception as e:
+    prep_time = (time.time() - prep_t0) * 1000
+
+    # Create DB record (if not rejected)
+    risk = "UNKNOWN"
+    weather_insights = _default_weather()
+    if latitude is not None and longitude is not None:
+        weather_insights = await run_in_threadpool(
+            get_spread_risk, latitude, longitude, _crop_name(result["final_disease"]), result["final_disease"]
+        )
+        risk = weather_insights.get("risk_level", "UNKNOWN")
+        
+    outcome = _detection_outcome(result, current_user, latitude, longitude, risk)
+    detection = outcome[4]
+    if detection is None:
+        detection_id = str(uuid.uuid4())
+    else:
+        detection = await run_in_threadpool(_save_detection, db, detection)
+        detection_id = detection.id
+    
+    inline = None
+    if inline_previews and result.get("artifacts"):
+        inline = await predict_pool.run(_inline_previews, result["artifacts"])
+
+    try:
+        return _build_response(
+            detection_id, current_user, latitude, longitude, result, gate, outcome, risk, weather_insights,
+            _latency_ms(ingest_info, prep_time, result, request_start), near_dup_distance, inline
+        )
+    except Exception as inner_e:
         with open("error_log.txt", "w") as f:
-            import traceback
             f.write(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+        raise inner_e
+
+
+@router.get("/predict-stats")
+async def predict_stats():
+    """Queue depth / wait time of the predict worker pool and inference batching stats."""
+    return {
+        "worker_pool": predict_pool.stats(),
+        "inference_batches": inference_scheduler.stats(),
+        "result_cache": prediction_cache.stats(),
+        "near_duplicates": near_duplicates.stats(),
+        "artifacts": artifact_store.stats(),
+    }
 
 
 @router.post("/predict-compare")
@@ -363,7 +632,6 @@ async def predict_compare_legacy(
     Legacy endpoint for Technical Analysis tab to show DIP stages.
     We return dummy stages rather than running KMeans/GrabCut in production.
     """
-    from fastapi import Response
     # In a fully refactored app, this endpoint might be removed or placed behind a 'debug' flag.
     # For now, return mock data to keep the frontend Technical Analysis tab from breaking.
     return {
@@ -0,0 +1,307 @@
+import os
+import io
+import time
+import uuid
+import asyncio
+import zipfile
+import zlib
+
+from fastapi import APIRouter, File, UploadFile, Depends, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+import numpy as np
+import cv2
+
+from ..db.session import get_db
+from ..db.models import User
+from ..core.dependencies import get_current_user
+from ..services.weather import get_spread_risk
+from ..services.ingest import decode_upload
+from ..services.worker_pool import QueueFullError
+from ..services.quality import assess_quality_batch
+from .predict import (
+    models_cache, load_models, predict_pool, inference_scheduler,
+    PREDICT_INLINE_PREVIEWS, _resolve, _mock_result, _store_previews, _inline_previews,
+    _non_leaf_response, _default_weather, _crop_name, _detection_outcome, _build_response,
+)
+from dip_module import apply_production_dip_batch
+
+router = APIRouter()
+
+PREDICT_BATCH_MAX_FILES = int(os.getenv("PREDICT_BATCH_MAX_FILES", "200"))
+MAX_FILE_BYTES = 10 * 1024 * 1024
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+# Raised while reading a truncated or corrupt .zip (bad directory, CRC or deflate stream)
+BAD_ARCHIVE_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError)
+
+
+def _iter_upload(filename, contents):
+    """
+    (filename, bytes) for one upload, or for each image inside it when it is a .zip archive.
+    Members are read one at a time as the caller advances; oversized images come back as
+    (filename, None). A corrupt archive raises one of BAD_ARCHIVE_ERRORS.
+    """
+    if not zipfile.is_zipfile(io.BytesIO(contents)):
+        yield filename, contents if len(contents) <= MAX_FILE_BYTES else None
+        return
+    with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if info.file_size > MAX_FILE_BYTES:
+                yield name, None
+                continue
+            yield name, archive.read(info)
+
+def _expand_uploads(uploads, max_files=PREDICT_BATCH_MAX_FILES):
+    """
+    (filename, bytes) pairs with any .zip archive replaced by the images it contains.
+    Oversized images come back as (filename, None). Stops expanding past max_files.
+    """
+    items = []
+    for filename, contents in uploads:
+        for item in _iter_upload(filename, contents):
+            items.append(item)
+            if len(items) > max_files:
+                return items
+    return items
+
+def _raw_model_inputs(images):
+    """Raw-model inputs for an (N, 224, 224, 3) BGR stack in one cvtColor / preprocess call."""
+    from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
+    n, h, w = images.shape[:3]
+    rgb = cv2.cvtColor(images.reshape(n * h, w, 3), cv2.COLOR_BGR2RGB).reshape(images.shape)
+    return preprocess_input(rgb.astype(np.float32))
+
+def _dip_model_inputs(images):
+    """
+    DIP stages for an (N, 224, 224, 3) BGR stack through the batch DIP pipeline, as
+    (segmented_rgb, dip_input, dip_prep_ms, masks) per image like _dip_model_input.
+    """
+    from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
+    segmented, _, dip_prep_time, masks = apply_production_dip_batch(images)
+    dip_inputs = preprocess_input(segmented.astype(np.float32))
+    return [
+        (segmented[k], dip_inputs[k], dip_prep_time / len(images), {name: m[k] for name, m in masks.items()})
+        for k in range(len(images))
+    ]
+
+def _predict_stack(key, x):
+    """
+    Predictions for a stacked batch, row by row through the inference scheduler so the
+    engine only ever runs on its worker thread (batches are capped by INFERENCE_MAX_BATCH_SIZE).
+    Blocks until every row is done: call it from a pool thread, not the event loop.
+    """
+    if models_cache["dual"] is not None:
+        head = 0 if key == "raw" else 1
+        futures = [inference_scheduler.submit("dual", row) for row in x]
+        return np.stack([f.result()[head] for f in futures])
+    futures = [inference_scheduler.submit(key, row) for row in x]
+    return np.stack([f.result() for f in futures])
+
+def _save_detections(db: Session, detections):
+    """Insert all Detection rows in a single transaction; returns their ids."""
+    db.add_all(detections)
+    db.flush()
+    ids = [d.id for d in detections]
+    db.commit()
+    return ids
+
+
+@router.post("/predict-batch")
+async def predict_batch(
+    files: list[UploadFile] = File(...),
+    latitude: float = Form(None),
+    longitude: float = Form(None),
+    force_dip_ui: bool = Form(False),
+    inline_previews: bool = Form(PREDICT_INLINE_PREVIEWS),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Multi-image variant of /predict for field surveys (many files, or one .zip).
+    Quality/OOD gates run vectorised over the whole stack, surviving images go through the
+    raw model as one batch, and only the DIP subset (forced or raw confidence < 0.75) gets
+    apply_production_dip + the DIP model as a second batch. All Detection rows are written
+    in one transaction. Each entry of `results` has the same shape as a /predict response;
+    its latency_ms amortises the batched stages over the images that went through them.
+    """
+    request_start = time.time()
+
+    uploads = [(f.filename, await f.read()) for f in files]
+
+    try:
+        async with predict_pool.admit():
+            # Unpacking is CPU work too: it runs on the pool, after admission
+            try:
+                items = await predict_pool.run(_expand_uploads, uploads)
+            except BAD_ARCHIVE_ERRORS:
+                raise HTTPException(status_code=400, detail="Invalid or corrupt zip archive.")
+            if len(items) > PREDICT_BATCH_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Too many images (max {PREDICT_BATCH_MAX_FILES}).")
+            return await _predict_batch_admitted(
+                items, latitude, longitude, force_dip_ui, current_user, db, request_start,
+                inline_previews=inline_previews
+            )
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing other images. Please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        with open("error_log.txt", "w") as f:
+            import traceback
+            f.write(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _predict_batch_admitted(items, latitude, longitude, force_dip_ui, current_user, db, request_start,
+                                  pool=predict_pool, inline_previews=False):
+    await pool.run(load_models)
+    results = [None] * len(items)
+
+    # 1. Decode every upload (in parallel across the pool)
+    decode_t0 = time.time()
+    decoded = await asyncio.gather(*(
+        pool.run(decode_upload, contents, (224, 224)) for _, contents in items if contents is not None
+    ))
+    decode_iter = iter(decoded)
+    valid, images, ingest_infos = [], [], []
+    for i, (filename, contents) in enumerate(items):
+        if contents is None:
+            results[i] = {"filename": filename, "error": "File too large."}
+            continue
+        img_bgr, ingest_info = next(decode_iter)
+        if img_bgr is None:
+            results[i] = {"filename": filename, "error": "Invalid image file."}
+            continue
+        valid.append(i)
+        images.append(img_bgr)
+        ingest_infos.append(ingest_info)
+    decode_ms = (time.time() - decode_t0) * 1000
+
+    if not valid:
+        return {"count": len(items), "results": results, "latency_ms": {"total": round((time.time() - request_start) * 1000, 2)}}
+
+    # 2. Quality + OOD gates, each on one small level of its frame
+    prep_t0 = time.time()
+    stack = np.stack(images)
+    gates = await pool.run(assess_quality_batch, stack)
+
+    leaf = [k for k, gate in enumerate(gates) if gate["is_leaf"]]
+    for k, gate in enumerate(gates):
+        if not gate["is_leaf"]:
+            response = _non_leaf_response(current_user.id, latitude, longitude, gate["green_ratio"], request_start)
+            results[valid[k]] = {"filename": items[valid[k]][0], **response}
+
+    raw_ms = dip_prep_ms = dip_ms = 0.0
+    leaf_results = {}
+    dip_subset = []
+    if leaf and (not models_cache["raw"] or not models_cache["dip"]):
+        leaf_results = {k: _mock_result() for k in leaf}
+    elif leaf:
+        # 3. Raw model: every surviving image in one batch
+        raw_inputs = await pool.run(_raw_model_inputs, stack[leaf])
+        inf_t0 = time.time()
+        raw_preds = await pool.run(_predict_stack, "raw", raw_inputs)
+        raw_ms = (time.time() - inf_t0) * 1000
+
+        # 4. DIP only for the forced / low-confidence subset, as a second batch
+        dip_subset = [
+            j for j, k in enumerate(leaf)
+            if force_dip_ui or gates[k]["is_blurry"] or gates[k]["is_bad_lighting"] or float(np.max(raw_preds[j])) < 0.75
+        ]
+        dip_stages = {}
+        dip_preds = {}
+        if dip_subset:
+            dip_t0 = time.time()
+            stages = await pool.run(_dip_model_inputs, stack[[leaf[j] for j in dip_subset]])
+            dip_prep_ms = (time.time() - dip_t0) * 1000
+            dip_stages = dict(zip(dip_subset, stages))
+
+            inf_t1 = time.time()
+            preds = await pool.run(_predict_stack, "dip", np.stack([s[1] for s in stages]))
+            dip_ms = (time.time() - inf_t1) * 1000
+            dip_preds = dict(zip(dip_subset, preds))
+
+        for j, k in enumerate(leaf):
+            leaf_results[k] = _resolve(raw_preds[j], dip_preds.get(j))
+
+        # Previews for the DIP modes that show them go to the artifact store (served by URL)
+        to_store = [j for j in dip_subset if leaf_results[leaf[j]]["previews"]]
+        stored = await asyncio.gather(*(
+            pool.run(_store_previews, leaf_results[leaf[j]]["previews"], dip_stages[j][0], dip_stages[j][3])
+            for j in to_store
+        ))
+        for j, artifacts in zip(to_store, stored):
+            leaf_results[leaf[j]]["artifacts"] = artifacts
+
+    dip_set = set(dip_subset)
+    for j, k in enumerate(leaf):
+        in_dip = j in dip_set
+        leaf_results[k].update(
+            raw_time=raw_ms / len(leaf),
+            dip_time=dip_prep_ms / len(dip_subset) if in_dip else 0,
+            dip_inf_time=dip_ms / len(dip_subset) if in_dip else 0,
+        )
+    prep_ms = (time.time() - prep_t0) * 1000
+
+    # 5. Weather once per distinct diagnosis (same location for the whole batch)
+    weather = {}
+    if latitude is not None and longitude is not None:
+        diseases = sorted({leaf_results[k]["final_disease"] for k in leaf})
+        insights = await asyncio.gather(*(
+            run_in_threadpool(get_spread_risk, latitude, longitude, _crop_name(d), d) for d in diseases
+        ))
+        weather = dict(zip(diseases, insights))
+
+    # 6. Outcomes + all Detection rows in one transaction
+    outcomes = {}
+    for k in leaf:
+        weather_insights = weather.get(leaf_results[k]["final_disease"], _default_weather())
+        risk = weather_insights.get("risk_level", "UNKNOWN")
+        outcomes[k] = (_detection_outcome(leaf_results[k], current_user, latitude, longitude, risk), risk, weather_insights)
+    persisted = [k for k in leaf if outcomes[k][0][4] is not None]
+    ids = await run_in_threadpool(_save_detections, db, [outcomes[k][0][4] for k in persisted]) if persisted else []
+    detection_ids = dict(zip(persisted, ids))
+
+    inline = {}
+    if inline_previews:
+        with_artifacts = [k for k in leaf if leaf_results[k].get("artifacts")]
+        encoded = await asyncio.gather(*(pool.run(_inline_previews, leaf_results[k]["artifacts"]) for k in with_artifacts))
+        inline = dict(zip(with_artifacts, encoded))
+
+    total_ms = (time.time() - request_start) * 1000
+    for k in leaf:
+        outcome, risk, weather_insights = outcomes[k]
+        result = leaf_results[k]
+        latency_ms = {
+            "decode": round(float(ingest_infos[k]["decode_ms"]), 2),
+            "preprocessing": round(float(prep_ms / len(leaf)), 2),
+            "raw_inference": round(float(result["raw_time"]), 2),
+            "dip_preprocessing": round(float(result["dip_time"]), 2),
+            "dip_inference": round(float(result["dip_inf_time"]), 2),
+            "total": round(float(total_ms / len(valid)), 2)
+        }
+        response = _build_response(
+            detection_ids.get(k, str(uuid.uuid4())), current_user, latitude, longitude, result, gates[k],
+            outcome, risk, weather_insights, latency_ms, inline_previews=inline.get(k)
+        )
+        results[valid[k]] = {"filename": items[valid[k]][0], **response}
+
+    return {
+        "count": len(items),
+        "results": results,
+        "latency_ms": {
+            "decode": round(decode_ms, 2),
+            "preprocessing": round(prep_ms, 2),
+            "raw_inference": round(raw_ms, 2),
+            "dip_preprocessing": round(dip_prep_ms, 2),
+            "dip_inference": round(dip_ms, 2),
+            "total": round(total_ms, 2)
+        }
+    }
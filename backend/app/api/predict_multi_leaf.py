@@ -0,0 +1,214 @@
+import os
+import time
+import uuid
+from collections import defaultdict
+
+from fastapi import APIRouter, File, UploadFile, Depends, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+import numpy as np
+import cv2
+
+from ..db.session import get_db
+from ..db.models import User
+from ..core.dependencies import get_current_user
+from ..services.weather import get_spread_risk
+from ..services.ingest import decode_native
+from ..services.worker_pool import QueueFullError
+from ..services.quality import assess_quality
+from .predict import (
+    models_cache, load_models, predict_pool, determine_severity,
+    _resolve, _mock_result, _non_leaf_response, _default_weather, _crop_name, _detection_outcome,
+    _build_response, _save_detection,
+)
+from .predict_batch import _raw_model_inputs, _dip_model_inputs, _predict_stack, MAX_FILE_BYTES
+from dip_module import find_leaf_regions
+
+router = APIRouter()
+
+MULTI_LEAF_MAX_LEAVES = int(os.getenv("MULTI_LEAF_MAX_LEAVES", "8"))  # crops per forward pass, bounds latency
+MULTI_LEAF_MIN_AREA = float(os.getenv("MULTI_LEAF_MIN_AREA", "0.02"))  # fraction of the frame
+MULTI_LEAF_DECODE_SIDE = int(os.getenv("MULTI_LEAF_DECODE_SIDE", "0"))  # 0 = full resolution
+
+
+def _decode_and_locate(contents: bytes):
+    """
+    CPU stage: native-resolution decode, the quality gates on the 224 frame, and the leaf
+    regions cropped out of the native image and resized to the model's input size.
+    """
+    native, ingest_info = decode_native(contents, target=MULTI_LEAF_DECODE_SIDE or None)
+    if native is None:
+        raise HTTPException(status_code=400, detail="Invalid image file.")
+    frame = cv2.resize(native, (224, 224), interpolation=cv2.INTER_AREA)
+    gate = assess_quality(frame)
+    regions, found = find_leaf_regions(native, MULTI_LEAF_MIN_AREA, MULTI_LEAF_MAX_LEAVES)
+    if not regions:
+        # No component is big enough on its own: classify the whole frame, as /predict would
+        h, w = native.shape[:2]
+        regions = [{"bbox": (0, 0, w, h), "area_fraction": 1.0}]
+    crops = np.stack([
+        cv2.resize(native[y:y + h, x:x + w], (224, 224), interpolation=cv2.INTER_AREA)
+        for x, y, w, h in (r["bbox"] for r in regions)
+    ])
+    return crops, regions, found, ingest_info, gate
+
+def _is_healthy(disease):
+    return disease.endswith("healthy")
+
+def _aggregate(leaf_results):
+    """
+    Image-level diagnosis from the per-leaf results. Confident leaves vote with their
+    confidence; a disease seen on any confident leaf outranks "healthy", since one diseased
+    leaf is what the farmer needs to act on. Same shape as a _resolve result.
+    """
+    confident = [r for r in leaf_results if r["mode"] != "LOW_CONFIDENCE_REJECT"]
+    if not confident:
+        best = max(leaf_results, key=lambda r: r["final_conf"])
+        return {**best, "previews": None, "mode": "LOW_CONFIDENCE_REJECT", "votes": {}}
+
+    voters = [r for r in confident if not _is_healthy(r["final_disease"])] or confident
+    votes = defaultdict(float)
+    for r in voters:
+        votes[r["final_disease"]] += r["final_conf"]
+    disease = max(votes, key=votes.get)
+    agreeing = [r for r in voters if r["final_disease"] == disease]
+    return {
+        "final_disease": disease,
+        "final_conf": float(np.mean([r["final_conf"] for r in agreeing])),
+        "mode": "MULTI_LEAF",
+        "previews": None,
+        "raw_conf": float(np.mean([r["raw_conf"] for r in agreeing])),
+        "dip_conf": float(np.mean([r["dip_conf"] for r in agreeing])),
+        "improvement": float(np.mean([r["improvement"] for r in agreeing])),
+        "votes": {d: round(v, 4) for d, v in sorted(votes.items(), key=lambda kv: -kv[1])},
+    }
+
+def _leaf_entry(region, result):
+    return {
+        "bbox": list(region["bbox"]),
+        "area_fraction": round(float(region["area_fraction"]), 4),
+        "disease_name": result["final_disease"] if result["mode"] != "LOW_CONFIDENCE_REJECT" else "Low Confidence",
+        "confidence": round(float(result["final_conf"]), 4),
+        "severity": determine_severity(result["final_conf"]),
+        "inference_mode": result["mode"],
+        "raw_confidence": round(float(result["raw_conf"]), 4),
+        "dip_confidence": round(float(result["dip_conf"]), 4),
+    }
+
+
+@router.post("/predict-multi-leaf")
+async def predict_multi_leaf(
+    file: UploadFile = File(...),
+    latitude: float = Form(None),
+    longitude: float = Form(None),
+    force_dip_ui: bool = Form(False),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Multi-leaf variant of /predict for photos of a branch or several leaves.
+    Every leaf-sized connected component of the DIP mask (up to MULTI_LEAF_MAX_LEAVES,
+    largest first) is cropped at native resolution; the crops go through the raw model as
+    one batch and the forced / low-confidence subset through DIP + the DIP model as a second.
+    Returns a /predict-shaped response for the aggregate diagnosis (one Detection row) plus
+    `leaves`, the per-leaf results with their bounding boxes in the uploaded image.
+    """
+    request_start = time.time()
+
+    try:
+        contents = await file.read()
+        if len(contents) > MAX_FILE_BYTES:
+            raise HTTPException(status_code=413, detail="File too large.")
+
+        async with predict_pool.admit():
+            await predict_pool.run(load_models)
+            return await _predict_multi_leaf_admitted(
+                contents, latitude, longitude, force_dip_ui, current_user, db, request_start
+            )
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing other images. Please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        with open("error_log.txt", "w") as f:
+            import traceback
+            f.write(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _predict_multi_leaf_admitted(contents, latitude, longitude, force_dip_ui, current_user, db, request_start):
+    # 1. Decode at native resolution, gate the whole frame, locate and crop the leaves
+    prep_t0 = time.time()
+    crops, regions, found, ingest_info, gate = await predict_pool.run(_decode_and_locate, contents)
+    # Several small leaves can sit under the whole-frame green ratio; leaf-sized components count too
+    if not gate["is_leaf"] and not found:
+        return _non_leaf_response(current_user.id, latitude, longitude, gate["green_ratio"], request_start)
+
+    raw_ms = dip_prep_ms = dip_ms = 0.0
+    if not models_cache["raw"] or not models_cache["dip"]:
+        leaf_results = [_mock_result() for _ in regions]
+    else:
+        # 2. Raw model: every crop in one forward pass
+        raw_inputs = await predict_pool.run(_raw_model_inputs, crops)
+        inf_t0 = time.time()
+        raw_preds = await predict_pool.run(_predict_stack, "raw", raw_inputs)
+        raw_ms = (time.time() - inf_t0) * 1000
+
+        # 3. DIP + DIP model for the forced / low-confidence crops, as a second batch
+        force_dip = force_dip_ui or gate["is_blurry"] or gate["is_bad_lighting"]
+        dip_subset = [j for j in range(len(regions)) if force_dip or float(np.max(raw_preds[j])) < 0.75]
+        dip_preds = {}
+        if dip_subset:
+            dip_t0 = time.time()
+            stages = await predict_pool.run(_dip_model_inputs, crops[dip_subset])
+            dip_prep_ms = (time.time() - dip_t0) * 1000
+            inf_t1 = time.time()
+            preds = await predict_pool.run(_predict_stack, "dip", np.stack([s[1] for s in stages]))
+            dip_ms = (time.time() - inf_t1) * 1000
+            dip_preds = dict(zip(dip_subset, preds))
+        leaf_results = [_resolve(raw_preds[j], dip_preds.get(j)) for j in range(len(regions))]
+
+    result = _aggregate(leaf_results)
+    result.update(raw_time=raw_ms, dip_time=dip_prep_ms, dip_inf_time=dip_ms)
+    prep_time = (time.time() - prep_t0) * 1000
+
+    # 4. Weather and the Detection row for the aggregate diagnosis, as in /predict
+    risk = "UNKNOWN"
+    weather_insights = _default_weather()
+    if latitude is not None and longitude is not None:
+        weather_insights = await run_in_threadpool(
+            get_spread_risk, latitude, longitude, _crop_name(result["final_disease"]), result["final_disease"]
+        )
+        risk = weather_insights.get("risk_level", "UNKNOWN")
+
+    outcome = _detection_outcome(result, current_user, latitude, longitude, risk)
+    detection = outcome[4]
+    if detection is None:
+        detection_id = str(uuid.uuid4())
+    else:
+        detection = await run_in_threadpool(_save_detection, db, detection)
+        detection_id = detection.id
+
+    latency_ms = {
+        "decode": round(float(ingest_info["decode_ms"]), 2),
+        "preprocessing": round(float(prep_time), 2),
+        "raw_inference": round(float(raw_ms), 2),
+        "dip_preprocessing": round(float(dip_prep_ms), 2),
+        "dip_inference": round(float(dip_ms), 2),
+        "total": round(float((time.time() - request_start) * 1000), 2)
+    }
+    response = _build_response(
+        detection_id, current_user, latitude, longitude, result, gate, outcome, risk, weather_insights, latency_ms
+    )
+    response["leaves"] = [_leaf_entry(region, r) for region, r in zip(regions, leaf_results)]
+    response["diagnostics"].update(
+        leaf_count=len(regions),
+        leaves_found=found,
+        leaves_capped=found > len(regions),
+        leaf_votes=result["votes"],
+    )
+    return response
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, Text, DateTime, ForeignKey
 from sqlalchemy.orm import relationship
 from .session import Base
 from datetime import datetime
@@ -28,3 +28,37 @@ class Detection(Base):
     severity = Column(String, nullable=True) # Mild, Moderate, Severe, Unknown
 
     user = relationship("User", back_populates="detections")
+
+class BulkJob(Base):
+    __tablename__ = "bulk_jobs"
+
+    id = Column(String, primary_key=True, index=True) # uuid4 hex
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    status = Column(String, index=True, default="queued") # queued, running, completed, cancelled
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0) # finished items (results + errors), also the last result_seq
+    failed = Column(Integer, default=0)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    force_dip = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.now, index=True)
+    updated_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+
+    items = relationship("BulkJobItem", back_populates="job")
+
+class BulkJobItem(Base):
+    __tablename__ = "bulk_job_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, ForeignKey("bulk_jobs.id"), index=True)
+    seq = Column(Integer) # position in the submitted upload
+    filename = Column(String)
+    path = Column(String, nullable=True) # staged image bytes, removed once processed
+    status = Column(String, index=True, default="queued") # queued, running, done, error, cancelled
+    claim_token = Column(String, nullable=True, index=True)
+    claimed_at = Column(DateTime, nullable=True)
+    result_seq = Column(Integer, nullable=True, index=True) # completion order within the job
+    result = Column(Text, nullable=True) # JSON, same shape as a /predict-batch entry
+
+    job = relationship("BulkJob", back_populates="items")
@@ -1,12 +1,17 @@
 import os
+import asyncio
 import logging
+import threading
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .api import predict, history, heatmap, auth, chat, tts
+from .api import predict, predict_batch, predict_multi_leaf, jobs, artifacts, history, heatmap, auth, chat, tts
 from .db.session import engine
 from .db import models
 
@@ -21,7 +26,24 @@ logger = logging.getLogger("cropsense")
 # Create tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="CropSense AI")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load + warm the models in the background: "/" answers as a liveness probe right away,
+    # while "/ready" stays 503 until warmup has finished.
+    stop_warmup = threading.Event()
+    warmup_task = asyncio.create_task(run_in_threadpool(predict.warmup_models, stop=stop_warmup))
+    stop_bulk_worker = asyncio.Event()
+    bulk_worker = asyncio.create_task(jobs.run_worker(stop_bulk_worker)) if jobs.BULK_JOB_IN_PROCESS else None
+    yield
+    if not warmup_task.done():
+        # Cancelling only drops the await: the flag stops the threadpool warmup itself
+        stop_warmup.set()
+        warmup_task.cancel()
+    if bulk_worker is not None:
+        stop_bulk_worker.set()
+        await bulk_worker
+
+app = FastAPI(title="CropSense AI", lifespan=lifespan)
 
 frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
 # In FastAPI, you CANNOT use wildcard origins `["*"]` with allow_credentials=True.
@@ -35,6 +57,10 @@ app.add_middleware(
 
 app.include_router(auth.router, prefix="/api/auth")
 app.include_router(predict.router, prefix="/api")
+app.include_router(predict_batch.router, prefix="/api")
+app.include_router(predict_multi_leaf.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
+app.include_router(artifacts.router, prefix="/api")
 app.include_router(history.router, prefix="/api")
 app.include_router(heatmap.router, prefix="/api")
 app.include_router(chat.router, prefix="/api")
@@ -43,3 +69,8 @@ app.include_router(tts.router, prefix="/api")
 @app.get("/")
 def health_check():
     return {"status": "ok", "message": "CropSense AI Backend is running"}
+
+@app.get("/ready")
+def readiness_check():
+    status_code = 200 if predict.model_status["ready"] else 503
+    return JSONResponse(status_code=status_code, content=predict.model_status)
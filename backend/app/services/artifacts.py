@@ -0,0 +1,175 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .encoders import ENCODER_VERSION, MEDIA_TYPES, encode_many, to_data_uri
+
+logger = logging.getLogger("cropsense.artifacts")
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(BASE_DIR, "artifacts"))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_MB", "512")) * 1024 * 1024
+
+# Part of every artifact hash: changing how previews are encoded yields new URLs, so the
+# immutable cache headers on old ones stay truthful.
+ARTIFACT_ENCODING = ENCODER_VERSION
+ENCODED_EXTENSIONS = tuple(MEDIA_TYPES)  # .png (masks), .webp (RGB previews)
+EXTENSION_FOR = {media_type: ext for ext, media_type in MEDIA_TYPES.items()}
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for diagnostic preview images (DIP masks, segmented leaf).
+    put() only hashes the pixels and writes them raw; the image is encoded (1-bit PNG for
+    masks, WebP for RGB, see encoders.py) on the first get() and kept in place of the raw
+    array. Disk usage is bounded by evicting the least recently used artifacts; the bound
+    is per process when several workers share `root`.
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, max_bytes=ARTIFACT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self._index = OrderedDict()  # hash -> bytes on disk
+        self._total = 0
+        self._lock = threading.Lock()
+        self._counters = {"puts": 0, "encodes": 0, "hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key[:2], f"{key}{ext}")
+
+    def _exists(self, key):
+        return any(os.path.exists(self._path(key, ext)) for ext in (".npy",) + ENCODED_EXTENSIONS)
+
+    def _read_encoded(self, key):
+        for ext in ENCODED_EXTENSIONS:
+            try:
+                with open(self._path(key, ext), "rb") as f:
+                    return f.read(), MEDIA_TYPES[ext]
+            except OSError:
+                continue
+        return None
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _scan(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                key, ext = os.path.splitext(name)
+                if ext == ".npy" or ext in ENCODED_EXTENSIONS:
+                    path = os.path.join(dirpath, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(files):
+            self._index[key] = self._index.get(key, 0) + size
+            self._total += size
+
+    def _track(self, key, size):
+        self._total += size - self._index.get(key, 0)
+        self._index[key] = size
+        self._index.move_to_end(key)
+        while self._total > self.max_bytes and len(self._index) > 1:
+            old_key, old_size = self._index.popitem(last=False)
+            self._total -= old_size
+            self._counters["evictions"] += 1
+            for ext in (".npy",) + ENCODED_EXTENSIONS:
+                try:
+                    os.remove(self._path(old_key, ext))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def key_for(array) -> str:
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        h = hashlib.sha256(f"{ARTIFACT_ENCODING}|{array.shape}|".encode())
+        h.update(array.data)
+        return h.hexdigest()
+
+    def put(self, array) -> str:
+        """Store an image array (H, W) or (H, W, 3) uint8 and return its content hash."""
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        key = self.key_for(array)
+        with self._lock:
+            self._counters["puts"] += 1
+            known = key in self._index
+        if known and self._exists(key):
+            with self._lock:
+                self._index.move_to_end(key)
+            return key
+        path = self._path(key, ".npy")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._track(key, os.path.getsize(path))
+        return key
+
+    def has_all(self, keys):
+        """Whether every key is still stored (not evicted); if so they count as recently used."""
+        if not all(self._exists(key) for key in keys):
+            return False
+        with self._lock:
+            for key in keys:
+                if key in self._index:
+                    self._index.move_to_end(key)
+        return True
+
+    def get_many(self, keys):
+        """
+        (bytes, media type) per key, None if unknown or evicted. Artifacts fetched for the
+        first time are encoded together in parallel and the encoded file replaces the raw one.
+        """
+        found = {key: self._read_encoded(key) for key in keys}
+        raw = {}
+        for key in keys:
+            if found[key] is None and key not in raw:
+                try:
+                    raw[key] = np.load(self._path(key, ".npy"))
+                except (OSError, ValueError):
+                    found[key] = self._read_encoded(key)  # encoded concurrently by another request
+        if raw:
+            for key, (data, media_type) in zip(raw, encode_many(list(raw.values()))):
+                self._write(self._path(key, EXTENSION_FOR[media_type]), data)
+                try:
+                    os.remove(self._path(key, ".npy"))
+                except OSError:
+                    pass
+                found[key] = (data, media_type)
+
+        with self._lock:
+            self._counters["encodes"] += len(raw)
+            for key in keys:
+                if found[key] is None:
+                    self._counters["misses"] += 1
+                else:
+                    self._counters["hits"] += 1
+                    self._track(key, len(found[key][0]))
+        return [found[key] for key in keys]
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def data_uris(self, keys):
+        """Inline form of artifacts for clients that still expect base64 previews."""
+        return [None if item is None else to_data_uri(*item) for item in self.get_many(keys)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                "entries": len(self._index),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+            }
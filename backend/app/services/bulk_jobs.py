@@ -0,0 +1,263 @@
+import os
+import json
+import uuid
+import time
+import shutil
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from fastapi.concurrency import run_in_threadpool
+
+from ..db.session import SessionLocal
+from ..db.models import BulkJob, BulkJobItem
+
+logger = logging.getLogger("cropsense.bulk_jobs")
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+BULK_JOB_DIR = os.getenv("BULK_JOB_DIR", os.path.join(BASE_DIR, "bulk_jobs"))  # staged uploads
+BULK_JOB_CHUNK = int(os.getenv("BULK_JOB_CHUNK", "16"))  # images claimed per worker step
+BULK_JOB_POLL_S = float(os.getenv("BULK_JOB_POLL_S", "1.0"))
+BULK_JOB_STALE_S = float(os.getenv("BULK_JOB_STALE_S", "600"))  # running items older than this are requeued
+
+FINISHED_JOB_STATES = ("completed", "cancelled")
+
+
+def stage_item(job_id: str, seq: int, contents: bytes) -> str:
+    """Write one upload to the job's staging directory and return its path."""
+    job_dir = os.path.join(BULK_JOB_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, f"{seq:06d}")
+    with open(path, "wb") as f:
+        f.write(contents)
+    return path
+
+def discard_staging(job_id: str):
+    """Remove a job's staging directory and everything staged in it."""
+    shutil.rmtree(os.path.join(BULK_JOB_DIR, job_id), ignore_errors=True)
+
+def _remove_staged(path):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def create_job(job_id, user_id, items, latitude=None, longitude=None, force_dip=False):
+    """
+    Persist a job and its items. `items` is a list of (filename, path, error) where
+    error is None for staged images; rejected uploads are recorded as finished errors.
+    """
+    db = SessionLocal()
+    try:
+        job = BulkJob(
+            id=job_id, user_id=user_id, status="queued", total=len(items), processed=0, failed=0,
+            latitude=latitude, longitude=longitude, force_dip=force_dip
+        )
+        db.add(job)
+        rows = []
+        for seq, (filename, path, error) in enumerate(items):
+            row = BulkJobItem(job_id=job_id, seq=seq, filename=filename, path=path)
+            if error is not None:
+                job.processed += 1
+                job.failed += 1
+                row.status = "error"
+                row.result_seq = job.processed
+                row.result = json.dumps({"filename": filename, "error": error})
+            rows.append(row)
+        if job.processed == job.total:
+            job.status = "completed"
+            job.finished_at = datetime.now()
+        db.add_all(rows)
+        db.commit()
+    finally:
+        db.close()
+
+def job_status(job: BulkJob):
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "processed": job.processed,
+        "failed": job.failed,
+        "progress": round(job.processed / job.total, 4) if job.total else 1.0,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+
+def fetch_results(job_id, after_seq, limit=500):
+    """Finished items with result_seq > after_seq, in completion order, as parsed JSON."""
+    db = SessionLocal()
+    try:
+        rows = db.query(BulkJobItem.result_seq, BulkJobItem.seq, BulkJobItem.result).filter(
+            BulkJobItem.job_id == job_id, BulkJobItem.result_seq > after_seq
+        ).order_by(BulkJobItem.result_seq).limit(limit).all()
+        job = db.get(BulkJob, job_id)
+        # A cancelled job is only drained once the chunks workers had already claimed are stored
+        finished = job is None or (job.status in FINISHED_JOB_STATES and db.query(BulkJobItem.id).filter(
+            BulkJobItem.job_id == job_id, BulkJobItem.status == "running"
+        ).first() is None)
+        return [(result_seq, seq, json.loads(result)) for result_seq, seq, result in rows], finished
+    finally:
+        db.close()
+
+def cancel_job(job_id):
+    """Cancel the queued remainder of a job. Items already claimed by a worker still finish."""
+    db = SessionLocal()
+    try:
+        job = db.get(BulkJob, job_id)
+        if job is None or job.status in FINISHED_JOB_STATES:
+            return
+        queued = db.query(BulkJobItem).filter(BulkJobItem.job_id == job_id, BulkJobItem.status == "queued").all()
+        for item in queued:
+            _remove_staged(item.path)
+            item.status = "cancelled"
+            item.path = None
+        job.status = "cancelled"
+        job.updated_at = job.finished_at = datetime.now()
+        running = db.query(BulkJobItem.id).filter(
+            BulkJobItem.job_id == job_id, BulkJobItem.status == "running"
+        ).first()
+        db.commit()
+    finally:
+        db.close()
+    if running is None:
+        discard_staging(job_id)
+
+
+def requeue_stale(stale_s=BULK_JOB_STALE_S):
+    """Put items left 'running' by a worker that died back in the queue."""
+    db = SessionLocal()
+    try:
+        cutoff = datetime.now() - timedelta(seconds=stale_s)
+        count = db.query(BulkJobItem).filter(
+            BulkJobItem.status == "running", BulkJobItem.claimed_at < cutoff
+        ).update({"status": "queued", "claim_token": None, "claimed_at": None}, synchronize_session=False)
+        db.commit()
+        if count:
+            logger.warning(f"Requeued {count} stale bulk job items")
+        return count
+    finally:
+        db.close()
+
+def claim_items(limit=BULK_JOB_CHUNK):
+    """
+    Atomically claim up to `limit` queued items of the oldest active job.
+    The status re-check in the UPDATE makes concurrent claims from several worker
+    processes safe: a row taken by someone else is simply not claimed here.
+    Returns (job dict, [(item_id, filename, path)]) or (None, []).
+    """
+    db = SessionLocal()
+    try:
+        first = db.query(BulkJobItem.job_id).join(BulkJob).filter(
+            BulkJobItem.status == "queued", BulkJob.status.in_(("queued", "running"))
+        ).order_by(BulkJob.created_at, BulkJobItem.id).first()
+        if first is None:
+            return None, []
+        job_id = first[0]
+        ids = [item_id for (item_id,) in db.query(BulkJobItem.id).filter(
+            BulkJobItem.job_id == job_id, BulkJobItem.status == "queued"
+        ).order_by(BulkJobItem.id).limit(limit)]
+
+        token = uuid.uuid4().hex
+        db.query(BulkJobItem).filter(BulkJobItem.id.in_(ids), BulkJobItem.status == "queued").update(
+            {"status": "running", "claim_token": token, "claimed_at": datetime.now()}, synchronize_session=False
+        )
+        db.query(BulkJob).filter(BulkJob.id == job_id, BulkJob.status == "queued").update(
+            {"status": "running", "updated_at": datetime.now()}, synchronize_session=False
+        )
+        db.commit()
+
+        job = db.get(BulkJob, job_id)
+        job_info = {
+            "id": job.id, "user_id": job.user_id, "latitude": job.latitude,
+            "longitude": job.longitude, "force_dip": job.force_dip,
+        }
+        items = db.query(BulkJobItem.id, BulkJobItem.filename, BulkJobItem.path).filter(
+            BulkJobItem.claim_token == token
+        ).order_by(BulkJobItem.id).all()
+        return job_info, [tuple(item) for item in items]
+    finally:
+        db.close()
+
+def complete_items(job_id, items, results):
+    """
+    Store the results of a claimed chunk and advance the job counters. result_seq values are
+    taken from the job's `processed` counter inside the same transaction, so they are dense
+    and commit in order, which lets NDJSON readers resume from the last seq they saw.
+    """
+    db = SessionLocal()
+    try:
+        failed = sum(1 for result in results if "error" in result)
+        db.query(BulkJob).filter(BulkJob.id == job_id).update({
+            "processed": BulkJob.processed + len(items),
+            "failed": BulkJob.failed + failed,
+            "updated_at": datetime.now(),
+        }, synchronize_session=False)
+        job = db.get(BulkJob, job_id)
+        db.refresh(job)
+        first_seq = job.processed - len(items) + 1
+
+        for offset, ((item_id, _, path), result) in enumerate(zip(items, results)):
+            db.query(BulkJobItem).filter(BulkJobItem.id == item_id).update({
+                "status": "error" if "error" in result else "done",
+                "result_seq": first_seq + offset,
+                "result": json.dumps(result, default=str),
+                "path": None,
+            }, synchronize_session=False)
+
+        remaining = db.query(BulkJobItem.id).filter(
+            BulkJobItem.job_id == job_id, BulkJobItem.status.in_(("queued", "running"))
+        ).first()
+        finished = remaining is None
+        if finished and job.status == "running":
+            job.status = "completed"
+            job.finished_at = datetime.now()
+        db.commit()
+    finally:
+        db.close()
+
+    for _, _, path in items:
+        _remove_staged(path)
+    if finished:
+        discard_staging(job_id)
+
+
+async def run_worker(process_chunk, stop: asyncio.Event, chunk_size=BULK_JOB_CHUNK, should_yield=None):
+    """
+    Claim-process-complete loop. `process_chunk(job, items)` returns one result dict per item.
+    `should_yield()`, when given, is polled before every claim; while it returns True the
+    worker backs off so interactive requests get the CPU first.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Bulk job worker {worker_id} started")
+    await run_in_threadpool(requeue_stale)
+    last_requeue = time.monotonic()
+
+    while not stop.is_set():
+        if should_yield is not None and should_yield():
+            await asyncio.sleep(0.05)
+            continue
+        if time.monotonic() - last_requeue > BULK_JOB_STALE_S:
+            await run_in_threadpool(requeue_stale)
+            last_requeue = time.monotonic()
+
+        job, items = await run_in_threadpool(claim_items, chunk_size)
+        if not items:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=BULK_JOB_POLL_S)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            results = await process_chunk(job, items)
+        except Exception:
+            logger.exception(f"Bulk job {job['id']}: chunk of {len(items)} failed")
+            results = [{"filename": filename, "error": "Processing failed."} for _, filename, _ in items]
+        await run_in_threadpool(complete_items, job["id"], items, results)
+
+    logger.info(f"Bulk job worker {worker_id} stopped")
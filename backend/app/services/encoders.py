@@ -0,0 +1,50 @@
+import os
+import base64
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+ENCODE_THREADS = int(os.getenv("ENCODE_THREADS", "4"))
+PREVIEW_WEBP_QUALITY = int(os.getenv("PREVIEW_WEBP_QUALITY", "80"))
+
+# kind -> (file extension, media type, cv2.imencode params)
+FORMATS = {
+    "mask": (".png", "image/png", [cv2.IMWRITE_PNG_BILEVEL, 1]),  # 1-bit, lossless for 0/255 masks
+    "gray": (".png", "image/png", []),
+    "rgb": (".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, PREVIEW_WEBP_QUALITY]),
+}
+MEDIA_TYPES = {ext: media_type for ext, media_type, _ in FORMATS.values()}
+
+# Identifies the output of encode_image; anything hashing artifacts should include it
+ENCODER_VERSION = f"mask=png1|gray=png|rgb=webp{PREVIEW_WEBP_QUALITY}"
+
+# cv2.imencode releases the GIL, so a few threads encode a set of previews concurrently
+_executor = ThreadPoolExecutor(max_workers=max(1, ENCODE_THREADS), thread_name_prefix="encode")
+
+
+def artifact_kind(array) -> str:
+    """'mask' for binary 0/255 images, 'gray' for other single-channel ones, else 'rgb'."""
+    if array.ndim == 2 or array.shape[2] == 1:
+        return "mask" if not np.any((array != 0) & (array != 255)) else "gray"
+    return "rgb"
+
+def encode_image(array):
+    """Encode an RGB or single-channel uint8 image in the format for its kind; returns (bytes, media type)."""
+    array = np.ascontiguousarray(array, dtype=np.uint8)
+    kind = artifact_kind(array)
+    ext, media_type, params = FORMATS[kind]
+    image = cv2.cvtColor(array, cv2.COLOR_RGB2BGR) if kind == "rgb" else array
+    ok, buf = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"Could not encode {kind} image of shape {array.shape}")
+    return buf.tobytes(), media_type
+
+def encode_many(arrays):
+    """encode_image over several arrays in parallel, results in input order."""
+    if len(arrays) <= 1:
+        return [encode_image(array) for array in arrays]
+    return list(_executor.map(encode_image, arrays))
+
+def to_data_uri(data: bytes, media_type: str) -> str:
+    return f"data:{media_type};base64," + base64.b64encode(data).decode()
@@ -0,0 +1,125 @@
+import os
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger("cropsense.engines")
+
+# keras | tflite. TFLite artifacts are produced by ml_pipeline/export_tflite.py
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras").lower()
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "int8").lower()  # fp16 | int8 (tflite only)
+TFLITE_NUM_THREADS = int(os.getenv("TFLITE_NUM_THREADS", "0")) or None
+# Serve ml_pipeline/model_dual_head.keras (built by build_dual_head.py) when present
+INFERENCE_DUAL_HEAD = os.getenv("INFERENCE_DUAL_HEAD", "false").lower() in ("1", "true", "yes")
+
+
+def tflite_path(keras_path: str, precision: str) -> str:
+    """model_nodip.keras -> model_nodip_int8.tflite (same naming as export_tflite.py)."""
+    return os.path.splitext(keras_path)[0] + f"_{precision}.tflite"
+
+
+class KerasEngine:
+    """Full tf.keras model, the original serving path."""
+    name = "keras"
+
+    def __init__(self, path: str):
+        import tensorflow as tf
+        self.path = path
+        self.model = tf.keras.models.load_model(path)
+
+    def predict_on_batch(self, x):
+        return np.asarray(self.model.predict_on_batch(x))
+
+
+class TFLiteEngine:
+    """
+    TFLite interpreter engine for the float16 / INT8 exports.
+    The interpreter is not thread-safe, so calls are serialized; the input tensor is
+    resized whenever the incoming batch size changes.
+    """
+    name = "tflite"
+
+    def __init__(self, path: str, num_threads=TFLITE_NUM_THREADS):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.path = path
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch = int(self._input["shape"][0])
+        self._lock = threading.Lock()
+
+    def _quantize(self, x):
+        dtype = self._input["dtype"]
+        if dtype == np.float32:
+            return np.ascontiguousarray(x, dtype=np.float32)
+        scale, zero_point = self._input["quantization"]
+        return np.clip(np.round(x / scale + zero_point), np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+
+    def _dequantize(self, y):
+        if self._output["dtype"] == np.float32:
+            return y
+        scale, zero_point = self._output["quantization"]
+        return (y.astype(np.float32) - zero_point) * scale
+
+    def predict_on_batch(self, x):
+        x = self._quantize(np.asarray(x))
+        with self._lock:
+            if x.shape[0] != self._batch:
+                self.interpreter.resize_tensor_input(self._input["index"], list(x.shape))
+                self.interpreter.allocate_tensors()
+                self._batch = x.shape[0]
+            self.interpreter.set_tensor(self._input["index"], x)
+            self.interpreter.invoke()
+            y = self.interpreter.get_tensor(self._output["index"]).copy()
+        return self._dequantize(y)
+
+
+class DualHeadEngine:
+    """
+    Shared-trunk model with a raw and a DIP head. predict_on_batch returns an
+    (N, 2, num_classes) array: row i holds both heads' outputs for input i.
+    """
+    name = "dual_head"
+
+    def __init__(self, path: str):
+        import tensorflow as tf
+        self.path = path
+        self.model = tf.keras.models.load_model(path)
+
+    def predict_on_batch(self, x):
+        raw_out, dip_out = self.model.predict_on_batch(x)
+        return np.stack([np.asarray(raw_out), np.asarray(dip_out)], axis=1)
+
+
+class HeadView:
+    """Exposes one head of a DualHeadEngine through the single-model interface."""
+
+    def __init__(self, engine: DualHeadEngine, head: int):
+        self.engine = engine
+        self.head = head
+        self.name = f"{engine.name}[{head}]"
+
+    def predict_on_batch(self, x):
+        return self.engine.predict_on_batch(x)[:, self.head]
+
+
+def load_engine(keras_path: str, backend: str = INFERENCE_BACKEND, precision: str = INFERENCE_PRECISION):
+    """Load the configured engine for a model, falling back to Keras when no TFLite export exists."""
+    if backend == "tflite":
+        path = tflite_path(keras_path, precision)
+        if os.path.exists(path):
+            logger.info(f"Loading TFLite ({precision}) engine from {path}")
+            return TFLiteEngine(path)
+        logger.warning(f"{path} not found, run ml_pipeline/export_tflite.py. Falling back to Keras.")
+    elif backend != "keras":
+        logger.warning(f"Unknown INFERENCE_BACKEND '{backend}', using Keras.")
+
+    if os.path.exists(keras_path):
+        return KerasEngine(keras_path)
+    return None
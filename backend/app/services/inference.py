@@ -0,0 +1,104 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger("cropsense.inference")
+
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+
+
+class InferenceScheduler:
+    """
+    Dynamic micro-batching in front of a model cache (e.g. predict.models_cache).
+    Each model key gets one worker thread that drains its queue into batches of up to
+    `max_batch_size` inputs, waiting at most `max_wait_ms` after the first input arrives,
+    then runs a single forward pass and resolves every caller's Future with its row.
+    Engines with `batched_remotely` (the sidecar, which micro-batches itself) get no wait:
+    whatever is queued goes out at once, so requests are not held in two batching windows.
+    """
+
+    def __init__(self, models, max_batch_size=INFERENCE_MAX_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS):
+        self.models = models
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self._queues = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _ensure_worker(self, key):
+        with self._lock:
+            if key not in self._workers:
+                self._queues[key] = queue.Queue()
+                self._stats[key] = {"batches": 0, "items": 0, "max_batch": 0}
+                worker = threading.Thread(target=self._run, args=(key,), name=f"inference-{key}", daemon=True)
+                self._workers[key] = worker
+                worker.start()
+        return self._queues[key]
+
+    def submit(self, key, x) -> Future:
+        """Queue a single (unbatched) input for model `key`; returns a Future of its prediction row."""
+        future = Future()
+        self._ensure_worker(key).put((x, future))
+        return future
+
+    async def predict(self, key, x):
+        """Awaitable wrapper around submit() for use inside async endpoints."""
+        return await asyncio.wrap_future(self.submit(key, x))
+
+    def _collect(self, key, q):
+        batch = [q.get()]
+        # Looked up per batch: the engine behind a key can be loaded or swapped at any time
+        max_wait_ms = 0.0 if getattr(self.models.get(key), "batched_remotely", False) else self.max_wait_ms
+        deadline = time.monotonic() + max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline, still take what is already queued
+                batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, key):
+        q = self._queues[key]
+        while True:
+            batch = self._collect(key, q)
+            # Drop callers that cancelled while queued
+            live = [(x, f) for x, f in batch if f.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                model = self.models[key]
+                if model is None:
+                    raise RuntimeError(f"Model '{key}' is not loaded.")
+                preds = np.asarray(model.predict_on_batch(np.stack([x for x, _ in live])))
+                for i, (_, future) in enumerate(live):
+                    future.set_result(preds[i])
+            except Exception as e:
+                logger.error(f"Batched inference failed for '{key}': {e}")
+                for _, future in live:
+                    future.set_exception(e)
+                continue
+
+            stats = self._stats[key]
+            stats["batches"] += 1
+            stats["items"] += len(live)
+            stats["max_batch"] = max(stats["max_batch"], len(live))
+
+    def stats(self):
+        return {
+            key: {
+                **s,
+                "avg_batch": round(s["items"] / s["batches"], 2) if s["batches"] else 0.0,
+                "pending": self._queues[key].qsize(),
+            }
+            for key, s in self._stats.items()
+        }
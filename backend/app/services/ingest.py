@@ -0,0 +1,101 @@
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+
+# libjpeg can decode directly at 1/2, 1/4 or 1/8 scale via the DCT, which is far
+# cheaper than decoding a 12MP phone photo at full size and shrinking it afterwards.
+REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    1: cv2.IMREAD_COLOR,
+}
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _read_header(contents: bytes):
+    """Return (width, height, format, exif orientation) without decoding pixels."""
+    try:
+        with PILImage.open(BytesIO(contents)) as pil_img:
+            width, height = pil_img.size
+            orientation = pil_img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            return width, height, pil_img.format, orientation
+    except Exception:
+        return None, None, None, 1
+
+
+def pick_decode_scale(width, height, target: int = 224) -> int:
+    """Largest JPEG reduction factor that still keeps both sides >= target."""
+    if not width or not height:
+        return 1
+    for factor in (8, 4, 2):
+        if min(width, height) // factor >= target:
+            return factor
+    return 1
+
+
+def apply_exif_orientation(img, orientation: int):
+    """Rotate/flip a decoded array so it matches the EXIF orientation tag (same mapping as PIL.ImageOps.exif_transpose)."""
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+
+def decode_upload(contents: bytes, size=(224, 224)):
+    """
+    In-memory ingest stage for uploaded photos.
+    1. Reads the image header (size, format, EXIF orientation) without decoding.
+    2. Decodes JPEGs at a reduced DCT scale picked from the target size.
+    3. Applies EXIF orientation and resizes once to `size`.
+    Returns the shared BGR buffer (or None if undecodable) and an info dict.
+    """
+    return _decode(contents, target=max(size), size=size)
+
+
+def decode_native(contents: bytes, target: int = None):
+    """
+    Like decode_upload, but keeps the photo's own resolution (EXIF orientation applied, no
+    resize) for callers that crop regions out of it. With `target`, JPEGs are decoded at the
+    largest DCT reduction that keeps the short side >= target.
+    """
+    return _decode(contents, target=target)
+
+
+def _decode(contents: bytes, target=None, size=None):
+    start_time = time.time()
+
+    width, height, fmt, orientation = _read_header(contents)
+    scale = pick_decode_scale(width, height, target=target) if fmt == "JPEG" and target else 1
+
+    buf = np.frombuffer(contents, dtype=np.uint8)
+    img_bgr = cv2.imdecode(buf, REDUCED_DECODE_FLAGS[scale] | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img_bgr is None:
+        return None, {"decode_scale": scale, "source_size": (width, height), "decode_ms": 0.0}
+
+    img_bgr = apply_exif_orientation(img_bgr, orientation)
+    if size is not None and img_bgr.shape[1::-1] != tuple(size):
+        img_bgr = cv2.resize(img_bgr, size, interpolation=cv2.INTER_AREA)
+
+    ingest_info = {
+        "decode_scale": scale,
+        "source_size": (width, height),
+        "orientation": orientation,
+        "decode_ms": (time.time() - start_time) * 1000,
+    }
+    return img_bgr, ingest_info
@@ -0,0 +1,118 @@
+import os
+import time
+import copy
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Bits of 64 a photo may differ by and still reuse a result: recompression, not another leaf
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "3"))  # 0 disables reuse
+NEAR_DUP_MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", "5000"))
+NEAR_DUP_TTL_S = float(os.getenv("NEAR_DUP_TTL_S", "1800"))
+
+HASH_BITS = 64
+
+
+def dhash(gray) -> int:
+    """64-bit difference hash of a grayscale image (row-wise gradient signs on a 9x8 thumbnail)."""
+    thumb = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+class NearDuplicateIndex:
+    """
+    Multi-index Hamming search over recent prediction hashes.
+    The 64-bit hash is split into max_distance + 1 disjoint chunks; by the pigeonhole principle
+    any hash within max_distance shares at least one chunk exactly, so lookups only verify the
+    entries found in those chunk buckets. Entries are evicted oldest-first by TTL and capacity.
+    """
+
+    def __init__(self, max_distance=NEAR_DUP_MAX_DISTANCE, max_entries=NEAR_DUP_MAX_ENTRIES, ttl_s=NEAR_DUP_TTL_S):
+        self.max_distance = max(0, int(max_distance))
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = ttl_s
+        num_chunks = min(HASH_BITS, self.max_distance + 1)
+        bounds = [round(i * HASH_BITS / num_chunks) for i in range(num_chunks + 1)]
+        self._chunks = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds, bounds[1:])]
+        self._buckets = [{} for _ in self._chunks]
+        self._entries = OrderedDict()  # entry id -> (hash, tag, stored_at, value)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "stale": 0, "evictions": 0}
+
+    def _chunk_keys(self, h):
+        return [(h >> shift) & mask for shift, mask in self._chunks]
+
+    def _remove(self, entry_id):
+        h = self._entries.pop(entry_id)[0]
+        for bucket, key in zip(self._buckets, self._chunk_keys(h)):
+            ids = bucket.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del bucket[key]
+
+    def _evict(self, now):
+        while self._entries:
+            entry_id, (_, _, stored_at, _) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - stored_at <= self.ttl_s:
+                break
+            self._remove(entry_id)
+            self._counters["evictions"] += 1
+
+    def lookup(self, h, tag=None, accept=None):
+        """
+        Closest recent entry with the same tag within max_distance, as (value, distance), else None.
+        With `accept`, entries whose value it rejects (e.g. previews evicted since) are dropped
+        and the next closest one is tried.
+        """
+        if not self.max_distance:
+            return None
+        with self._lock:
+            self._evict(time.time())
+            self._counters["lookups"] += 1
+            candidates = set()
+            for bucket, key in zip(self._buckets, self._chunk_keys(h)):
+                candidates.update(bucket.get(key, ()))
+            matches = []
+            for entry_id in candidates:
+                other, other_tag, _, value = self._entries[entry_id]
+                if other_tag != tag:
+                    continue
+                distance = (h ^ other).bit_count()
+                if distance <= self.max_distance:
+                    matches.append((distance, entry_id, value))
+            for distance, entry_id, value in sorted(matches, key=lambda m: m[:2]):
+                if accept is not None and not accept(value):
+                    self._remove(entry_id)
+                    self._counters["stale"] += 1
+                    continue
+                self._counters["hits"] += 1
+                return copy.deepcopy(value), distance
+            return None
+
+    def add(self, h, value, tag=None):
+        if not self.max_distance:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (h, tag, time.time(), copy.deepcopy(value))
+            for bucket, key in zip(self._buckets, self._chunk_keys(h)):
+                bucket.setdefault(key, set()).add(entry_id)
+            self._evict(time.time())
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["lookups"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_distance": self.max_distance,
+                "ttl_s": self.ttl_s,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
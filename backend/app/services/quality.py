@@ -0,0 +1,204 @@
+import os
+import json
+import logging
+from typing import TypedDict
+
+import cv2
+import numpy as np
+
+from .near_duplicate import dhash
+
+logger = logging.getLogger("cropsense.quality")
+
+# Side of the pyramid level every gate metric is measured on (one pyrDown of the 224 decode buffer)
+QUALITY_LEVEL_SIZE = 112
+# Written by scripts/calibrate_quality_gate.py from data_split/val
+CALIBRATION_PATH = os.getenv(
+    "QUALITY_CALIBRATION_PATH", os.path.join(os.path.dirname(__file__), "quality_calibration.json")
+)
+
+# Thresholds are in the units of the original full-frame gate, so diagnostics and the
+# frontend's colour coding keep their meaning; blur_scale maps the level's Laplacian
+# variance back onto that scale.
+DEFAULT_CALIBRATION = {
+    "level_size": QUALITY_LEVEL_SIZE,
+    "blur_scale": 2.45,
+    "blur_threshold": 100.0,
+    "dark_percent": 20.0,
+    "bright_percent": 20.0,
+    "green_ratio": 0.15,
+}
+
+DARK_PIXEL = 40
+BRIGHT_PIXEL = 215
+EXG_GREEN = 20
+
+
+class QualityReport(TypedDict):
+    blur_variance: float
+    brightness: float
+    dark_percent: float
+    bright_percent: float
+    green_ratio: float
+    is_blurry: bool
+    is_bad_lighting: bool
+    is_leaf: bool
+    dhash: int
+
+
+def load_calibration(path=CALIBRATION_PATH):
+    calibration = dict(DEFAULT_CALIBRATION)
+    try:
+        with open(path) as f:
+            calibration.update({k: v for k, v in json.load(f).items() if k in DEFAULT_CALIBRATION})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring quality calibration {path}: {e}")
+    return calibration
+
+CALIBRATION = load_calibration()
+
+
+def quality_level(img_bgr, size=None):
+    """The single small pyramid level the gate works on: pyrDown when the frame is exactly 2x, else INTER_AREA."""
+    size = size or CALIBRATION["level_size"]
+    h, w = img_bgr.shape[:2]
+    if (h, w) == (2 * size, 2 * size):
+        return cv2.pyrDown(img_bgr)
+    if (h, w) == (size, size):
+        return img_bgr
+    return cv2.resize(img_bgr, (size, size), interpolation=cv2.INTER_AREA)
+
+def measure_level(level):
+    """
+    Raw gate metrics of one level in a single pass: one grayscale conversion feeds the
+    Laplacian and one 256-bin histogram (mean, dark and bright fractions); ExG is computed
+    on the same pixels.
+    """
+    gray = cv2.cvtColor(level, cv2.COLOR_BGR2GRAY)
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    n = gray.size
+
+    channels = level.astype(np.int16)
+    exg = 2 * channels[..., 1] - channels[..., 2] - channels[..., 0]
+    return {
+        "laplacian_variance": float(std[0, 0]) ** 2,
+        "brightness": float(hist @ np.arange(256)) / n,
+        "dark_percent": float(hist[:DARK_PIXEL].sum()) / n * 100,
+        "bright_percent": float(hist[BRIGHT_PIXEL + 1:].sum()) / n * 100,
+        "green_ratio": float(np.count_nonzero(exg > EXG_GREEN)) / n,
+        "gray": gray,
+    }
+
+def assess_quality(img_bgr, calibration=None) -> QualityReport:
+    """Blur, lighting and leaf (OOD) gates for one decoded frame. Cost is fixed by the level size."""
+    calibration = calibration or CALIBRATION
+    m = measure_level(quality_level(img_bgr, calibration["level_size"]))
+    blur_variance = m["laplacian_variance"] * calibration["blur_scale"]
+    return QualityReport(
+        blur_variance=blur_variance,
+        brightness=m["brightness"],
+        dark_percent=m["dark_percent"],
+        bright_percent=m["bright_percent"],
+        green_ratio=m["green_ratio"],
+        is_blurry=blur_variance < calibration["blur_threshold"],
+        is_bad_lighting=m["dark_percent"] > calibration["dark_percent"] or m["bright_percent"] > calibration["bright_percent"],
+        is_leaf=m["green_ratio"] >= calibration["green_ratio"],
+        dhash=dhash(m["gray"]),
+    )
+
+def _tall(stack, pad):
+    """
+    An (N, H, W[, C]) stack as one (N * (H + 2 * pad), W[, C]) frame, each image framed by
+    `pad` reflect-101 rows: a cv2 filter over the tall frame then sees, for every image,
+    exactly the vertical border it would see on that image alone (cv2 handles the left and
+    right borders itself).
+    """
+    n, h = stack.shape[:2]
+    padded = np.empty((n, h + 2 * pad) + stack.shape[2:], stack.dtype)
+    padded[:, pad:pad + h] = stack
+    for k in range(1, pad + 1):
+        padded[:, pad - k] = stack[:, k]
+        padded[:, pad + h - 1 + k] = stack[:, h - 1 - k]
+    return padded.reshape((-1,) + stack.shape[2:])
+
+_PYR_TAPS = (1, 4, 6, 4, 1)
+
+def _pyr_rows(rows):
+    """
+    pyrDown output row for each (N, 5, W, C) window of input rows, bit-exact with cv2
+    (5-tap [1 4 6 4 1] kernel both ways, reflect-101 columns, (sum + 128) >> 8).
+    """
+    rows = rows.astype(np.int32)
+    v = sum(t * rows[:, k] for k, t in enumerate(_PYR_TAPS))  # (N, W, C)
+    v = np.concatenate([v[:, 2:0:-1], v, v[:, -2:-4:-1]], axis=1)
+    half = rows.shape[2] // 2
+    out = sum(t * v[:, k:k + 2 * half:2] for k, t in enumerate(_PYR_TAPS))
+    return ((out + 128) >> 8).astype(np.uint8)
+
+def quality_level_stack(images, size=None):
+    """quality_level over a stack (or list) of frames, as one (N, size, size, 3) array."""
+    size = size or CALIBRATION["level_size"]
+    if len({img.shape for img in images}) != 1 or images[0].shape[:2] != (2 * size, 2 * size):
+        return np.stack([quality_level(img, size) for img in images])
+    # One pyrDown over the stack as a tall frame. Output row j reads input rows 2j-2..2j+2,
+    # so only each image's first and last output rows see a neighbour across the seam;
+    # those two rows are recomputed with the image's own reflect-101 border.
+    stack = np.ascontiguousarray(images)
+    n, h = stack.shape[:2]
+    level = cv2.pyrDown(stack.reshape(n * h, *stack.shape[2:])).reshape(n, size, size, 3)
+    level[:, 0] = _pyr_rows(stack[:, [2, 1, 0, 1, 2]])
+    level[:, -1] = _pyr_rows(stack[:, [h - 4, h - 3, h - 2, h - 1, h - 2]])
+    return level
+
+def measure_levels(levels):
+    """
+    measure_level over an (N, S, S, 3) stack of levels at once: one grayscale conversion and
+    one Laplacian for the whole stack, then the variance, lighting and ExG figures as
+    per-image array reductions.
+    """
+    n, h, w = levels.shape[:3]
+    gray = cv2.cvtColor(levels.reshape(n * h, w, 3), cv2.COLOR_BGR2GRAY).reshape(n, h, w)
+    laplacian = cv2.Laplacian(_tall(gray, 1), cv2.CV_32F).reshape(n, h + 2, w)[:, 1:h + 1]
+    flat = gray.reshape(n, -1)
+    exg = 2 * levels[..., 1].astype(np.int16) - levels[..., 2] - levels[..., 0]
+    size = flat.shape[1]
+    # Laplacian values are small integers, so float64 sums are exact and E[x^2] - E[x]^2 is safe
+    mean = laplacian.sum(axis=(1, 2), dtype=np.float64) / size
+    mean_sq = np.einsum("nij,nij->n", laplacian, laplacian, dtype=np.float64) / size
+    return {
+        "laplacian_variance": mean_sq - mean ** 2,
+        "brightness": flat.sum(axis=1, dtype=np.int64) / size,
+        "dark_percent": (flat < DARK_PIXEL).sum(axis=1, dtype=np.int64) / size * 100,
+        "bright_percent": (flat > BRIGHT_PIXEL).sum(axis=1, dtype=np.int64) / size * 100,
+        "green_ratio": (exg.reshape(n, -1) > EXG_GREEN).sum(axis=1, dtype=np.int64) / size,
+        "gray": gray,
+    }
+
+def assess_quality_batch(images, calibration=None):
+    """
+    assess_quality over an (N, H, W, 3) stack or a list of frames: the level and every gate
+    metric are computed for the whole stack at once; only the dHash runs per image.
+    """
+    calibration = calibration or CALIBRATION
+    if len(images) == 0:
+        return []
+    m = measure_levels(quality_level_stack(images, calibration["level_size"]))
+    blur_variance = m["laplacian_variance"] * calibration["blur_scale"]
+    return [
+        QualityReport(
+            blur_variance=float(blur_variance[i]),
+            brightness=float(m["brightness"][i]),
+            dark_percent=float(m["dark_percent"][i]),
+            bright_percent=float(m["bright_percent"][i]),
+            green_ratio=float(m["green_ratio"][i]),
+            is_blurry=bool(blur_variance[i] < calibration["blur_threshold"]),
+            is_bad_lighting=bool(m["dark_percent"][i] > calibration["dark_percent"]
+                                 or m["bright_percent"][i] > calibration["bright_percent"]),
+            is_leaf=bool(m["green_ratio"][i] >= calibration["green_ratio"]),
+            dhash=dhash(m["gray"][i]),
+        )
+        for i in range(len(blur_variance))
+    ]
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("cropsense.result_cache")
+
+PREDICT_CACHE_SIZE = int(os.getenv("PREDICT_CACHE_SIZE", "1024"))
+PREDICT_CACHE_TTL_S = float(os.getenv("PREDICT_CACHE_TTL_S", "3600"))
+PREDICT_CACHE_DIR = os.getenv("PREDICT_CACHE_DIR", "")  # empty disables the on-disk tier
+
+
+def make_cache_key(contents: bytes, model_version: str, **flags) -> str:
+    """Content address: sha256 of the upload bytes, the model fingerprint and the form flags."""
+    h = hashlib.sha256(contents)
+    h.update(model_version.encode())
+    for name in sorted(flags):
+        h.update(f"|{name}={flags[name]}".encode())
+    return h.hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier result cache for /predict: an in-process LRU bounded by entry count and TTL,
+    optionally backed by JSON files under `disk_dir` (shared across workers and restarts).
+    Values are deep-copied in and out so callers can mutate what they get back.
+    """
+
+    def __init__(self, max_entries=PREDICT_CACHE_SIZE, ttl_s=PREDICT_CACHE_TTL_S, disk_dir=PREDICT_CACHE_DIR):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_s = ttl_s
+        self.disk_dir = disk_dir or None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - record["stored_at"] > self.ttl_s:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return record
+
+    def _write_disk(self, key, stored_at, value):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"stored_at": stored_at, "value": value}, f, default=str)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {e}")
+
+    def _insert(self, key, stored_at, value):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if time.time() - stored_at <= self.ttl_s:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self._counters["expired"] += 1
+
+        if self.disk_dir:
+            record = self._read_disk(key)
+            if record is not None:
+                with self._lock:
+                    self._insert(key, record["stored_at"], record["value"])
+                    self._counters["hits"] += 1
+                    self._counters["disk_hits"] += 1
+                return copy.deepcopy(record["value"])
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, key, value):
+        stored_at = time.time()
+        value = copy.deepcopy(value)
+        with self._lock:
+            if self.max_entries:
+                self._insert(key, stored_at, value)
+        if self.disk_dir:
+            self._write_disk(key, stored_at, value)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "disk_tier": bool(self.disk_dir),
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,206 @@
+import os
+import atexit
+import logging
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Listener, Client
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .inference import InferenceScheduler
+
+logger = logging.getLogger("cropsense.sidecar")
+
+# Unix socket path, or host:port for TCP (Windows). Empty: every API worker loads its own models.
+INFERENCE_SIDECAR = os.getenv("INFERENCE_SIDECAR", "")
+# Connections exchange pickles, so only an authenticated peer may connect. No default:
+# without a key, only a Unix socket (owner-only permissions) is accepted.
+INFERENCE_SIDECAR_AUTHKEY = os.getenv("INFERENCE_SIDECAR_AUTHKEY", "").encode() or None
+
+HEADS = {"raw": 0, "dip": 1}
+
+
+def parse_address(address: str):
+    """'/run/cropsense.sock' -> (path, 'AF_UNIX'); '127.0.0.1:8765' -> ((host, port), 'AF_INET')."""
+    if ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        return (host, int(port)), "AF_INET"
+    return address, "AF_UNIX"
+
+def check_transport(family, authkey):
+    """Refuse a TCP sidecar without an authkey: anyone reaching the port could send a pickle."""
+    if family == "AF_INET" and not authkey:
+        raise ValueError("INFERENCE_SIDECAR_AUTHKEY must be set to use a host:port sidecar address.")
+
+def _attach(name):
+    """Attach to a client's segment without letting this process's resource tracker own it."""
+    shm = SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+def _close_segments(segments):
+    for shm in segments.values():
+        try:
+            shm.close()
+        except BufferError:  # rows still referenced by the scheduler; freed with them
+            pass
+    segments.clear()
+
+
+class SidecarServer:
+    """
+    Single per-node inference process. API workers send a request per batch over a local
+    socket; the input tensor itself travels through a shared-memory segment owned by the
+    worker, only the (N, num_classes) output is sent back over the socket. Requests from
+    all workers meet in one InferenceScheduler, so they are micro-batched together.
+    """
+
+    def __init__(self, models, address=INFERENCE_SIDECAR, authkey=INFERENCE_SIDECAR_AUTHKEY, **scheduler_kwargs):
+        self.models = models
+        self.address, self.family = parse_address(address)
+        check_transport(self.family, authkey)
+        self.authkey = authkey
+        self.scheduler = InferenceScheduler(models, **scheduler_kwargs)
+
+    def _engine_path(self, key):
+        engine = self.models.get("dual") or self.models.get(key)
+        return getattr(getattr(engine, "engine", engine), "path", None)
+
+    def _predict(self, key, x):
+        if self.models.get("dual") is not None and key in HEADS:
+            futures = [self.scheduler.submit("dual", row) for row in x]
+            return np.stack([f.result()[HEADS[key]] for f in futures])
+        futures = [self.scheduler.submit(key, row) for row in x]
+        return np.stack([f.result() for f in futures])
+
+    def _serve_connection(self, conn):
+        segments = {}
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    op = request.get("op", "predict")
+                    if op == "info":
+                        conn.send({"pid": os.getpid(), "paths": {key: self._engine_path(key) for key in HEADS},
+                                   "loaded": {key: self.models.get(key) is not None for key in HEADS}})
+                        continue
+                    if op == "stats":
+                        conn.send({"stats": self.scheduler.stats()})
+                        continue
+                    if request.get("shm"):
+                        name = request["shm"]
+                        if name not in segments:
+                            # One buffer per client thread: a new name means the old one was replaced
+                            _close_segments(segments)
+                            segments[name] = _attach(name)
+                        x = np.ndarray(request["shape"], dtype=request["dtype"], buffer=segments[name].buf)
+                    else:
+                        x = request["x"]
+                    conn.send({"y": self._predict(request["key"], x)})
+                    del x
+                except Exception as e:
+                    logger.error(f"Sidecar request failed: {e}")
+                    conn.send({"error": str(e)})
+        finally:
+            _close_segments(segments)
+            conn.close()
+
+    def serve_forever(self):
+        if self.family == "AF_UNIX" and os.path.exists(self.address):
+            os.remove(self.address)
+        # The socket is created owner-only (0600), so other local users cannot connect
+        umask = os.umask(0o177) if self.family == "AF_UNIX" else None
+        try:
+            listener = Listener(self.address, family=self.family, authkey=self.authkey)
+        finally:
+            if umask is not None:
+                os.umask(umask)
+        with listener:
+            logger.info(f"Inference sidecar (pid {os.getpid()}) listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:  # failed handshake, etc.
+                    logger.warning(f"Rejected sidecar connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+class SidecarEngine:
+    """
+    predict_on_batch() client for one model key on the sidecar. Each calling thread keeps its
+    own connection and a reusable shared-memory input buffer, grown when a larger batch arrives.
+    """
+    name = "sidecar"
+    # The sidecar's own scheduler micro-batches across workers: a local InferenceScheduler
+    # in front of this engine sends immediately instead of waiting to fill a batch
+    batched_remotely = True
+
+    def __init__(self, key, address=INFERENCE_SIDECAR, authkey=INFERENCE_SIDECAR_AUTHKEY):
+        self.key = key
+        self.address, self.family = parse_address(address)
+        check_transport(self.family, authkey)
+        self.authkey = authkey
+        self._local = threading.local()
+        self._segments = []
+        self._segments_lock = threading.Lock()
+        info = self._call({"op": "info"})
+        if not info["loaded"].get(key):
+            raise RuntimeError(f"Sidecar at {address} has no '{key}' model loaded.")
+        self.path = info["paths"].get(key)  # keeps predict.model_fingerprint() meaningful
+        atexit.register(self.close)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, family=self.family, authkey=self.authkey)
+        return conn
+
+    def _call(self, request):
+        for attempt in range(2):
+            try:
+                conn = self._conn()
+                conn.send(request)
+                response = conn.recv()
+                break
+            except (EOFError, OSError):
+                # Sidecar restarted: reconnect once
+                self._local.conn = None
+                if attempt:
+                    raise
+        if "error" in response:
+            raise RuntimeError(f"Sidecar inference failed: {response['error']}")
+        return response
+
+    def _buffer(self, nbytes):
+        shm = getattr(self._local, "shm", None)
+        if shm is None or shm.size < nbytes:
+            with self._segments_lock:
+                if shm is not None:
+                    self._segments.remove(shm)
+                    shm.close()
+                    shm.unlink()
+                shm = self._local.shm = SharedMemory(create=True, size=nbytes)
+                self._segments.append(shm)
+        return shm
+
+    def predict_on_batch(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        shm = self._buffer(x.nbytes)
+        np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf)[...] = x
+        response = self._call({"key": self.key, "shm": shm.name, "shape": x.shape, "dtype": x.dtype.str})
+        return response["y"]
+
+    def close(self):
+        with self._segments_lock:
+            for shm in self._segments:
+                shm.close()
+                shm.unlink()
+            self._segments.clear()
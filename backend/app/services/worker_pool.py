@@ -0,0 +1,85 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+PREDICT_WORKERS = int(os.getenv("PREDICT_WORKERS", str(os.cpu_count() or 4)))
+PREDICT_MAX_QUEUE = int(os.getenv("PREDICT_MAX_QUEUE", "64"))
+PREDICT_RETRY_AFTER_S = int(os.getenv("PREDICT_RETRY_AFTER_S", "2"))
+
+
+class QueueFullError(Exception):
+    """Raised when a request cannot be admitted because the pool's queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Prediction queue is full.")
+        self.retry_after = retry_after
+
+
+class BoundedWorkerPool:
+    """
+    Dedicated thread pool for the CPU-bound image and inference stages, so the
+    uvicorn event loop stays free for the rest of the API.
+    Admission is bounded: at most `max_workers + max_queue` requests are in flight,
+    anything beyond that is refused immediately with QueueFullError.
+    """
+
+    def __init__(self, max_workers=PREDICT_WORKERS, max_queue=PREDICT_MAX_QUEUE,
+                 retry_after=PREDICT_RETRY_AFTER_S, name="predict"):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._rejected = 0
+        self._completed = 0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+
+    @asynccontextmanager
+    async def admit(self):
+        """Reserve a request slot for the duration of the block, or raise QueueFullError."""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise QueueFullError(self.retry_after)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _timed(self, enqueued_at, fn, args, kwargs):
+        wait_ms = (time.monotonic() - enqueued_at) * 1000
+        with self._lock:
+            self._queued -= 1
+            self._completed += 1
+            self._total_wait_ms += wait_ms
+            self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+        return fn(*args, **kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking stage on the pool and await its result."""
+        with self._lock:
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._timed, time.monotonic(), fn, args, kwargs
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queue_depth": self._queued,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait_ms / self._completed, 2) if self._completed else 0.0,
+                "max_wait_ms": round(self._max_wait_ms, 2),
+            }
@@ -0,0 +1,95 @@
+import os
+import io
+import sys
+import time
+import glob
+import base64
+import argparse
+
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+
+# Run from anywhere: make the backend package and the DIP module importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../ml_pipeline")))
+from dip_module import apply_production_dip
+from app.services.encoders import encode_image, encode_many, to_data_uri
+
+ARTIFACTS = ("segmented", "gli", "lab", "combined")
+
+
+def legacy_data_uri(array):
+    """The previous preview path: PIL round trip, JPEG quality 85, base64."""
+    mode = "L" if array.ndim == 2 else "RGB"
+    buffered = io.BytesIO()
+    PILImage.fromarray(array.astype(np.uint8), mode=mode).save(buffered, format="JPEG", quality=85)
+    return "data:image/jpeg;base64," + base64.b64encode(buffered.getvalue()).decode()
+
+def synthetic_leaf(rng):
+    """Leaf-like test image: textured green ellipse with brown lesions on a soil background."""
+    img = np.empty((480, 640, 3), np.uint8)
+    img[:] = (40, 70, 110)
+    img = cv2.add(img, rng.integers(0, 40, img.shape, dtype=np.uint8))
+    center = (int(rng.integers(250, 390)), int(rng.integers(180, 300)))
+    cv2.ellipse(img, center, (int(rng.integers(150, 250)), int(rng.integers(90, 160))), int(rng.integers(0, 180)), 0, 360, (50, 160, 60), -1)
+    for _ in range(int(rng.integers(3, 12))):
+        spot = (center[0] + int(rng.integers(-120, 120)), center[1] + int(rng.integers(-70, 70)))
+        cv2.circle(img, spot, int(rng.integers(4, 16)), (30, 60, 120), -1)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+def load_inputs(image_dir, count):
+    if image_dir:
+        paths = sorted(glob.glob(os.path.join(image_dir, "**", "*.*"), recursive=True))[:count]
+        images = [cv2.imread(p) for p in paths]
+        return [img for img in images if img is not None]
+    rng = np.random.default_rng(0)
+    return [synthetic_leaf(rng) for _ in range(count)]
+
+def previews(img_bgr):
+    segmented_rgb, _, _, masks = apply_production_dip(img_bgr)
+    return [segmented_rgb, masks["gli"], masks["lab"], masks["combined"]]
+
+def main(image_dir=None, count=50, repeats=3):
+    sets = [previews(img) for img in load_inputs(image_dir, count)]
+    if not sets:
+        print("No images found.")
+        return
+    print(f"{len(sets)} preview sets ({'synthetic' if not image_dir else image_dir}), best of {repeats}\n")
+
+    def best_ms(fn):
+        timings = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - t0) * 1000)
+        return min(timings) / len(sets)
+
+    rows = []
+    for i, name in enumerate(ARTIFACTS):
+        legacy_bytes = np.mean([len(legacy_data_uri(s[i])) for s in sets])
+        new_bytes = np.mean([len(to_data_uri(*encode_image(s[i]))) for s in sets])
+        legacy_ms = best_ms(lambda: [legacy_data_uri(s[i]) for s in sets])
+        new_ms = best_ms(lambda: [encode_image(s[i]) for s in sets])
+        rows.append((name, legacy_bytes, new_bytes, legacy_ms, new_ms))
+
+    print(f"{'artifact':<10} {'legacy B':>10} {'new B':>10} {'ratio':>7} {'legacy ms':>10} {'new ms':>8}")
+    for name, legacy_bytes, new_bytes, legacy_ms, new_ms in rows:
+        print(f"{name:<10} {legacy_bytes:>10.0f} {new_bytes:>10.0f} {new_bytes / legacy_bytes:>7.2f} {legacy_ms:>10.3f} {new_ms:>8.3f}")
+
+    legacy_set_ms = best_ms(lambda: [[legacy_data_uri(a) for a in s] for s in sets])
+    serial_set_ms = best_ms(lambda: [[encode_image(a) for a in s] for s in sets])
+    parallel_set_ms = best_ms(lambda: [encode_many(s) for s in sets])
+    print("\nFull set of 4 per request:")
+    print(f"  bytes (data URI)     : {sum(r[1] for r in rows):.0f} -> {sum(r[2] for r in rows):.0f}")
+    print(f"  legacy PIL/JPEG      : {legacy_set_ms:.3f} ms")
+    print(f"  cv2 serial           : {serial_set_ms:.3f} ms")
+    print(f"  cv2 parallel (x4)    : {parallel_set_ms:.3f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare preview encoders: bytes and time per artifact.")
+    parser.add_argument("--images", default=None, help="Directory of images (default: synthetic leaves).")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args.images, args.count, args.repeats)
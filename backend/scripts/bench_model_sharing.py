@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import multiprocessing as mp
+
+import numpy as np
+
+# Run from anywhere: make the backend package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+ML_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../ml_pipeline"))
+SOCKET = "/tmp/cropsense-bench-sidecar.sock"
+
+
+def memory_kb(pid="self"):
+    """(RSS, PSS) in kB from /proc; PSS splits shared pages fairly between processes."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss, rss
+    return values.get("Rss", 0), values.get("Pss", 0)
+
+def _inputs(batch):
+    return np.random.default_rng(0).uniform(-1, 1, (batch, 224, 224, 3)).astype(np.float32)
+
+def _run_worker(layout, raw_path, dip_path, requests, start, results):
+    from app.services.engines import KerasEngine
+    from app.services.sidecar import SidecarEngine
+    if layout == "per-worker":
+        raw, dip = KerasEngine(raw_path), KerasEngine(dip_path)
+    else:
+        raw, dip = SidecarEngine("raw", SOCKET), SidecarEngine("dip", SOCKET)
+    x = _inputs(1)
+    raw.predict_on_batch(x), dip.predict_on_batch(x)  # warmup
+
+    start.wait()
+    t0 = time.perf_counter()
+    for _ in range(requests):
+        raw.predict_on_batch(x)
+        dip.predict_on_batch(x)
+    elapsed = time.perf_counter() - t0
+    results.put((elapsed, *memory_kb()))
+
+def serve_sidecar(raw_path, dip_path):
+    from app.services.engines import KerasEngine
+    from app.services.sidecar import SidecarServer
+    models = {"raw": KerasEngine(raw_path), "dip": KerasEngine(dip_path), "dual": None}
+    for engine in (models["raw"], models["dip"]):
+        engine.predict_on_batch(_inputs(1))
+    SidecarServer(models, SOCKET).serve_forever()
+
+def _start_sidecar(raw_path, dip_path):
+    """Separate interpreter, as in deployment (not a multiprocessing child of this script)."""
+    if os.path.exists(SOCKET):
+        os.remove(SOCKET)
+    proc = subprocess.Popen([sys.executable, __file__, "--serve-sidecar", "--raw", raw_path, "--dip", dip_path],
+                            stderr=subprocess.DEVNULL)
+    while not os.path.exists(SOCKET):
+        if proc.poll() is not None:
+            raise RuntimeError("Sidecar failed to start.")
+        time.sleep(0.2)
+    return proc
+
+def run_layout(ctx, layout, workers, requests, raw_path, dip_path):
+    sidecar = _start_sidecar(raw_path, dip_path) if layout == "sidecar" else None
+
+    start, results = ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=_run_worker, args=(layout, raw_path, dip_path, requests, start, results))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    time.sleep(1.0)
+    t0 = time.perf_counter()
+    start.set()
+    stats = [results.get() for _ in procs]
+    wall = time.perf_counter() - t0
+    for p in procs:
+        p.join()
+
+    rss = sum(s[1] for s in stats)
+    pss = sum(s[2] for s in stats)
+    if sidecar is not None:
+        sidecar_rss, sidecar_pss = memory_kb(sidecar.pid)
+        rss, pss = rss + sidecar_rss, pss + sidecar_pss
+        sidecar.terminate()
+        sidecar.wait()
+    return {
+        "throughput": workers * requests / wall,
+        "rss_mb": rss / 1024,
+        "pss_mb": pss / 1024,
+    }
+
+def main(workers=4, requests=50, raw_path=None, dip_path=None):
+    raw_path = raw_path or os.path.join(ML_DIR, "model_nodip.keras")
+    dip_path = dip_path or os.path.join(ML_DIR, "model_with_dip.keras")
+    for path in (raw_path, dip_path):
+        if not os.path.exists(path):
+            print(f"{path} not found.")
+            return
+
+    ctx = mp.get_context("spawn")
+    print(f"{workers} workers x {requests} requests (raw + DIP forward pass each, batch 1)\n")
+    print(f"{'layout':<12} {'req/s':>8} {'RSS MB':>9} {'PSS MB':>9}")
+    for layout in ("per-worker", "sidecar"):
+        r = run_layout(ctx, layout, workers, requests, raw_path, dip_path)
+        print(f"{layout:<12} {r['throughput']:>8.1f} {r['rss_mb']:>9.0f} {r['pss_mb']:>9.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and memory: per-worker models vs one inference sidecar.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--raw", default=None, help="Raw model (default: ml_pipeline/model_nodip.keras).")
+    parser.add_argument("--dip", default=None, help="DIP model (default: ml_pipeline/model_with_dip.keras).")
+    parser.add_argument("--serve-sidecar", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_sidecar:
+        serve_sidecar(args.raw, args.dip)
+    else:
+        main(args.workers, args.requests, args.raw, args.dip)
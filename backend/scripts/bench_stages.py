@@ -0,0 +1,199 @@
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import argparse
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+# Run from anywhere: make the backend package and the DIP module importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../ml_pipeline")))
+from dip_module import DipArena
+from benchmark_dip import synthetic_leaf
+from app.services.ingest import decode_upload
+from app.services.quality import assess_quality
+from app.services.encoders import encode_image, to_data_uri
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_stages_baseline.json")
+SIZES = {"224": (224, 224), "1mp": (864, 1152), "12mp": (3024, 4032)}
+SOURCES = ("noise", "leaf", "real")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+STAGES = ["decode", "resize"] + [name for name, _ in DipArena.STAGES] + ["quality_gate", "encode_mask", "encode_rgb", "data_uri"]
+
+
+def noise_image(rng, shape):
+    """Same recipe as data_prep.generate_synthetic_data: random colours with a green bias."""
+    img = rng.integers(0, 150, shape + (3,), dtype=np.uint8)
+    img[:, :, 1] = rng.integers(50, 255, shape, dtype=np.uint8)
+    return img
+
+def source_images(source, shape, count, real_dir=None, seed=0):
+    rng = np.random.default_rng(seed)
+    if source == "noise":
+        return [noise_image(rng, shape) for _ in range(count)]
+    if source == "leaf":
+        return [synthetic_leaf(rng, shape) for _ in range(count)]
+    paths = sorted(p for p in glob.glob(os.path.join(real_dir or "", "**", "*"), recursive=True)
+                   if p.lower().endswith(IMAGE_EXTENSIONS))[:count] if real_dir else []
+    images = [cv2.imread(p) for p in paths]
+    return [cv2.resize(img, shape[::-1], interpolation=cv2.INTER_AREA if img.shape[0] > shape[0] else cv2.INTER_CUBIC)
+            for img in images if img is not None]
+
+def time_image(img_bgr, arena, repeats):
+    """{stage: [ms per repeat]} for one photo through ingest, DIP, the quality gate and preview encoding."""
+    samples = {stage: [] for stage in STAGES}
+    jpeg = cv2.imencode(".jpg", img_bgr, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    for attempt in range(repeats + 1):  # first pass is warmup
+        timings = {}
+        t0 = time.perf_counter()
+        frame, _ = decode_upload(jpeg, size=(224, 224))
+        timings["decode"] = (time.perf_counter() - t0) * 1000
+        # DIP on the full-resolution photo, so the resize stage scales with the input
+        segmented, final_mask, _, _ = arena.run(img_bgr, timings=timings)
+        t0 = time.perf_counter()
+        assess_quality(frame)
+        timings["quality_gate"] = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        encode_image(final_mask)
+        timings["encode_mask"] = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        data, media_type = encode_image(segmented)
+        timings["encode_rgb"] = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        to_data_uri(data, media_type)
+        timings["data_uri"] = (time.perf_counter() - t0) * 1000
+        if attempt:
+            for stage in STAGES:
+                samples[stage].append(timings[stage])
+    return samples
+
+def run_suite(sizes=tuple(SIZES), sources=SOURCES, count=6, repeats=5, real_dir=None):
+    arena = DipArena()
+    cases = {}
+    for size in sizes:
+        for source in sources:
+            images = source_images(source, SIZES[size], count, real_dir)
+            if not images:
+                continue
+            samples = {stage: [] for stage in STAGES}
+            for img in images:
+                for stage, values in time_image(img, arena, repeats).items():
+                    samples[stage].extend(values)
+            cases[f"{source}@{size}"] = {
+                stage: {
+                    "median_ms": round(float(np.median(values)), 4),
+                    "p90_ms": round(float(np.percentile(values, 90)), 4),
+                    "min_ms": round(float(np.min(values)), 4),
+                }
+                for stage, values in samples.items()
+            }
+            print(f"  {source}@{size}: {len(images)} images x {repeats}")
+    return {
+        "version": 1,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "host": {
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+        },
+        "config": {"sizes": list(sizes), "sources": list(sources), "images": count, "repeats": repeats},
+        "cases": cases,
+    }
+
+def print_report(report):
+    for case, stages in report["cases"].items():
+        print(f"\n{case}")
+        print(f"  {'stage':<22} {'median ms':>10} {'p90 ms':>9}")
+        for stage, stats in stages.items():
+            print(f"  {stage:<22} {stats['median_ms']:>10.3f} {stats['p90_ms']:>9.3f}")
+
+def compare(baseline, current, tolerance=0.25, min_delta_ms=0.05):
+    """
+    Stages whose median is more than `tolerance` slower than the baseline, ignoring deltas
+    under `min_delta_ms` (timer noise on sub-0.1 ms stages). Returns a list of regressions.
+    """
+    regressions = []
+    for case, stages in current["cases"].items():
+        base_stages = baseline["cases"].get(case)
+        if base_stages is None:
+            print(f"\n{case}: not in baseline, skipped")
+            continue
+        print(f"\n{case}")
+        print(f"  {'stage':<22} {'baseline':>9} {'current':>9} {'ratio':>7}")
+        for stage, stats in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                print(f"  {stage:<22} {'-':>9} {stats['median_ms']:>9.3f}")
+                continue
+            ratio = stats["median_ms"] / max(base["median_ms"], 1e-9)
+            delta = stats["median_ms"] - base["median_ms"]
+            regressed = ratio > 1 + tolerance and delta > min_delta_ms
+            if regressed:
+                regressions.append({"case": case, "stage": stage, "baseline_ms": base["median_ms"],
+                                    "current_ms": stats["median_ms"], "ratio": round(ratio, 3)})
+            flag = "  REGRESSION" if regressed else ""
+            print(f"  {stage:<22} {base['median_ms']:>9.3f} {stats['median_ms']:>9.3f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+def main(compare_path=None, save_path=None, real_dir=None, sizes=None, sources=None,
+         count=6, repeats=5, tolerance=0.25, min_delta_ms=0.05):
+    baseline = None
+    if compare_path:
+        with open(compare_path) as f:
+            baseline = json.load(f)
+        # Same input matrix as the baseline unless overridden
+        config = baseline.get("config", {})
+        sizes = sizes or config.get("sizes")
+        sources = sources or config.get("sources")
+        count = config.get("images", count)
+        repeats = config.get("repeats", repeats)
+
+    sizes = sizes or list(SIZES)
+    sources = sources or list(SOURCES)
+    if "real" in sources and not real_dir:
+        sources = [s for s in sources if s != "real"]
+        print("No --real-dir given: real leaves skipped.")
+
+    print(f"Timing {len(sizes)} sizes x {len(sources)} sources...")
+    report = run_suite(sizes, sources, count, repeats, real_dir)
+
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved to {save_path}")
+
+    if baseline is None:
+        print_report(report)
+        return 0
+
+    if baseline.get("host", {}).get("machine") != report["host"]["machine"] or \
+            baseline.get("host", {}).get("cpus") != report["host"]["cpus"]:
+        print("Warning: baseline was recorded on a different host; ratios are indicative only.")
+    regressions = compare(baseline, report, tolerance, min_delta_ms)
+    print(f"\n{len(regressions)} stage(s) regressed beyond {tolerance:.0%}.")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage timings of ingest, DIP, quality gate and preview encoding.")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, default=None,
+                        help="Compare against a baseline JSON (default: the committed one); exit 1 on regressions.")
+    parser.add_argument("--save", nargs="?", const=BASELINE_PATH, default=None,
+                        help="Write results as JSON (default: overwrite the committed baseline).")
+    parser.add_argument("--real-dir", default=None, help="Directory of real leaf photos for the 'real' source.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=None)
+    parser.add_argument("--sources", nargs="+", choices=list(SOURCES), default=None)
+    parser.add_argument("--images", type=int, default=6, help="Images per case.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed median slowdown (0.25 = 25%%).")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05)
+    args = parser.parse_args()
+    raise SystemExit(main(args.compare, args.save, args.real_dir, args.sizes, args.sources,
+                          args.images, args.repeats, args.tolerance, args.min_delta_ms))
@@ -0,0 +1,43 @@
+import os
+import sys
+import signal
+import asyncio
+import logging
+import argparse
+
+# Run from anywhere: make the backend package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app.db.session import engine
+from app.db import models
+from app.api import jobs
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    # No interactive traffic in this process; the OS priority keeps it behind the API workers
+    await jobs.run_worker(stop, should_yield=None)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk diagnosis job worker (run one or more alongside the API).")
+    parser.add_argument("--nice", type=int, default=10, help="Scheduling niceness increment (POSIX only).")
+    args = parser.parse_args()
+
+    if args.nice and hasattr(os, "nice"):
+        os.nice(args.nice)
+    models.Base.metadata.create_all(bind=engine)
+    asyncio.run(main())
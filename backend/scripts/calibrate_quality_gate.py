@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Run from anywhere: make the backend package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../ml_pipeline")))
+from app.services.ingest import decode_upload
+from app.services.quality import (
+    CALIBRATION_PATH, DEFAULT_CALIBRATION, QUALITY_LEVEL_SIZE, quality_level, measure_level, assess_quality,
+)
+
+from dataset_cache import list_split, split_exists
+from dip_module import resize_image
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+VAL_DIR = os.path.join(ROOT_DIR, "data_split", "val")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def reference_gate(img_bgr):
+    """
+    The gate as it ran before services/quality.py, on the full-resolution frame it was given
+    (cv2.imread of the upload): float64 Laplacian and extreme-pixel counts over every pixel,
+    ExG on a 64x64 resize_image.
+    """
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    small = resize_image(img_bgr, (64, 64)).astype(np.int16)
+    exg_small = 2 * small[..., 1] - small[..., 2] - small[..., 0]
+    return {
+        "blur_variance": cv2.Laplacian(gray, cv2.CV_64F).var(),
+        "dark_percent": np.sum(gray < 40) / gray.size * 100,
+        "bright_percent": np.sum(gray > 215) / gray.size * 100,
+        "green_ratio": np.sum(exg_small > 20) / (64 * 64),
+    }
+
+def best_threshold(values, positive, below=True):
+    """
+    Threshold t maximising agreement between (values < t if below else values > t) and the
+    reference decisions `positive`. Returns (t, agreement fraction).
+    """
+    order = np.argsort(values, kind="stable")
+    v, p = values[order], positive[order]
+    n = len(v)
+    pos_before = np.concatenate([[0], np.cumsum(p)])        # positives among the first i values
+    neg_before = np.arange(n + 1) - pos_before
+    pos_after = pos_before[-1] - pos_before
+    neg_after = neg_before[-1] - neg_before
+    agree = pos_before + neg_after if below else neg_before + pos_after
+    # Only cut between distinct values
+    valid = np.ones(n + 1, bool)
+    valid[1:n] = v[1:] > v[:-1]
+    agree = np.where(valid, agree, -1)
+    i = int(np.argmax(agree))
+    if i == 0:
+        t = v[0] - 1e-6
+    elif i == n:
+        t = v[-1] + 1e-6
+    else:
+        t = (v[i - 1] + v[i]) / 2
+    return float(t), float(agree[i]) / n
+
+def _decode_full(contents):
+    return cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+
+def _measure(path, level_size):
+    """Baseline gate on the full-resolution decode, and the level measured as served (224 ingest)."""
+    with open(path, "rb") as f:
+        contents = f.read()
+    full_bgr = _decode_full(contents)
+    img_bgr, _ = decode_upload(contents, size=(224, 224))
+    if full_bgr is None or img_bgr is None:
+        return None
+    m = measure_level(quality_level(img_bgr, level_size))
+    m.pop("gray")
+    return reference_gate(full_bgr), m
+
+def main(val_dir=VAL_DIR, output=CALIBRATION_PATH, level_size=QUALITY_LEVEL_SIZE, max_images=None, workers=8):
+    # Split manifest (data_prep.py) or materialized directory; manifest paths are relative to the repo root
+    paths = list_split(val_dir)[0] if split_exists(val_dir) else []
+    paths = [os.path.join(ROOT_DIR, p) for p in paths if p.lower().endswith(IMAGE_EXTENSIONS)][:max_images]
+    if not paths:
+        print(f"No images found in {val_dir}.")
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pairs = [r for r in pool.map(lambda p: _measure(p, level_size), paths) if r is not None]
+    ref = {k: np.array([r[k] for r, _ in pairs]) for k in pairs[0][0]}
+    lvl = {k: np.array([m[k] for _, m in pairs]) for k in pairs[0][1]}
+    base = DEFAULT_CALIBRATION
+
+    blur_t, blur_agree = best_threshold(lvl["laplacian_variance"], ref["blur_variance"] < base["blur_threshold"])
+    dark_t, dark_agree = best_threshold(lvl["dark_percent"], ref["dark_percent"] > base["dark_percent"], below=False)
+    bright_t, bright_agree = best_threshold(lvl["bright_percent"], ref["bright_percent"] > base["bright_percent"], below=False)
+    green_t, green_agree = best_threshold(lvl["green_ratio"], ref["green_ratio"] < base["green_ratio"])
+
+    calibration = {
+        "level_size": level_size,
+        "blur_scale": base["blur_threshold"] / blur_t,
+        "blur_threshold": base["blur_threshold"],
+        "dark_percent": dark_t,
+        "bright_percent": bright_t,
+        "green_ratio": green_t,
+    }
+
+    # End-to-end decision agreement with the calibrated module
+    ref_dip = (ref["blur_variance"] < base["blur_threshold"]) | (ref["dark_percent"] > base["dark_percent"]) | (ref["bright_percent"] > base["bright_percent"])
+    ref_leaf = ref["green_ratio"] >= base["green_ratio"]
+    new_blurry = lvl["laplacian_variance"] * calibration["blur_scale"] < calibration["blur_threshold"]
+    new_dip = new_blurry | (lvl["dark_percent"] > dark_t) | (lvl["bright_percent"] > bright_t)
+    new_leaf = lvl["green_ratio"] >= green_t
+
+    # Gate cost on one image, before (full-resolution baseline) and after (single level of the 224 ingest)
+    with open(paths[0], "rb") as f:
+        contents = f.read()
+    full_frame = _decode_full(contents)
+    frame, _ = decode_upload(contents, size=(224, 224))
+    t0 = time.perf_counter()
+    for _ in range(200):
+        reference_gate(full_frame)
+    ref_ms = (time.perf_counter() - t0) / 200 * 1000
+    t0 = time.perf_counter()
+    for _ in range(200):
+        assess_quality(frame, calibration)
+    new_ms = (time.perf_counter() - t0) / 200 * 1000
+
+    report = {
+        **calibration,
+        "source": os.path.relpath(val_dir, os.path.dirname(output)) if os.path.isabs(val_dir) else val_dir,
+        "images": len(pairs),
+        "agreement": {
+            "blur": round(blur_agree, 4),
+            "dark": round(dark_agree, 4),
+            "bright": round(bright_agree, 4),
+            "green": round(green_agree, 4),
+            "force_dip_decision": round(float(np.mean(ref_dip == new_dip)), 4),
+            "leaf_decision": round(float(np.mean(ref_leaf == new_leaf)), 4),
+        },
+        "gate_ms": {"baseline_full_resolution": round(ref_ms, 4), "level": round(new_ms, 4)},
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n========= QUALITY GATE CALIBRATION =========")
+    print(f"Images                 : {len(pairs)} ({val_dir})")
+    print(f"Level                  : {level_size}x{level_size}")
+    print(f"Blur scale / threshold : {calibration['blur_scale']:.4f} (level variance < {blur_t:.1f})")
+    print(f"Dark / bright percent  : {dark_t:.2f} / {bright_t:.2f}")
+    print(f"Green ratio            : {green_t:.4f}")
+    print(f"Agreement w/ baseline  : {report['agreement']}")
+    print(f"Gate cost              : {ref_ms:.3f} ms -> {new_ms:.3f} ms")
+    print(f"Saved to {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the downscaled quality gate to the original full-resolution gate's decisions.")
+    parser.add_argument("--val-dir", default=VAL_DIR)
+    parser.add_argument("--output", default=CALIBRATION_PATH)
+    parser.add_argument("--level-size", type=int, default=QUALITY_LEVEL_SIZE)
+    parser.add_argument("--max-images", type=int, default=None)
+    args = parser.parse_args()
+    main(args.val_dir, args.output, args.level_size, args.max_images)
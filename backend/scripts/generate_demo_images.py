@@ -7,6 +7,7 @@ import sys
 # Ensure custom paths are accessible 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../ml_pipeline")))
 from dip_module import apply_production_dip
+from dataset_cache import list_split, split_exists
 from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
 
 CLASS_NAMES = [
@@ -24,7 +25,8 @@ CLASS_NAMES = [
     'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus', 'Tomato___healthy'
 ]
 
-VAL_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../data_split/val"))
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+VAL_DIR = os.path.join(ROOT_DIR, "data_split", "val")
 OUT_DIR = r"C:\Users\mahab\JARVIs\CropSenseAI\test_assets_demo"
 
 os.makedirs(OUT_DIR, exist_ok=True)
@@ -56,22 +58,27 @@ def predict_model(model, img_bgr):
     idx = np.argmax(preds)
     return idx, float(preds[idx])
 
+# Validation files per class, from the split manifest or materialized directory (repo-relative paths)
+val_files = {}
+if split_exists(VAL_DIR):
+    val_paths, val_labels, val_classes = list_split(VAL_DIR)
+    for path, label in zip(val_paths, val_labels):
+        val_files.setdefault(val_classes[label], []).append(os.path.join(ROOT_DIR, path))
+
 found_count = 0
 
 for target_class in TARGET_CLASSES:
     if found_count >= 3: break
     
-    class_dir = os.path.join(VAL_DIR, target_class)
-    if not os.path.exists(class_dir):
-        print(f"Skipping {target_class}, dir missing.")
+    if target_class not in val_files:
+        print(f"Skipping {target_class}, no validation images.")
         continue
         
     print(f"\nSearching for goldilocks image in {target_class}...")
     
     # Try images until we find one that mathematically proves the DIP engine
     found_for_class = False
-    for filename in os.listdir(class_dir)[:50]:
-        img_path = os.path.join(class_dir, filename)
+    for img_path in val_files[target_class][:50]:
         img_bgr = cv2.imread(img_path)
         if img_bgr is None: continue
         
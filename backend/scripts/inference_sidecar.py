@@ -0,0 +1,34 @@
+import os
+import sys
+import logging
+import argparse
+
+# Run from anywhere: make the backend package importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app.api import predict
+from app.services.sidecar import SidecarServer, INFERENCE_SIDECAR
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per-node inference process: loads the models once and serves every API worker "
+                    "that runs with the same INFERENCE_SIDECAR address."
+    )
+    parser.add_argument("--address", default=INFERENCE_SIDECAR or "/tmp/cropsense-inference.sock",
+                        help="Unix socket path or host:port (default: INFERENCE_SIDECAR).")
+    args = parser.parse_args()
+
+    # Load locally (Keras / TFLite / dual-head, as configured) and warm up before accepting workers
+    status = predict.warmup_models(use_sidecar=False)
+    if not status["models_loaded"]:
+        sys.exit(f"Models not found, nothing to serve ({status['error'] or 'see ml_pipeline/'}).")
+    SidecarServer(predict.models_cache, args.address).serve_forever()
@@ -1,57 +1,58 @@
 import os
 import cv2
 import numpy as np
-import tensorflow as tf
 import matplotlib.pyplot as plt
 import sys
 
 sys.path.append(os.path.abspath("ml_pipeline"))
-from dip_module import apply_dip_pipeline
+from dip_module import apply_production_dip, resize_image, DIP_SIZE
+from dataset_cache import list_split
+from eval_engine import EvaluationEngine
 
-def apply_synthetic_blur(image_path, kernel_size=(15, 15)):
-    img_bgr = cv2.imread(image_path)
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+BLUR_KERNEL = (21, 21)
+
+def apply_synthetic_blur(img_bgr, kernel_size=BLUR_KERNEL):
     # Apply heavy Gaussian Blur to simulate bad camera focus
-    blurred_rgb = cv2.GaussianBlur(img_rgb, kernel_size, 0)
-    return img_rgb, blurred_rgb
+    return cv2.GaussianBlur(img_bgr, kernel_size, 0)
 
-def prove_blur_recovery():
-    print("Loading Baseline (Raw) and Production (DIP) Models...")
-    model_raw = tf.keras.models.load_model("ml_pipeline/model_nodip.keras")
-    model_dip = tf.keras.models.load_model("ml_pipeline/model_with_dip.keras")
-    
+def prove_blur_recovery(refresh=False):
     val_dir = "data_split/val"
-    classes = sorted(os.listdir(val_dir))
+    paths, labels, classes = list_split(val_dir)
     
     # Select an image that is highly likely to be confused if blurred
     # We will just pick the first image in Apple___Apple_scab or similar
-    import glob
-    test_files = glob.glob("data_split/val/*/*")
-    test_image_path = test_files[0]
-    true_class_name = test_image_path.split(os.sep)[-2]
+    test_image_path = paths[0]
+    true_class_name = classes[labels[0]]
     
     print(f"Testing Blur Robustness on: {true_class_name}")
     
-    img_orig, img_blurred = apply_synthetic_blur(test_image_path, kernel_size=(21, 21))
-    
-    # Save the blurred image temporarily to ingest it via the standard pipelines
-    temp_blur_path = "temp_blurred_test.jpg"
-    cv2.imwrite(temp_blur_path, cv2.cvtColor(img_blurred, cv2.COLOR_RGB2BGR))
+    # The blurred image is decoded once and fed to both models from memory
+    print("Scoring Baseline (Raw) and Production (DIP) Models...")
+    engine = EvaluationEngine(classes)
+    engine.register("model_raw", "ml_pipeline/model_nodip.keras", "raw")
+    engine.register("model_dip", "ml_pipeline/model_with_dip.keras", "dip")
+    predictions = engine.run(f"blur_recovery_{BLUR_KERNEL[0]}", [test_image_path], [labels[0]],
+                             transform=apply_synthetic_blur, refresh=refresh)
+    if len(predictions) < 2:
+        return
     
-    # 1. Feed into Raw Model A (Expect Failure)
-    raw_input = apply_dip_pipeline(temp_blur_path, use_dip=False)
-    raw_preds = model_raw.predict(np.expand_dims(raw_input, axis=0), verbose=0)[0]
+    # 1. Raw Model A (Expect Failure)
+    raw_preds = predictions["model_raw"]["probs"][0]
     raw_pred_idx = np.argmax(raw_preds)
     raw_pred_class = classes[raw_pred_idx]
     raw_conf = raw_preds[raw_pred_idx] * 100
     
-    # 2. Feed into DIP Model B (Expect Recovery)
-    dip_input = apply_dip_pipeline(temp_blur_path, use_dip=True)
-    dip_preds = model_dip.predict(np.expand_dims(dip_input, axis=0), verbose=0)[0]
+    # 2. DIP Model B (Expect Recovery)
+    dip_preds = predictions["model_dip"]["probs"][0]
     dip_pred_idx = np.argmax(dip_preds)
     dip_pred_class = classes[dip_pred_idx]
     dip_conf = dip_preds[dip_pred_idx] * 100
     
+    img_bgr = cv2.imread(test_image_path)
+    blurred_bgr = apply_synthetic_blur(img_bgr)
+    img_orig = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+    img_blurred = cv2.cvtColor(blurred_bgr, cv2.COLOR_BGR2RGB)
+    
     # Visual Output Formulation
     plt.figure(figsize=(14, 6))
     
@@ -67,12 +68,7 @@ def prove_blur_recovery():
     plt.axis('off')
     
     # Calculate exactly what DIP did visually to the blurred image for the 3rd panel
-    from ml_pipeline.dip_module import apply_median_filter, apply_clahe, hsv_segmentation, apply_sharpening
-    img_dip_recovered = cv2.resize(img_blurred, (224, 224))
-    img_dip_recovered = apply_median_filter(img_dip_recovered)
-    img_dip_recovered = apply_clahe(img_dip_recovered)
-    img_dip_recovered, _ = hsv_segmentation(img_dip_recovered)
-    img_dip_recovered = apply_sharpening(img_dip_recovered)
+    img_dip_recovered, _, _, _ = apply_production_dip(resize_image(blurred_bgr, DIP_SIZE))
     
     plt.subplot(1, 3, 3)
     plt.imshow(img_dip_recovered)
@@ -92,9 +88,6 @@ def prove_blur_recovery():
     print(f"DIP Model    : {dip_pred_class} ({dip_conf:.1f}%) -> {'CORRECT' if dip_pred_class == true_class_name else 'FAILED'}")
     print("==========================================")
     print("Saved visual proof to blur_recovery_comparison.png")
-    
-    if os.path.exists(temp_blur_path):
-        os.remove(temp_blur_path)
 
 if __name__ == "__main__":
     prove_blur_recovery()
@@ -4,22 +4,24 @@ import os
 import sys
 
 sys.path.append(os.path.abspath("ml_pipeline"))
-from train import CropDataGenerator
+from train import data_generator, fit_input, LOADERS
 
-def run_finetuning():
+def run_finetuning(loader="cache"):
     base_dir = "data_split"
     
-    # Using the identical custom data generator
+    # Same inputs as train.py, read from the precomputed dataset cache
     print("Initializing Generators (Subsampled for speed)...")
-    train_gen = CropDataGenerator(
+    train_gen = data_generator(
         os.path.join(base_dir, 'train'),
         batch_size=32,
-        use_dip=True
+        use_dip=True,
+        loader=loader
     )
-    val_gen = CropDataGenerator(
+    val_gen = data_generator(
         os.path.join(base_dir, 'val'),
         batch_size=32,
-        use_dip=True
+        use_dip=True,
+        loader=loader
     )
 
     model_path = "ml_pipeline/model_with_dip.keras"
@@ -41,8 +43,8 @@ def run_finetuning():
 
     print("Executing Deep Adaptation Pass (3 Epochs)...")
     model.fit(
-        train_gen, 
-        validation_data=val_gen, 
+        fit_input(train_gen), 
+        validation_data=fit_input(val_gen), 
         epochs=3, 
         steps_per_epoch=50, 
         validation_steps=10
@@ -53,4 +55,8 @@ def run_finetuning():
     print(f"Fine-tuning optimization complete. Production weights Overwritten at {output_path}")
 
 if __name__ == "__main__":
-    run_finetuning()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--loader', choices=LOADERS, default="cache", help="Input pipeline (see train.data_generator)")
+    args = parser.parse_args()
+    run_finetuning(loader=args.loader)
@@ -11,7 +11,7 @@ import DipComparison from "@/components/DipComparison";
 import dynamic from "next/dynamic";
 import { motion, AnimatePresence } from "framer-motion";
 import { LogOut, Leaf, AlertTriangle, Info, Map as MapIcon, History, Activity, Shield, Zap, LayoutList, Stethoscope, Microscope, Sparkles } from "lucide-react";
-import api from "@/lib/api";
+import api, { artifactUrl } from "@/lib/api";
 
 const HeatMap = dynamic(() => import("@/components/HeatMap"), { ssr: false });
 
@@ -169,6 +169,8 @@ export default function Home() {
   const [uploading, setUploading] = useState(false);
   const [result, setResult] = useState<any>(null);
   const [dipData, setDipData] = useState<any>(null);
+  // DIP previews: artifact URL from the backend, or inline base64 from older servers
+  const preview = (field: string) => artifactUrl(result?.diagnostics?.[`${field}_url`]) ?? result?.diagnostics?.[`${field}_base64`];
   const [dipLoading, setDipLoading] = useState(false);
   const [uploadedFile, setUploadedFile] = useState<File | null>(null);
   const [activeTab, setActiveTab] = useState<"overview" | "treatment" | "map" | "technical">("overview");
@@ -589,7 +591,7 @@ export default function Home() {
                               </div>
                             </div>
 
-                            {result.diagnostics.inference_mode === "DIP_RECOVERY" && result.diagnostics.mask_preview_base64 && (
+                            {result.diagnostics.inference_mode === "DIP_RECOVERY" && preview("mask_preview") && (
                               <div className="pt-4 border-t" style={{ borderColor: 'var(--border-glass)' }}>
                                 <h3 className="text-xs uppercase font-medium mb-3" style={{ color: 'var(--text-muted)' }}>{t.techDIPIntervention}</h3>
                                 <p className="text-xs leading-relaxed mb-4" style={{ color: 'var(--text-muted)' }}>
@@ -598,19 +600,19 @@ export default function Home() {
                                 <div className="grid grid-cols-2 md:grid-cols-4 gap-4">
                                   <div className="bg-black/20 rounded-xl p-2 text-center text-[10px] text-gray-400">
                                     {t.techMaskGLI}
-                                    {result.diagnostics.gli_mask_base64 && <img src={result.diagnostics.gli_mask_base64} alt="GLI Mask" className="mt-2 rounded-lg w-full border border-white/5 object-contain max-h-32 mx-auto" />}
+                                    {preview("gli_mask") && <img src={preview("gli_mask")} alt="GLI Mask" className="mt-2 rounded-lg w-full border border-white/5 object-contain max-h-32 mx-auto" />}
                                   </div>
                                   <div className="bg-black/20 rounded-xl p-2 text-center text-[10px] text-gray-400">
                                     {t.techMaskLAB}
-                                    {result.diagnostics.lab_mask_base64 && <img src={result.diagnostics.lab_mask_base64} alt="LAB Mask" className="mt-2 rounded-lg w-full border border-white/5 object-contain max-h-32 mx-auto" />}
+                                    {preview("lab_mask") && <img src={preview("lab_mask")} alt="LAB Mask" className="mt-2 rounded-lg w-full border border-white/5 object-contain max-h-32 mx-auto" />}
                                   </div>
                                   <div className="bg-black/20 rounded-xl p-2 text-center text-[10px] text-gray-400">
                                     {t.techMaskAND}
-                                    {result.diagnostics.combined_mask_base64 && <img src={result.diagnostics.combined_mask_base64} alt="Combined Mask" className="mt-2 rounded-lg w-full border border-white/5 object-contain max-h-32 mx-auto" />}
+                                    {preview("combined_mask") && <img src={preview("combined_mask")} alt="Combined Mask" className="mt-2 rounded-lg w-full border border-white/5 object-contain max-h-32 mx-auto" />}
                                   </div>
                                   <div className="bg-black/20 rounded-xl p-2 text-center text-[10px] text-emerald-400 font-bold">
                                     {t.techMaskFinal}
-                                    <img src={result.diagnostics.mask_preview_base64} alt="Final Mask" className="mt-2 rounded-lg w-full border border-emerald-500/20 object-contain max-h-32 mx-auto" />
+                                    <img src={preview("mask_preview")} alt="Final Mask" className="mt-2 rounded-lg w-full border border-emerald-500/20 object-contain max-h-32 mx-auto" />
                                   </div>
                                 </div>
                                 <div className="mt-5 text-center p-3 rounded-lg border border-emerald-500/20" style={{ background: 'rgba(52, 211, 153, 0.08)' }}>
@@ -24,4 +24,7 @@ api.interceptors.request.use((config) => {
     return config;
 });
 
+// Diagnostic previews come back as "/api/artifacts/<hash>" paths served by the backend
+export const artifactUrl = (path?: string | null) => path ? new URL(path, API_URL).toString() : undefined;
+
 export default api;
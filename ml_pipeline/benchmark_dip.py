@@ -0,0 +1,147 @@
+import os
+import glob
+import time
+import argparse
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from dip_module import apply_production_dip, apply_production_dip_batch, apply_production_dip_reference, dip_arena, resize_image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+BATCH_SIZES = (1, 8, 32, 128)
+
+
+def synthetic_leaf(rng, shape=(480, 640)):
+    """Textured green ellipse with brown lesions on a soil background."""
+    h, w = shape
+    img = np.empty((h, w, 3), np.uint8)
+    img[:] = (40, 70, 110)
+    img = cv2.add(img, rng.integers(0, 40, img.shape, dtype=np.uint8))
+    center = (int(rng.integers(w // 3, 2 * w // 3)), int(rng.integers(h // 3, 2 * h // 3)))
+    axes = (int(rng.integers(w // 5, w // 3)), int(rng.integers(h // 5, h // 3)))
+    cv2.ellipse(img, center, axes, int(rng.integers(0, 180)), 0, 360, (50, 160, 60), -1)
+    for _ in range(int(rng.integers(3, 12))):
+        spot = (center[0] + int(rng.integers(-axes[0] // 2, axes[0] // 2 + 1)),
+                center[1] + int(rng.integers(-axes[1] // 2, axes[1] // 2 + 1)))
+        cv2.circle(img, spot, int(rng.integers(2, 16)), (30, 60, 120), -1)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+def golden_images(count=64, seed=0):
+    """
+    Deterministic golden set: synthetic leaves at several input sizes plus the edge cases
+    that take different branches (no foreground, all foreground, noise, a single colour).
+    """
+    rng = np.random.default_rng(seed)
+    shapes = [(224, 224), (480, 640), (1200, 1600), (300, 200)]
+    images = [synthetic_leaf(rng, shapes[i % len(shapes)]) for i in range(count)]
+    images += [
+        np.zeros((224, 224, 3), np.uint8),
+        np.full((224, 224, 3), 255, np.uint8),
+        np.full((224, 224, 3), (40, 180, 50), np.uint8),
+        rng.integers(0, 256, (224, 224, 3), dtype=np.uint8),
+        rng.integers(0, 256, (333, 517, 3), dtype=np.uint8),
+    ]
+    return images
+
+def load_images(image_dir, count):
+    paths = sorted(p for p in glob.glob(os.path.join(image_dir, "**", "*"), recursive=True)
+                   if p.lower().endswith(IMAGE_EXTENSIONS))[:count]
+    return [img for img in (cv2.imread(p) for p in paths) if img is not None]
+
+def check_golden(images):
+    """Every output of apply_production_dip against the reference implementation, bit for bit."""
+    mismatches = []
+    for i, img in enumerate(images):
+        ref_rgb, ref_mask, _, ref_masks = apply_production_dip_reference(img)
+        rgb, mask, _, masks = apply_production_dip(img, copy=False)
+        same = np.array_equal(rgb, ref_rgb) and np.array_equal(mask, ref_mask)
+        same = same and all(np.array_equal(masks[k], ref_masks[k]) for k in ref_masks)
+        if not same:
+            mismatches.append(i)
+    return mismatches
+
+def check_batch(images, batch_size=8):
+    """apply_production_dip_batch against the reference, image by image, in chunks of batch_size."""
+    mismatches = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        rgb, mask, _, masks = apply_production_dip_batch(np.stack([resize_image(img) for img in chunk]))
+        for k, img in enumerate(chunk):
+            ref_rgb, ref_mask, _, ref_masks = apply_production_dip_reference(img)
+            same = np.array_equal(rgb[k], ref_rgb) and np.array_equal(mask[k], ref_mask)
+            if not (same and all(np.array_equal(masks[m][k], ref_masks[m]) for m in ref_masks)):
+                mismatches.append(start + k)
+    return mismatches
+
+def batch_throughput(frames, batch_sizes=BATCH_SIZES, repeats=3):
+    """Images/sec of the per-image loop vs apply_production_dip_batch at each batch size."""
+    rows = []
+    for batch_size in batch_sizes:
+        stack = np.stack([frames[i % len(frames)] for i in range(batch_size)])
+        apply_production_dip_batch(stack)
+        loop_ms = batch_ms = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            for img in stack:
+                apply_production_dip(img)
+            loop_ms = min(loop_ms, (time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            apply_production_dip_batch(stack)
+            batch_ms = min(batch_ms, (time.perf_counter() - t0) * 1000)
+        rows.append((batch_size, batch_size / loop_ms * 1000, batch_size / batch_ms * 1000))
+    return rows
+
+def _best_ms(fn, images, repeats):
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for img in images:
+            fn(img)
+        timings.append((time.perf_counter() - t0) * 1000 / len(images))
+    return min(timings)
+
+def _allocated_kb(fn, img):
+    tracemalloc.start()
+    fn(img)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+def main(image_dir=None, count=64, repeats=5):
+    images = load_images(image_dir, count) if image_dir else golden_images(count)
+    if not images:
+        print(f"No images found in {image_dir}.")
+        return False
+    dip_arena()  # build the lookup tables outside the timings
+
+    mismatches = check_golden(images)
+    batch_mismatches = check_batch(images)
+    print(f"Golden set: {len(images)} images ({image_dir or 'synthetic'})")
+    print(f"Bit-exact : {'yes' if not mismatches else f'NO, {len(mismatches)} mismatches: {mismatches[:10]}'}")
+    print(f"Batch API : {'yes' if not batch_mismatches else f'NO, {len(batch_mismatches)} mismatches: {batch_mismatches[:10]}'}")
+
+    frames = [cv2.resize(img, (224, 224)) for img in images]
+    variants = [
+        ("reference", apply_production_dip_reference),
+        ("arena + copy", apply_production_dip),
+        ("arena, views", lambda img: apply_production_dip(img, copy=False)),
+    ]
+    print(f"\n{'variant':<14} {'ms/img':>8} {'peak KB':>9}   (224x224 input, best of {repeats})")
+    for name, fn in variants:
+        fn(frames[0])
+        print(f"{name:<14} {_best_ms(fn, frames, repeats):>8.3f} {_allocated_kb(fn, frames[0]):>9.1f}")
+
+    print(f"\n{'batch':>6} {'loop img/s':>11} {'batch img/s':>12} {'speedup':>8}")
+    for batch_size, loop_ips, batch_ips in batch_throughput(frames):
+        print(f"{batch_size:>6} {loop_ips:>11.1f} {batch_ips:>12.1f} {batch_ips / loop_ips:>7.2f}x")
+    return not mismatches and not batch_mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check apply_production_dip against the reference and time both.")
+    parser.add_argument("--images", default=None, help="Directory of golden images (default: synthetic set).")
+    parser.add_argument("--count", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    raise SystemExit(0 if main(args.images, args.count, args.repeats) else 1)
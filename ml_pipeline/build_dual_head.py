@@ -0,0 +1,102 @@
+import os
+import numpy as np
+import tensorflow as tf
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_MODEL_PATH = os.path.join(MODEL_DIR, "model_nodip.keras")
+DIP_MODEL_PATH = os.path.join(MODEL_DIR, "model_with_dip.keras")
+DUAL_MODEL_PATH = os.path.join(MODEL_DIR, "model_dual_head.keras")
+# Max |softmax diff| allowed between a dual-head output and its source model: the same
+# float32 ops run in both graphs, so anything above rounding noise means a wrong split
+PARITY_TOLERANCE = 1e-5
+
+def _same_operation(op_a, op_b):
+    """Same name, same type and bit-identical weights."""
+    if op_a.name != op_b.name or type(op_a) is not type(op_b):
+        return False
+    w_a = [np.asarray(w) for w in getattr(op_a, "weights", [])]
+    w_b = [np.asarray(w) for w in getattr(op_b, "weights", [])]
+    return len(w_a) == len(w_b) and all(
+        x.shape == y.shape and np.array_equal(x, y) for x, y in zip(w_a, w_b)
+    )
+
+def _cut_points(ops):
+    """
+    Indices k where the graph can be split into ops[:k+1] and ops[k+1:] through the single
+    tensor ops[k].output, i.e. no later operation reads anything produced before k
+    (MobileNetV3 residual and squeeze-excite branches rule out most positions).
+    """
+    position = {op.name: i for i, op in enumerate(ops)}
+    earliest_parent = []
+    for i, op in enumerate(ops):
+        parents = [position[p.operation.name] for node in op._inbound_nodes for p in node.parent_nodes]
+        earliest_parent.append(min(parents) if parents else i)
+
+    cuts = []
+    reach = len(ops)
+    for k in range(len(ops) - 1, -1, -1):
+        if k < len(ops) - 1 and reach >= k:
+            cuts.append(k)
+        reach = min(reach, earliest_parent[k])
+    return sorted(cuts)
+
+def find_shared_prefix(model_a, model_b):
+    """Return the deepest cut index whose whole prefix is shared by both models, or None."""
+    ops_a, ops_b = model_a.operations, model_b.operations
+    shared = 0
+    while shared < min(len(ops_a), len(ops_b)) and _same_operation(ops_a[shared], ops_b[shared]):
+        shared += 1
+    cuts = [k for k in _cut_points(ops_a) if k < shared]
+    return cuts[-1] if cuts else None
+
+def build_dual_head(raw_model, dip_model):
+    """
+    Compose one serving graph: the shared frozen trunk runs once per image and feeds
+    both the raw and the DIP heads. Outputs [raw_probs, dip_probs] for every row.
+    """
+    k = find_shared_prefix(raw_model, dip_model)
+    if k is None:
+        raise ValueError("Models do not share a backbone prefix.")
+    raw_ops, dip_ops = raw_model.operations, dip_model.operations
+
+    trunk = tf.keras.Model(raw_model.input, raw_ops[k].output, name="shared_trunk")
+    head_raw = tf.keras.Model(raw_ops[k].output, raw_model.output, name="head_raw")
+    head_dip = tf.keras.Model(dip_ops[k].output, dip_model.output, name="head_dip")
+
+    inputs = tf.keras.Input(shape=raw_model.input_shape[1:])
+    features = trunk(inputs)
+    dual = tf.keras.Model(inputs, [head_raw(features), head_dip(features)], name="dual_head")
+    return dual, raw_ops[k].name
+
+def verify(dual, raw_model, dip_model, num_samples=4):
+    x = np.random.default_rng(0).uniform(0, 255, (num_samples,) + raw_model.input_shape[1:]).astype(np.float32)
+    raw_out, dip_out = dual.predict_on_batch(x)
+    return (
+        float(np.max(np.abs(np.asarray(raw_out) - raw_model.predict_on_batch(x)))),
+        float(np.max(np.abs(np.asarray(dip_out) - dip_model.predict_on_batch(x)))),
+    )
+
+def main(raw_path=RAW_MODEL_PATH, dip_path=DIP_MODEL_PATH, output_path=DUAL_MODEL_PATH, tolerance=PARITY_TOLERANCE):
+    for path in (raw_path, dip_path):
+        if not os.path.exists(path):
+            print(f"{path} not found.")
+            return
+
+    raw_model = tf.keras.models.load_model(raw_path)
+    dip_model = tf.keras.models.load_model(dip_path)
+
+    dual, cut_name = build_dual_head(raw_model, dip_model)
+    raw_diff, dip_diff = verify(dual, raw_model, dip_model)
+
+    separate = raw_model.count_params() + dip_model.count_params()
+    print("\n========= DUAL-HEAD SERVING MODEL =========")
+    print(f"Shared trunk ends at  : {cut_name}")
+    print(f"Parameters            : {dual.count_params():,} (separate models: {separate:,})")
+    print(f"Max |diff| raw / dip  : {raw_diff:.2e} / {dip_diff:.2e}")
+    if max(raw_diff, dip_diff) > tolerance:
+        raise SystemExit(f"Parity check failed (tolerance {tolerance:.0e}); {output_path} not written.")
+    dual.save(output_path)
+    print(f"Saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,21 @@
 import os
 import zipfile
 import shutil
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
+from preprocess_runner import run_units, chunk_units, write_failures
+from manifest import SPLITS, manifest_path, read_manifest, write_manifest, hash_files
+from dedup import duplicate_groups, NEAR_DUPLICATE_DISTANCE
 
 DATASET_NAME = "emmarex/plantdisease"
 DATA_READY_DIR = "dataset/PlantVillage"
 TRAIN_DIR = "data_split/train"
 VAL_DIR = "data_split/val"
 TEST_DIR = "data_split/test"
+MANIFEST_PATH = "data_split/manifest.csv"
+SPLIT_FAILURES = "data_split/failures.csv"
+DUPLICATES_REPORT = "data_split/duplicates_report.csv"
 
 def download_data():
     if os.path.exists(DATA_READY_DIR):
@@ -50,28 +57,151 @@ def clean_data():
                 count += 1
     print(f"Removed {count} non-image or invalid files.")
 
-def split_data():
-    """Stratified split: 70/15/15"""
+def materialize_files(pairs, mode):
+    """
+    Work unit (runs in a pool process): place (source, destination) pairs as hardlinks,
+    symlinks or copies, falling back to a copy when a link cannot be made (e.g. across
+    volumes). Destinations already in place in the requested mode are skipped. Returns [(source, error)].
+    """
+    failed = []
+    for src, dst in pairs:
+        try:
+            if os.path.lexists(dst):
+                if mode == "copy":
+                    in_place = os.path.exists(dst) and os.path.getsize(dst) == os.path.getsize(src)
+                else:
+                    in_place = os.path.exists(dst) and os.path.samefile(src, dst)
+                if in_place and os.path.islink(dst) == (mode == "symlink"):
+                    continue
+                os.remove(dst)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                if mode == "hardlink":
+                    os.link(src, dst)
+                    continue
+                if mode == "symlink":
+                    os.symlink(os.path.abspath(src), dst)
+                    continue
+            except OSError:
+                pass
+            shutil.copy2(src, dst + ".part")
+            os.replace(dst + ".part", dst)
+        except Exception as e:
+            failed.append((src, str(e)))
+    return failed
+
+def _hash_sources(filepaths, previous, workers=None):
+    """
+    Content hash, perceptual hash, size and mtime per source file. Hashes from the previous
+    manifest are reused for files whose size and mtime did not change, so a re-split hashes
+    nothing new.
+    """
+    known = {}
+    if previous is not None and "phash" in previous:
+        known = {row.path: row for row in previous.itertuples() if isinstance(row.hash, str)}
+    rows, todo = {}, []
+    for path in filepaths:
+        old = known.get(path)
+        st = os.stat(path)
+        if old is not None and old.size == st.st_size and old.mtime_ns == st.st_mtime_ns:
+            rows[path] = (old.size, old.mtime_ns, old.hash, old.phash if isinstance(old.phash, str) else None)
+        else:
+            todo.append(path)
+
+    failures = []
+    if todo:
+        print(f"Hashing {len(todo)} files ({len(rows)} unchanged)...")
+        units = [(todo[s0:s1],) for s0, s1 in chunk_units(todo)]
+        for _, hashed in run_units(hash_files, units, workers, sizes=[len(u[0]) for u in units], label="files"):
+            for path, size, mtime_ns, digest, phash, error in hashed:
+                if error:
+                    failures.append((path, "hash", error))
+                else:
+                    rows[path] = (size, mtime_ns, digest, phash)
+    return rows, failures
+
+def _deduplicate(df, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    Assign duplicate groups and drop redundant copies. Byte-identical files keep one copy
+    (the first path); identical files filed under different classes are all dropped, as
+    their label is unknowable. Near duplicates (perceptual hashes within max_distance bits)
+    are kept but share a group so the split keeps them together.
+    Returns (kept rows, report rows).
+    """
+    phashes = [int(h, 16) if isinstance(h, str) else None for h in df["phash"]]
+    df = df.assign(group=duplicate_groups(list(df["hash"]), phashes, max_distance))
+
+    report = []
+    drop = set()
+    for _, copies in df[df.duplicated("hash", keep=False)].groupby("hash", sort=False):
+        if copies["label"].nunique() > 1:
+            detail = "identical image under classes " + ", ".join(sorted(copies["label"].unique()))
+            drop.update(copies.index)
+            report += [(r.path, r.label, r.group, "", "removed", detail) for r in copies.itertuples()]
+        else:
+            kept = copies.iloc[0]
+            drop.update(copies.index[1:])
+            report += [(r.path, r.label, r.group, "", "removed", f"exact duplicate of {kept.path}")
+                       for r in copies.iloc[1:].itertuples()]
+    df = df.drop(index=list(drop))
+
+    sizes = df["group"].map(df["group"].value_counts())
+    for r in df[sizes > 1].itertuples():
+        classes = df.loc[df["group"] == r.group, "label"].unique()
+        detail = f"near duplicate group of {sizes[r.Index]}"
+        if len(classes) > 1:
+            detail += " spanning classes " + ", ".join(sorted(classes))
+        report.append((r.path, r.label, r.group, "", "grouped", detail))
+    return df, report
+
+def _split_groups(groups, test_size, seed):
+    """
+    train_test_split of groups stratified by label. Classes with fewer than 2 groups cannot
+    be stratified: each of their groups goes to the second part with probability test_size.
+    """
+    counts = groups["label"].map(groups["label"].value_counts())
+    common, rare = groups[counts >= 2], groups[counts < 2]
+    if len(common):
+        try:
+            first, second = train_test_split(common, test_size=test_size, stratify=common["label"], random_state=seed)
+        except ValueError:
+            # Too few groups for one per class on both sides: split without stratifying
+            first, second = train_test_split(common, test_size=test_size, random_state=seed)
+    else:
+        first, second = common, common
+    if len(rare):
+        print(f"{len(rare)} classes with a single group, assigned without stratification.")
+        to_second = np.random.default_rng(seed).random(len(rare)) < test_size
+        first, second = pd.concat([first, rare[~to_second]]), pd.concat([second, rare[to_second]])
+    return first, second
+
+def split_data(seed=42, val_ratio=0.15, test_ratio=0.15, manifest=MANIFEST_PATH, materialize=None, workers=None,
+               max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    Stratified split (70/15/15 by default) stored as a manifest of path, label, split and
+    content hash; no image is copied. The loaders read the manifest directly. Re-running
+    with another seed or other ratios only rewrites the manifest. Exact and near duplicates
+    are grouped first (dedup.py) and whole groups go to one split, so no copy of a training
+    image leaks into val or test; removed and grouped images are listed in
+    data_split/duplicates_report.csv. `materialize` ("hardlink", "symlink" or "copy") also
+    lays the split out as data_split/<split>/<label>/ for tools that glob directories.
+    """
     if not os.path.exists(DATA_READY_DIR):
         print("Data dir not found, skip split.")
         return
-        
-    if os.path.exists(TRAIN_DIR):
-        print("Split already exists. Skipping.")
-        return
 
     # Collect all image paths and labels
     filepaths = []
     labels = []
     
-    for class_name in os.listdir(DATA_READY_DIR):
+    for class_name in sorted(os.listdir(DATA_READY_DIR)):
         class_dir = os.path.join(DATA_READY_DIR, class_name)
         if os.path.isdir(class_dir):
-            for file in os.listdir(class_dir):
+            for file in sorted(os.listdir(class_dir)):
                 filepaths.append(os.path.join(class_dir, file))
                 labels.append(class_name)
                 
-    df = pd.DataFrame({"filepath": filepaths, "label": labels})
+    df = pd.DataFrame({"path": filepaths, "label": labels})
     if len(df) == 0:
         print("No images found.")
         return
@@ -80,31 +210,74 @@ def split_data():
     print("Original Distribution:")
     print(df['label'].value_counts())
     df['label'].value_counts().to_csv('original_distribution.csv')
-    
-    # 70/15/15 split
-    train_df, temp_df = train_test_split(df, test_size=0.30, stratify=df['label'], random_state=42)
-    val_df, test_df = train_test_split(temp_df, test_size=0.50, stratify=temp_df['label'], random_state=42)
-    
-    def copy_files(df_split, target_dir):
-        os.makedirs(target_dir, exist_ok=True)
-        for _, row in df_split.iterrows():
-            class_dir = os.path.join(target_dir, row['label'])
-            os.makedirs(class_dir, exist_ok=True)
-            try:
-                shutil.copy2(row['filepath'], os.path.join(class_dir, os.path.basename(row['filepath'])))
-            except Exception as e:
-                print(f"Error copying {row['filepath']}: {e}")
-            
-    print("Copying train data...")
-    copy_files(train_df, TRAIN_DIR)
-    print("Copying val data...")
-    copy_files(val_df, VAL_DIR)
-    print("Copying test data...")
-    copy_files(test_df, TEST_DIR)
-    
+
+    existing = manifest_path(os.path.dirname(manifest))
+    hashes, failures = _hash_sources(filepaths, read_manifest(existing) if existing else None, workers)
+    df = df[df["path"].isin(hashes)].copy()
+    df["size"], df["mtime_ns"], df["hash"], df["phash"] = zip(*(hashes[p] for p in df["path"]))
+    df, report = _deduplicate(df, max_distance)
+
+    # Stratified split of duplicate groups, each stratified by the class of its first image
+    groups = df.drop_duplicates("group")[["group", "label"]]
+    holdout = val_ratio + test_ratio
+    train_g, temp_g = _split_groups(groups, holdout, seed)
+    val_g, test_g = _split_groups(temp_g, test_ratio / holdout, seed)
+    split_of = pd.concat([train_g.assign(split="train"), val_g.assign(split="val"), test_g.assign(split="test")])
+    df["split"] = df["group"].map(split_of.set_index("group")["split"])
+
+    write_manifest(df, manifest)
+    print(f"Wrote {manifest}: " + ", ".join(f"{s} {int((df['split'] == s).sum())}" for s in SPLITS))
+
+    report = pd.DataFrame(report, columns=["path", "label", "group", "split", "action", "detail"])
+    report["split"] = report["group"].map(split_of.set_index("group")["split"]).fillna("")
+    report.to_csv(DUPLICATES_REPORT, index=False)
+    removed = int((report["action"] == "removed").sum())
+    grouped = int((report["action"] == "grouped").sum())
+    print(f"{removed} duplicate files removed, {grouped} near duplicates grouped, see {DUPLICATES_REPORT}.")
+
+    if materialize:
+        failures += _materialize(df, materialize, workers)
+    write_failures(SPLIT_FAILURES, failures)
+    if failures:
+        print(f"{len(failures)} files failed, see {SPLIT_FAILURES}.")
     print("Data split complete.")
 
+def _materialize(df, mode, workers=None):
+    """Lay the manifest out as split directories; entries not in the manifest are removed."""
+    targets = {TRAIN_DIR: "train", VAL_DIR: "val", TEST_DIR: "test"}
+    pairs = [
+        (row.path, os.path.join(target_dir, row.label, os.path.basename(row.path)))
+        for target_dir, split in targets.items()
+        for row in df[df["split"] == split].itertuples()
+    ]
+    wanted = {dst for _, dst in pairs}
+    stale = [os.path.join(root, f) for target_dir in targets for root, _, files in os.walk(target_dir)
+             for f in files if os.path.join(root, f) not in wanted]
+    for path in stale:
+        os.remove(path)
+
+    print(f"Materialising {len(pairs)} files as {mode}s ({len(stale)} stale entries removed)...")
+    units = [(pairs[s0:s1], mode) for s0, s1 in chunk_units(pairs)]
+    failures = []
+    for _, failed in run_units(materialize_files, units, workers, sizes=[len(u[0]) for u in units], label="files"):
+        failures.extend((src, "materialize", error) for src, error in failed)
+    return failures
+
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--val-ratio', type=float, default=0.15)
+    parser.add_argument('--test-ratio', type=float, default=0.15)
+    parser.add_argument('--manifest', default=MANIFEST_PATH, help="Split manifest, .csv or .parquet")
+    parser.add_argument('--materialize', choices=["hardlink", "symlink", "copy"], default=None,
+                        help="Also lay the split out as data_split/<split>/<label>/ directories")
+    parser.add_argument('--workers', type=int, default=None, help="Hash/copy processes (default: one per core)")
+    parser.add_argument('--dup-distance', type=int, default=NEAR_DUPLICATE_DISTANCE,
+                        help="Max Hamming distance (of 64 bits) between perceptual hashes of near duplicates")
+    args = parser.parse_args()
+
     download_data()
     clean_data()
-    split_data()
+    split_data(args.seed, args.val_ratio, args.test_ratio, args.manifest, args.materialize, args.workers,
+               args.dup_distance)
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+
+import cv2
+import numpy as np
+from numpy.lib.format import open_memmap
+
+import dip_module
+from dip_module import apply_production_dip_batch, resize_image, DIP_SIZE
+from preprocess_runner import run_units, chunk_units, write_failures
+from manifest import split_files
+
+CACHE_DIR = "dataset_cache"
+SPLITS_DIR = "data_split"
+SHARD_SIZE = 2048  # images per shard file, ~300 MB per kind at 224x224x3
+BUILD_CHUNK = 64   # images decoded and pushed through the batch DIP at a time
+KINDS = ("raw", "dip")
+INDEX_VERSION = 1
+
+
+def list_split(directory):
+    """
+    (paths, labels, classes) of a split: read from the split manifest when there is one
+    (manifest.py), else listed from the split directory with classes as its sorted entries.
+    Files are sorted for a stable order.
+    """
+    from_manifest = split_files(directory)
+    if from_manifest is not None:
+        return from_manifest
+    classes = sorted(os.listdir(directory))
+    paths, labels = [], []
+    for idx, c in enumerate(classes):
+        c_dir = os.path.join(directory, c)
+        if os.path.isdir(c_dir):
+            for f in sorted(os.listdir(c_dir)):
+                paths.append(os.path.join(c_dir, f))
+                labels.append(idx)
+    return paths, labels, classes
+
+def split_exists(directory):
+    """Whether a split can be listed: it is in a manifest or exists as a directory."""
+    return split_files(directory) is not None or os.path.isdir(directory)
+
+def file_list_hash(directory, paths):
+    """Hash of the split's file list: relative path, size and mtime of every file."""
+    h = hashlib.sha1()
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{os.path.relpath(path, directory)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+def dip_version():
+    """Hash of dip_module's source: any change to the DIP code invalidates cached DIP tensors."""
+    with open(dip_module.__file__, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def load_frames(paths):
+    """
+    (N, 224, 224, 3) BGR stack of the readable paths, resized as apply_dip_pipeline does,
+    their positions, and (position, error) for the rest.
+    """
+    frames, kept, errors = [], [], []
+    for i, path in enumerate(paths):
+        try:
+            img_bgr = cv2.imread(path)
+            if img_bgr is None:
+                raise ValueError("unreadable image")
+            frames.append(resize_image(img_bgr, size=DIP_SIZE))
+            kept.append(i)
+        except Exception as e:
+            errors.append((i, str(e)))
+    w, h = DIP_SIZE
+    return (np.stack(frames) if frames else np.empty((0, h, w, 3), np.uint8)), kept, errors
+
+def _shard_path(cache_dir, kind, shard_id):
+    return os.path.join(cache_dir, f"{kind}_{shard_id:05d}.npy")
+
+def build_rows(cache_dir, shard_id, start, paths, chunk=BUILD_CHUNK):
+    """
+    Work unit (runs in a pool process): raw (RGB) and DIP (segmented RGB) uint8 tensors for
+    rows [start, start + len(paths)) of a shard's temporary files. Returns [(row, error)]
+    for the paths that could not be processed; their rows stay zero.
+    """
+    w, h = DIP_SIZE
+    arrays = {kind: np.load(_shard_path(cache_dir, kind, shard_id) + ".tmp", mmap_mode="r+") for kind in KINDS}
+    failed = []
+    for offset in range(0, len(paths), chunk):
+        frames, kept, errors = load_frames(paths[offset:offset + chunk])
+        failed.extend((start + offset + i, error) for i, error in errors)
+        if not kept:
+            continue
+        rows = [start + offset + k for k in kept]
+        n = len(frames)
+        arrays["raw"][rows] = cv2.cvtColor(frames.reshape(n * h, w, 3), cv2.COLOR_BGR2RGB).reshape(frames.shape)
+        arrays["dip"][rows] = apply_production_dip_batch(frames)[0]
+    for array in arrays.values():
+        array.flush()
+    return failed
+
+def cache_status(split_dir, cache_dir):
+    """(current, reason): whether cache_dir holds an up-to-date cache of split_dir."""
+    index_path = os.path.join(cache_dir, "index.json")
+    if not os.path.exists(index_path):
+        return False, "no cache"
+    with open(index_path) as f:
+        index = json.load(f)
+    if index.get("version") != INDEX_VERSION:
+        return False, "cache format changed"
+    if index.get("dip_version") != dip_version():
+        return False, "DIP code changed"
+    paths, _, _ = list_split(split_dir)
+    if index.get("file_list_hash") != file_list_hash(split_dir, paths):
+        return False, "source files changed"
+    return True, "up to date"
+
+def _load_checkpoint(cache_dir, key):
+    """Shards finished by an interrupted build with the same key: {shard_id: [[row, error], ...]}."""
+    path = os.path.join(cache_dir, "checkpoint.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("key") != key:
+        return {}
+    return {
+        int(shard_id): failed for shard_id, failed in checkpoint["shards"].items()
+        if all(os.path.exists(_shard_path(cache_dir, kind, int(shard_id))) for kind in KINDS)
+    }
+
+def _save_checkpoint(cache_dir, key, done):
+    path = os.path.join(cache_dir, "checkpoint.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({"key": key, "shards": {str(k): v for k, v in done.items()}}, f)
+    os.replace(path + ".tmp", path)
+
+def build_cache(split_dir, cache_dir, shard_size=SHARD_SIZE, seed=0, workers=None):
+    """
+    Materialise a split as sharded uint8 .npy files plus labels.npy and index.json.
+    Rows are stored in a fixed seeded permutation, so any contiguous slice of a shard is a
+    class-mixed batch; unreadable images keep their row with label -1 and are listed in
+    failures.csv. Work units of UNIT_SIZE rows run on a process pool; each finished shard
+    is checkpointed, so an interrupted build resumes with the shards it had not finished.
+    """
+    paths, labels, classes = list_split(split_dir)
+    source_hash = file_list_hash(split_dir, paths)
+    os.makedirs(cache_dir, exist_ok=True)
+    order = np.random.default_rng(seed).permutation(len(paths))
+    paths = [paths[i] for i in order]
+    labels = np.asarray(labels, np.int32)[order] if len(paths) else np.empty(0, np.int32)
+
+    t0 = time.time()
+    w, h = DIP_SIZE
+    key = {"version": INDEX_VERSION, "file_list_hash": source_hash, "dip_version": dip_version(),
+           "shard_size": shard_size, "seed": seed}
+    shards = [{"id": shard_id, "start": start, "count": min(shard_size, len(paths) - start)}
+              for shard_id, start in enumerate(range(0, len(paths), shard_size))]
+    done = _load_checkpoint(cache_dir, key)
+    if done:
+        print(f"  resuming: {len(done)}/{len(shards)} shards already built")
+
+    # Preallocate the pending shards, then fan their rows out as work units
+    units, remaining, shard_failed = [], {}, {}
+    for shard in shards:
+        if shard["id"] in done:
+            continue
+        for kind in KINDS:
+            open_memmap(_shard_path(cache_dir, kind, shard["id"]) + ".tmp", mode="w+", dtype=np.uint8,
+                        shape=(shard["count"], h, w, 3)).flush()
+        shard_paths = paths[shard["start"]:shard["start"] + shard["count"]]
+        shard_units = [(cache_dir, shard["id"], s0, shard_paths[s0:s1]) for s0, s1 in chunk_units(shard_paths)]
+        units.extend(shard_units)
+        remaining[shard["id"]] = len(shard_units)
+        shard_failed[shard["id"]] = []
+
+    for unit, failed in run_units(build_rows, units, workers, sizes=[len(u[3]) for u in units]):
+        shard_id = unit[1]
+        shard_failed[shard_id].extend(failed)
+        remaining[shard_id] -= 1
+        if remaining[shard_id] == 0:
+            for kind in KINDS:
+                os.replace(_shard_path(cache_dir, kind, shard_id) + ".tmp", _shard_path(cache_dir, kind, shard_id))
+            done[shard_id] = sorted(shard_failed[shard_id])
+            _save_checkpoint(cache_dir, key, done)
+
+    failures = []
+    for shard in shards:
+        for row, error in done[shard["id"]]:
+            labels[shard["start"] + row] = -1
+            failures.append((paths[shard["start"] + row], "decode", error))
+    write_failures(os.path.join(cache_dir, "failures.csv"), failures)
+
+    np.save(os.path.join(cache_dir, "labels.npy"), labels)
+    index = {
+        "version": INDEX_VERSION,
+        "split_dir": split_dir,
+        "file_list_hash": source_hash,
+        "dip_version": key["dip_version"],
+        "size": list(DIP_SIZE),
+        "classes": classes,
+        "count": len(paths),
+        "shards": shards,
+        "paths": paths,
+        "failed": [path for path, _, _ in failures],
+        "build_s": round(time.time() - t0, 2),
+    }
+    # The index is written last: a cache without one is rebuilt (resuming from the checkpoint)
+    with open(os.path.join(cache_dir, "index.json.tmp"), "w") as f:
+        json.dump(index, f)
+    os.replace(os.path.join(cache_dir, "index.json.tmp"), os.path.join(cache_dir, "index.json"))
+    if os.path.exists(os.path.join(cache_dir, "checkpoint.json")):
+        os.remove(os.path.join(cache_dir, "checkpoint.json"))
+    return index
+
+def ensure_cache(split_dir, cache_root=CACHE_DIR, workers=None):
+    """DatasetCache for a split directory, (re)built first if missing or stale."""
+    cache_dir = os.path.join(cache_root, os.path.basename(os.path.normpath(split_dir)))
+    current, reason = cache_status(split_dir, cache_dir)
+    if not current:
+        print(f"Building dataset cache for {split_dir} in {cache_dir} ({reason})...")
+        build_cache(split_dir, cache_dir, workers=workers)
+    return DatasetCache(cache_dir)
+
+
+class DatasetCache:
+    """
+    Read side of a built cache. Shards are opened as read-only memory maps, so slices are
+    views onto the page cache and several training processes share one copy.
+    """
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, "index.json")) as f:
+            self.index = json.load(f)
+        self.cache_dir = cache_dir
+        self.classes = self.index["classes"]
+        self.paths = self.index["paths"]
+        self.shards = self.index["shards"]
+        self.labels = np.load(os.path.join(cache_dir, "labels.npy"))
+        self._arrays = {}
+
+    def __len__(self):
+        return self.index["count"]
+
+    def shard_array(self, kind, shard_id):
+        key = (kind, shard_id)
+        if key not in self._arrays:
+            path = os.path.join(self.cache_dir, f"{kind}_{shard_id:05d}.npy")
+            self._arrays[key] = np.load(path, mmap_mode="r")
+        return self._arrays[key]
+
+    def batches(self, batch_size):
+        """(shard_id, start, stop) row ranges of at most batch_size that never cross a shard."""
+        return [
+            (shard["id"], i, min(i + batch_size, shard["count"]))
+            for shard in self.shards
+            for i in range(0, shard["count"], batch_size)
+        ]
+
+    def slice(self, kind, shard_id, start, stop):
+        """Zero-copy (images, labels) view of rows [start, stop) of one shard; images are uint8 RGB."""
+        offset = self.shards[shard_id]["start"]
+        return self.shard_array(kind, shard_id)[start:stop], self.labels[offset + start:offset + stop]
+
+
+def main(splits=("train", "val", "test"), splits_dir=SPLITS_DIR, cache_root=CACHE_DIR, force=False, workers=None):
+    for split in splits:
+        split_dir = os.path.join(splits_dir, split)
+        if not split_exists(split_dir):
+            print(f"{split_dir} not found, skipped.")
+            continue
+        cache_dir = os.path.join(cache_root, split)
+        current, reason = cache_status(split_dir, cache_dir)
+        if current and not force:
+            print(f"{split}: {reason}")
+            continue
+        print(f"{split}: building ({'forced' if current else reason})...")
+        index = build_cache(split_dir, cache_dir, workers=workers)
+        print(f"{split}: {index['count']} images, {len(index['failed'])} unreadable (see {cache_dir}/failures.csv), {index['build_s']}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute memory-mapped raw and DIP input tensors per split.")
+    parser.add_argument("--splits", nargs="+", default=["train", "val", "test"])
+    parser.add_argument("--splits-dir", default=SPLITS_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the cache is up to date.")
+    parser.add_argument("--workers", type=int, default=None, help="Pool processes (default: one per core).")
+    args = parser.parse_args()
+    main(args.splits, args.splits_dir, args.cache_dir, args.force, args.workers)
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# Hamming distance (of 64) up to which two difference hashes count as the same picture:
+# survives JPEG re-encoding, resizing and small brightness changes, not a different leaf
+NEAR_DUPLICATE_DISTANCE = 4
+# Candidate buckets larger than this are compared in BLOCK x BLOCK tiles, so one skewed
+# bucket never holds more than BLOCK * BLOCK distances (32 MB of uint64) at a time
+BLOCK = 2048
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+def perceptual_hash(path):
+    """
+    64-bit difference hash (dHash): signs of the horizontal gradients of a 9x8 grayscale
+    thumbnail, or None when the image cannot be read. The JPEG is decoded at 1/8 scale.
+    """
+    gray = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+def popcount(x):
+    """Set bits per element of a uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return _POPCOUNT8[np.ascontiguousarray(x).view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+def _bands(max_distance):
+    """max_distance + 1 disjoint bit ranges covering 64 bits (shift, mask)."""
+    count = max_distance + 1
+    widths = [64 // count + (1 if i < 64 % count else 0) for i in range(count)]
+    shifts = np.cumsum([0] + widths[:-1])
+    return [(int(s), (1 << w) - 1) for s, w in zip(shifts, widths)]
+
+def _components(n, i, j):
+    """Connected-component label per node of an undirected graph with edges (i, j)."""
+    graph = coo_matrix((np.ones(len(i), np.int8), (i, j)), shape=(n, n))
+    return connected_components(graph, directed=False)[1]
+
+def _star_edges(labels):
+    """Edges joining every node to the first node of its component: at most n, same components."""
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    roots = first[inverse]
+    keep = np.flatnonzero(roots != np.arange(len(labels)))
+    return keep, roots[keep]
+
+def near_duplicate_components(hashes, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    Component label per uint64 hash, joining hashes within max_distance bits (transitively).
+    Equal hashes are collapsed first, so only distinct values are ever compared. Multi-index
+    hashing: the 64 bits are cut into max_distance + 1 bands, and two hashes that close must
+    agree exactly on at least one band (pigeonhole), so only values sharing a band value are
+    compared. Matches go straight into a sparse graph, reduced to one edge per value after
+    each band, so thousands of copies of one picture cost one comparison, not millions of pairs.
+    """
+    unique, inverse = np.unique(np.asarray(hashes, np.uint64), return_inverse=True)
+    n = len(unique)
+    edges_i, edges_j = np.empty(0, np.int64), np.empty(0, np.int64)
+    for shift, mask in _bands(max_distance):
+        keys = (unique >> np.uint64(shift)) & np.uint64(mask)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        found_i, found_j = [edges_i], [edges_j]
+        for s, e in zip(starts, ends):
+            if e - s < 2:
+                continue
+            members = order[s:e]
+            for b in range(0, len(members), BLOCK):
+                rows = members[b:b + BLOCK]
+                # Tiles below the diagonal only repeat pairs already seen
+                for c in range(b, len(members), BLOCK):
+                    cols = members[c:c + BLOCK]
+                    dist = popcount(unique[rows][:, None] ^ unique[cols][None, :])
+                    ri, ci = np.nonzero(dist <= max_distance)
+                    found_i.append(rows[ri])
+                    found_j.append(cols[ci])
+        i, j = np.concatenate(found_i), np.concatenate(found_j)
+        edges_i, edges_j = _star_edges(_components(n, i, j)) if len(i) else (i, j)
+    return _components(n, edges_i, edges_j)[inverse]
+
+def duplicate_groups(exact_hashes, perceptual_hashes, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    Group id per image: images with the same content hash, or perceptual hashes within
+    max_distance (transitively), share a group. Perceptual hashes may be None (unreadable).
+    Ids are dense and ordered by first member.
+    """
+    n = len(exact_hashes)
+    index = np.flatnonzero([h is not None for h in perceptual_hashes])
+    # Images whose perceptual hashes match: one edge from each to its component's first image
+    near = near_duplicate_components([h for h in perceptual_hashes if h is not None], max_distance)
+    i, j = _star_edges(near)
+    # Identical bytes are one picture even when the image could not be perceptually hashed
+    _, exact = np.unique(np.asarray(exact_hashes, object), return_inverse=True)
+    ei, ej = _star_edges(exact)
+    components = _components(n, np.r_[index[i], ei], np.r_[index[j], ej])
+    # Renumber in order of first appearance so ids are stable across runs
+    _, first_index, inverse = np.unique(components, return_index=True, return_inverse=True)
+    rank = np.argsort(np.argsort(first_index))
+    return rank[inverse]
@@ -2,13 +2,355 @@ import cv2
 import numpy as np
 import os
 import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("cropsense.dip")
 
 def resize_image(image, size=(224, 224)):
+    # Callers that already hold a buffer at the target size (e.g. the predict ingest stage) skip the copy
+    if image.shape[1::-1] == tuple(size):
+        return image
     return cv2.resize(image, size)
 
-def apply_production_dip(image_bgr):
+DIP_SIZE = (224, 224)
+EXG_THRESHOLD = 20
+CLEANUP_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+DILATE_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+GAUSSIAN_RADIUS = 6  # cv2.GaussianBlur's 8-bit kernel for sigma 2.0 is 13 taps
+# Images per pass of the batch pipeline: the working set of a chunk stays cache-sized
+DIP_BATCH_CHUNK = 8
+
+_pixel_luts = None
+_pixel_luts_lock = threading.Lock()
+_arenas = threading.local()
+_cc_pool = None
+_cc_pool_lock = threading.Lock()
+
+
+def pixel_luts():
+    """
+    Per-colour lookup tables indexed by the packed BGR value b | g << 8 | r << 16 (16 MB
+    each, built once per process): OpenCV's 8-bit LAB a*, and the GLI mask (2G - R - B > 20).
+    The a* table is built from cvtColor itself, so lookups are bit-exact.
+    """
+    global _pixel_luts
+    with _pixel_luts_lock:
+        if _pixel_luts is None:
+            lab_a = np.empty((256, 256, 256), np.uint8)  # [r, g, b]
+            gli = np.empty((256, 256, 256), np.uint8)
+            plane = np.empty((256, 256, 3), np.uint8)
+            plane[..., 0] = np.arange(256, dtype=np.uint8)            # b along columns
+            plane[..., 1] = np.arange(256, dtype=np.uint8)[:, None]   # g along rows
+            exg_gb = 2 * plane[..., 1].astype(np.int16) - plane[..., 0]
+            lab = np.empty_like(plane)
+            for r in range(256):
+                plane[..., 2] = r
+                cv2.cvtColor(plane, cv2.COLOR_BGR2LAB, dst=lab)
+                cv2.extractChannel(lab, 1, dst=lab_a[r])
+                gli[r] = np.where(exg_gb - r > EXG_THRESHOLD, 255, 0)
+            _pixel_luts = lab_a.reshape(-1), gli.reshape(-1)
+    return _pixel_luts
+
+
+class DipArena:
+    """
+    Preallocated working buffers for one thread. run() writes every stage in place through
+    OpenCV's dst= parameters, so a call allocates nothing at the frame size; its outputs are
+    views into the arena and are overwritten by the next run() on the same arena.
+    """
+
+    def __init__(self, size=DIP_SIZE):
+        w, h = size
+        self.size = tuple(size)
+        self.lab_a_lut, self.gli_lut = pixel_luts()
+        self.resized = np.empty((h, w, 3), np.uint8)
+        self.bgra = np.empty((h, w, 4), np.uint8)
+        self.index = np.empty((h, w), np.intp)  # np.take would otherwise cast a copy to intp
+        self.a = np.empty((h, w), np.uint8)
+        self.gli = np.empty((h, w), np.uint8)
+        self.lab = np.empty((h, w), np.uint8)
+        self.combined = np.empty((h, w), np.uint8)
+        self.closed = np.empty((h, w), np.uint8)
+        self.opened = np.empty((h, w), np.uint8)
+        self.labels = np.empty((h, w), np.int32)
+        self.largest = np.empty((h, w), np.uint8)
+        self.final = np.empty((h, w), np.uint8)
+        self.mask3 = np.empty((h, w, 3), np.uint8)
+        self.rgb = np.empty((h, w, 3), np.uint8)
+        self.segmented = np.empty((h, w, 3), np.uint8)
+        self.gaussian = np.empty((h, w, 3), np.uint8)
+        self.sharpened = np.empty((h, w, 3), np.uint8)
+        self._largest = self.opened
+
+    def _resize(self, image_bgr):
+        if image_bgr.shape[1::-1] == self.size:
+            return image_bgr
+        return cv2.resize(image_bgr, self.size, dst=self.resized)
+
+    def _exg(self, img):
+        # GLI mask looked up from the packed BGR value (the LAB stage reuses the index)
+        cv2.cvtColor(img, cv2.COLOR_BGR2BGRA, dst=self.bgra)
+        np.bitwise_and(self.bgra.view(np.uint32)[..., 0], 0xFFFFFF, out=self.index)
+        np.take(self.gli_lut, self.index, out=self.gli, mode="clip")
+
+    def _lab_otsu(self, img):
+        # LAB a-channel only; Otsu's output image is discarded, self.lab is overwritten right after
+        np.take(self.lab_a_lut, self.index, out=self.a, mode="clip")
+        otsu_thresh, _ = cv2.threshold(self.a, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=self.lab)
+        relaxed_thresh = min(otsu_thresh + 10, 255)
+        cv2.threshold(self.a, relaxed_thresh, 255, cv2.THRESH_BINARY_INV, dst=self.lab)
+
+    def _morphology(self, img):
+        cv2.bitwise_and(self.gli, self.lab, dst=self.combined)
+        cv2.morphologyEx(self.combined, cv2.MORPH_CLOSE, CLEANUP_KERNEL, dst=self.closed)
+        cv2.morphologyEx(self.closed, cv2.MORPH_OPEN, CLEANUP_KERNEL, dst=self.opened)
+
+    def _connected_components(self, img):
+        num_labels, _, stats, _ = cv2.connectedComponentsWithStats(self.opened, labels=self.labels, connectivity=8)
+        if num_labels > 1:
+            largest_label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+            self._largest = cv2.compare(self.labels, largest_label, cv2.CMP_EQ, dst=self.largest)
+        else:
+            self._largest = self.opened
+
+    def _dilate(self, img):
+        cv2.dilate(self._largest, DILATE_KERNEL, dst=self.final, iterations=1)
+
+    def _mask_apply(self, img):
+        # A masked bitwise_and would keep stale pixels in a reused dst, so AND with a 3-channel mask
+        cv2.cvtColor(self.final, cv2.COLOR_GRAY2BGR, dst=self.mask3)
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        cv2.bitwise_and(self.rgb, self.mask3, dst=self.segmented)
+
+    def _unsharp(self, img):
+        cv2.GaussianBlur(self.segmented, (0, 0), 2.0, dst=self.gaussian)
+        cv2.addWeighted(self.segmented, 1.5, self.gaussian, -0.5, 0, dst=self.sharpened)
+
+    STAGES = (
+        ("exg", _exg),
+        ("lab_otsu", _lab_otsu),
+        ("morphology", _morphology),
+        ("connected_components", _connected_components),
+        ("dilate", _dilate),
+        ("mask_apply", _mask_apply),
+        ("unsharp", _unsharp),
+    )
+
+    def run(self, image_bgr, timings=None):
+        """Outputs as apply_production_dip. `timings`, if given, receives ms per stage."""
+        start_time = time.time()
+        t0 = time.perf_counter()
+        img = self._resize(image_bgr)
+        if timings is not None:
+            t0 = _lap(timings, "resize", t0)
+        for name, stage in self.STAGES:
+            stage(self, img)
+            if timings is not None:
+                t0 = _lap(timings, name, t0)
+
+        intermediate_masks = {"gli": self.gli, "lab": self.lab, "combined": self.combined}
+        preprocessing_time = (time.time() - start_time) * 1000  # ms
+        return self.sharpened, self.final, preprocessing_time, intermediate_masks
+
+
+def _lap(timings, name, t0):
+    now = time.perf_counter()
+    timings[name] = (now - t0) * 1000
+    return now
+
+def dip_arena():
+    """The calling thread's DipArena."""
+    arena = getattr(_arenas, "arena", None)
+    if arena is None:
+        arena = _arenas.arena = DipArena()
+    return arena
+
+def apply_production_dip(image_bgr, copy=True):
+    """
+    Production DIP pipeline on the calling thread's preallocated buffers.
+    1. GLI (Green Leaf Index) masking
+    2. LAB A-channel Otsu thresholding
+    3. Logical AND combination + Morphology
+    4. Largest connected component extraction
+    Bit-exact with apply_production_dip_reference. copy=False returns the arena's own
+    arrays, valid until this thread's next call (for callers that consume them at once).
+    """
+    segmented_rgb, final_mask, preprocessing_time, intermediate_masks = dip_arena().run(image_bgr)
+    if copy:
+        segmented_rgb, final_mask = segmented_rgb.copy(), final_mask.copy()
+        intermediate_masks = {k: v.copy() for k, v in intermediate_masks.items()}
+    return segmented_rgb, final_mask, preprocessing_time, intermediate_masks
+
+def find_leaf_regions(image_bgr, min_area=0.02, max_leaves=8, pad=0.08):
+    """
+    Leaf regions for multi-leaf photos: the connected components of the cleaned GLI/LAB mask
+    (stages 1-3 of apply_production_dip, on the 224x224 frame) covering at least `min_area`
+    of the frame, largest first, at most `max_leaves` of them. Boxes are scaled back to
+    image_bgr's own resolution and grown by `pad` of their size on each side, so callers
+    can crop the leaf at native resolution. Returns (regions, total_found), each region a
+    dict with bbox (x, y, w, h) and area_fraction.
+    """
+    arena = dip_arena()
+    img = arena._resize(image_bgr)
+    for stage in (DipArena._exg, DipArena._lab_otsu, DipArena._morphology):
+        stage(arena, img)
+    num_labels, _, stats, _ = cv2.connectedComponentsWithStats(arena.opened, labels=arena.labels, connectivity=8)
+
+    frame_area = arena.size[0] * arena.size[1]
+    areas = stats[1:num_labels, cv2.CC_STAT_AREA]
+    keep = 1 + np.flatnonzero(areas >= min_area * frame_area)
+    keep = keep[np.argsort(-stats[keep, cv2.CC_STAT_AREA], kind="stable")]
+
+    h, w = image_bgr.shape[:2]
+    sx, sy = w / arena.size[0], h / arena.size[1]
+    regions = []
+    for label in keep[:max_leaves]:
+        x, y, bw, bh, area = (int(v) for v in stats[label])
+        px, py = bw * pad, bh * pad
+        x0, y0 = max(0, int((x - px) * sx)), max(0, int((y - py) * sy))
+        x1, y1 = min(w, int(np.ceil((x + bw + px) * sx))), min(h, int(np.ceil((y + bh + py) * sy)))
+        regions.append({"bbox": (x0, y0, x1 - x0, y1 - y0), "area_fraction": area / frame_area})
+    return regions, len(keep)
+
+
+
+def _largest_component(opened, out):
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(opened, connectivity=8)
+    if num_labels > 1:
+        largest_label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        cv2.compare(labels, largest_label, cv2.CMP_EQ, dst=out)
+    else:
+        out[...] = opened
+
+def _connected_components_pool():
+    global _cc_pool
+    with _cc_pool_lock:
+        if _cc_pool is None:
+            _cc_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="dip-cc")
+    return _cc_pool
+
+def _set_rows(stack, pad, value):
+    stack[:, :pad] = value
+    stack[:, -pad:] = value
+
+
+class DipBatchArena:
+    """
+    Per-thread working buffers for apply_production_dip_batch, sized for one chunk of
+    `chunk_size` 224x224 images (a shorter last chunk uses the leading rows of each buffer).
+    Morphology buffers carry 2 separator rows per image, the blur buffer 6 reflected rows.
+    """
+
+    def __init__(self, chunk_size=None, size=DIP_SIZE):
+        w, h = size
+        c = chunk_size or DIP_BATCH_CHUNK
+        m, r = 2, GAUSSIAN_RADIUS
+        self.chunk_size, self.size = c, tuple(size)
+        self.lab_a_lut, self.gli_lut = pixel_luts()
+        self.bgra = np.empty((c, h, w, 4), np.uint8)
+        self.index = np.empty((c, h, w), np.intp)
+        self.a = np.empty((c, h, w), np.uint8)
+        self.ping = np.empty((c, h + 2 * m, w), np.uint8)
+        self.pong = np.empty((c, h + 2 * m, w), np.uint8)
+        self.rgb = np.empty((c, h, w, 3), np.uint8)
+        self.mask3 = np.empty((c, h, w, 3), np.uint8)
+        self.padded = np.empty((c, h + 2 * r, w, 3), np.uint8)
+        self.gaussian = np.empty((c, h + 2 * r, w, 3), np.uint8)
+
+    def run_chunk(self, frames, sharpened, final, gli, lab, combined):
+        """One chunk of frames (n <= chunk_size), written into the given output slices."""
+        n, h, w = frames.shape[:3]
+        tall = frames.reshape(n * h, w, 3)
+        m, r = 2, GAUSSIAN_RADIUS
+
+        # 1-2. GLI and LAB a* lookups over the whole chunk as one (n*224, 224) image
+        bgra, index, a = self.bgra[:n], self.index[:n], self.a[:n]
+        cv2.cvtColor(tall, cv2.COLOR_BGR2BGRA, dst=bgra.reshape(n * h, w, 4))
+        np.bitwise_and(bgra.view(np.uint32)[..., 0], 0xFFFFFF, out=index)
+        np.take(self.gli_lut, index, out=gli, mode="clip")
+        np.take(self.lab_a_lut, index, out=a, mode="clip")
+        # Otsu needs each image's own histogram; cv2 builds and solves it in one C pass per image
+        for k in range(n):
+            otsu_thresh, _ = cv2.threshold(a[k], 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=lab[k])
+            cv2.threshold(a[k], min(otsu_thresh + 10, 255), 255, cv2.THRESH_BINARY_INV, dst=lab[k])
+        cv2.bitwise_and(gli.reshape(n * h, w), lab.reshape(n * h, w), dst=combined.reshape(n * h, w))
+
+        # 3. Close then open on the chunk as one tall image; the separator rows are set to
+        #    the neutral value of each pass (0 for dilate, 255 for erode) to keep images apart
+        ping, pong = self.ping[:n], self.pong[:n]
+        ping[:, m:-m] = combined
+        for op, neutral in ((cv2.dilate, 0), (cv2.erode, 255), (cv2.erode, 255), (cv2.dilate, 0)):
+            _set_rows(ping, m, neutral)
+            op(ping.reshape(-1, w), CLEANUP_KERNEL, dst=pong.reshape(-1, w))
+            ping, pong = pong, ping
+
+        # 4. Largest connected component per image (the pool only helps with several cores)
+        opened, largest = ping, pong
+        if n > 1 and os.cpu_count() > 1:
+            list(_connected_components_pool().map(lambda k: _largest_component(opened[k, m:-m], largest[k, m:-m]), range(n)))
+        else:
+            for k in range(n):
+                _largest_component(opened[k, m:-m], largest[k, m:-m])
+        _set_rows(largest, m, 0)
+        cv2.dilate(largest.reshape(-1, w), DILATE_KERNEL, dst=opened.reshape(-1, w))
+        final[...] = opened[:, m:-m]
+
+        # 5. Apply mask in RGB, then the unsharp mask; each image gets reflect-101 rows of its
+        #    own so the Gaussian sees the same border as on a single frame
+        rgb, mask3, padded, gaussian = self.rgb[:n], self.mask3[:n], self.padded[:n], self.gaussian[:n]
+        cv2.cvtColor(tall, cv2.COLOR_BGR2RGB, dst=rgb.reshape(n * h, w, 3))
+        cv2.cvtColor(final.reshape(n * h, w), cv2.COLOR_GRAY2BGR, dst=mask3.reshape(n * h, w, 3))
+        for k in range(n):
+            cv2.bitwise_and(rgb[k], mask3[k], dst=padded[k, r:r + h])
+        padded[:, :r] = padded[:, 2 * r:r:-1]
+        padded[:, r + h:] = padded[:, r + h - 2:h - 2:-1]
+        cv2.GaussianBlur(padded.reshape(-1, w, 3), (0, 0), 2.0, dst=gaussian.reshape(-1, w, 3))
+        for k in range(n):
+            cv2.addWeighted(padded[k, r:r + h], 1.5, gaussian[k, r:r + h], -0.5, 0, dst=sharpened[k])
+
+
+def dip_batch_arena():
+    """The calling thread's DipBatchArena."""
+    arena = getattr(_arenas, "batch", None)
+    if arena is None:
+        arena = _arenas.batch = DipBatchArena()
+    return arena
+
+def apply_production_dip_batch(images):
+    """
+    apply_production_dip over an (N, H, W, 3) BGR stack (resized to 224x224 if needed).
+    Pixel-wise stages run over cache-sized chunks of the stack viewed as one (n*224, 224)
+    image, and morphology, dilation and the unsharp blur run on the chunk with per-image
+    separator rows, all on the calling thread's preallocated buffers. Connected components
+    run image by image on a thread pool; Otsu thresholds come from cv2 per image. Returns the scalar function's
+    outputs stacked along axis 0, each image bit-exact with apply_production_dip.
     """
-    Highly optimized production DIP pipeline (<200ms).
+    start_time = time.time()
+    images = np.asarray(images, np.uint8)
+    if images.shape[1:3] != DIP_SIZE[::-1]:
+        images = np.stack([resize_image(img, DIP_SIZE) for img in images])
+    images = np.ascontiguousarray(images)
+    n, h, w = images.shape[:3]
+
+    sharpened = np.empty((n, h, w, 3), np.uint8)
+    final = np.empty((n, h, w), np.uint8)
+    gli, lab, combined = (np.empty((n, h, w), np.uint8) for _ in range(3))
+    arena = dip_batch_arena()
+    for i in range(0, n, arena.chunk_size):
+        chunk = slice(i, i + arena.chunk_size)
+        arena.run_chunk(images[chunk], sharpened[chunk], final[chunk], gli[chunk], lab[chunk], combined[chunk])
+
+    intermediate_masks = {"gli": gli, "lab": lab, "combined": combined}
+    preprocessing_time = (time.time() - start_time) * 1000  # ms, whole batch
+    return sharpened, final, preprocessing_time, intermediate_masks
+
+def apply_production_dip_reference(image_bgr):
+    """
+    The original allocating implementation, kept as the bit-exact reference for
+    apply_production_dip (see benchmark_dip.py). Not used on any serving or training path.
+
     1. GLI (Green Leaf Index) masking
     2. LAB A-channel Otsu thresholding
     3. Logical AND combination + Morphology
@@ -99,7 +441,7 @@ def apply_dip_pipeline(image_path: str, use_dip: bool = True):
     start_time = time.time()
     
     if use_dip:
-        img_rgb, _, _ = apply_production_dip(img_bgr)
+        img_rgb, _, _, _ = apply_production_dip(img_bgr)
     else:
         # Standard raw resize
         img_rgb = resize_image(img_bgr, size=(224, 224))
@@ -113,3 +455,36 @@ def apply_dip_pipeline(image_path: str, use_dip: bool = True):
     prep_time = (time.time() - start_time) * 1000
     
     return final_input, prep_time
+
+
+def apply_dip_pipeline_batch(image_paths, use_dip: bool = True):
+    """
+    apply_dip_pipeline for a list of paths: each image is read and resized, then the whole
+    stack goes through apply_production_dip_batch (or one BGR->RGB conversion) at once.
+    Returns (inputs, indices of the paths that could be read, prep time in ms); unreadable
+    paths are logged to cropsense.dip and left out.
+    """
+    frames, kept = [], []
+    for i, path in enumerate(image_paths):
+        img_bgr = cv2.imread(path)
+        if img_bgr is None:
+            logger.warning("Could not read image: %s", path)
+            continue
+        frames.append(resize_image(img_bgr, size=(224, 224)))
+        kept.append(i)
+    if not frames:
+        return np.empty((0, 224, 224, 3), np.float32), kept, 0.0
+
+    start_time = time.time()
+    stack = np.stack(frames)
+    if use_dip:
+        img_rgb, _, _, _ = apply_production_dip_batch(stack)
+    else:
+        n, h, w = stack.shape[:3]
+        img_rgb = cv2.cvtColor(stack.reshape(n * h, w, 3), cv2.COLOR_BGR2RGB).reshape(stack.shape)
+
+    from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
+    final_input = preprocess_input(img_rgb.astype(np.float32))
+
+    prep_time = (time.time() - start_time) * 1000
+    return final_input, kept, prep_time
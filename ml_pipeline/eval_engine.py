@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import hashlib
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
+from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
+
+from dip_module import apply_production_dip_batch, resize_image, DIP_SIZE
+from dataset_cache import dip_version
+
+PREDICTIONS_DIR = "predictions"
+# Bump when the stored arrays or the way inputs are built change: older files are recomputed
+PREDICTIONS_VERSION = 1
+INPUT_KINDS = ("raw", "dip")
+
+
+def decode_batch(paths, transform=None):
+    """
+    (N, 224, 224, 3) BGR stack of the readable paths, each decoded once, passed through
+    `transform` (e.g. a synthetic blur, applied at full resolution) and resized as
+    apply_dip_pipeline does; plus the positions of the paths that could be read.
+    """
+    frames, kept = [], []
+    for i, path in enumerate(paths):
+        img_bgr = cv2.imread(path)
+        if img_bgr is None:
+            print(f"Could not read image: {path}")
+            continue
+        if transform is not None:
+            img_bgr = transform(img_bgr)
+        frames.append(resize_image(img_bgr, size=DIP_SIZE))
+        kept.append(i)
+    w, h = DIP_SIZE
+    return (np.stack(frames) if frames else np.empty((0, h, w, 3), np.uint8)), kept
+
+def build_inputs(frames, kinds=INPUT_KINDS):
+    """
+    Model inputs of each kind from one BGR stack: "raw" is the RGB resize, "dip" the
+    production DIP output, both through preprocess_input, as apply_dip_pipeline builds them.
+    """
+    inputs = {}
+    if "raw" in kinds:
+        n, h, w = frames.shape[:3]
+        rgb = cv2.cvtColor(frames.reshape(n * h, w, 3), cv2.COLOR_BGR2RGB).reshape(frames.shape)
+        inputs["raw"] = preprocess_input(rgb.astype(np.float32))
+    if "dip" in kinds:
+        inputs["dip"] = preprocess_input(apply_production_dip_batch(frames)[0].astype(np.float32))
+    return inputs
+
+def file_fingerprint(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def dataset_fingerprint(paths, labels, classes):
+    """Hash of the evaluated files (path, size, mtime), their labels and the class list."""
+    h = hashlib.sha1("|".join(classes).encode())
+    for path, label in zip(paths, labels):
+        st = os.stat(path)
+        h.update(f"{path}|{st.st_size}|{st.st_mtime_ns}|{label}\n".encode())
+    return h.hexdigest()
+
+
+class EvaluationEngine:
+    """
+    Runs every registered model over a dataset from a single decode per image: each batch
+    is decoded once, raw and DIP inputs are built from the shared decode (DIP only if a DIP
+    model needs it), and every model predicts on its kind of input. Softmax outputs are
+    saved per model to predictions/<dataset>/<model>.npz with a key of the predictions
+    format version, model file, DIP code version (DIP models) and dataset, so metrics and
+    plots for another threshold are recomputed from the file without any inference.
+    """
+
+    def __init__(self, classes, predictions_dir=PREDICTIONS_DIR, batch_size=32):
+        self.classes = list(classes)
+        self.predictions_dir = predictions_dir
+        self.batch_size = batch_size
+        self.models = {}
+
+    def register(self, name, model_path, kind):
+        """Add a model file evaluated on `kind` ("raw" or "dip") inputs; missing files are skipped."""
+        if kind not in INPUT_KINDS:
+            raise ValueError(f"Unknown input kind {kind!r}, expected one of {INPUT_KINDS}")
+        if not os.path.exists(model_path):
+            print(f"Model {model_path} not found, skipped.")
+            return False
+        self.models[name] = {"path": model_path, "kind": kind}
+        return True
+
+    def _file(self, dataset, name):
+        return os.path.join(self.predictions_dir, dataset, f"{name}.npz")
+
+    def _key(self, name, data_key):
+        spec = self.models[name]
+        return {
+            "version": PREDICTIONS_VERSION,
+            "model": file_fingerprint(spec["path"]),
+            "kind": spec["kind"],
+            "dip_version": dip_version() if spec["kind"] == "dip" else None,
+            "data": data_key,
+        }
+
+    def load(self, dataset, name, key=None):
+        """Stored predictions of a model on a dataset (matching `key` if given), or None."""
+        path = self._file(dataset, name)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            if meta.get("key", {}).get("version") != PREDICTIONS_VERSION or (key is not None and meta["key"] != key):
+                return None
+            return {"probs": f["probs"], "y_true": f["y_true"], "paths": list(f["paths"]), **meta}
+
+    def _save(self, dataset, name, key, probs, y_true, paths, seconds):
+        path = self._file(dataset, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = {"key": key, "model": name, "classes": self.classes,
+                "inference_time_per_image": seconds / max(len(y_true), 1)}
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, probs=probs, y_true=y_true, paths=np.array(paths), meta=json.dumps(meta))
+        os.replace(tmp, path)
+
+    def run(self, dataset, paths, labels, transform=None, refresh=False):
+        """
+        Predictions of every registered model on (paths, labels): {name: {"probs", "y_true",
+        "paths", "classes", "inference_time_per_image", ...}}. Stored predictions are reused
+        unless `refresh`; only models without valid ones run. `dataset` names the stored
+        files and must differ per `transform`.
+        """
+        data_key = dataset_fingerprint(paths, labels, self.classes)
+        results, pending = {}, {}
+        for name in self.models:
+            key = self._key(name, data_key)
+            stored = None if refresh else self.load(dataset, name, key)
+            if stored is not None:
+                results[name] = stored
+            else:
+                pending[name] = key
+        if not pending:
+            print(f"{dataset}: predictions of {', '.join(results)} loaded, no inference needed.")
+            return results
+
+        print(f"{dataset}: running {', '.join(pending)} on {len(paths)} images...")
+        models = {name: tf.keras.models.load_model(self.models[name]["path"]) for name in pending}
+        kinds = {self.models[name]["kind"] for name in pending}
+        probs = {name: [] for name in pending}
+        seconds = dict.fromkeys(pending, 0.0)
+        y_true, kept_paths = [], []
+        for start in range(0, len(paths), self.batch_size):
+            batch = paths[start:start + self.batch_size]
+            t0 = time.time()
+            frames, kept = decode_batch(batch, transform)
+            if not kept:
+                continue
+            inputs = build_inputs(frames, kinds)
+            # Decode and DIP are shared by all models: split their cost evenly
+            shared = (time.time() - t0) / len(pending)
+            for name, model in models.items():
+                t0 = time.time()
+                probs[name].append(model.predict_on_batch(inputs[self.models[name]["kind"]]))
+                seconds[name] += time.time() - t0 + shared
+            y_true.extend(labels[start + k] for k in kept)
+            kept_paths.extend(batch[k] for k in kept)
+
+        y_true = np.asarray(y_true, np.int32)
+        for name, key in pending.items():
+            stacked = np.concatenate(probs[name]) if probs[name] else np.empty((0, len(self.classes)), np.float32)
+            self._save(dataset, name, key, stacked.astype(np.float32), y_true, kept_paths, seconds[name])
+            results[name] = self.load(dataset, name, key)
+        return results
+
+
+def compute_metrics(predictions, threshold=0.0):
+    """
+    Metrics and confusion matrix from stored predictions, no model needed. Predictions whose
+    top softmax score is below `threshold` count as abstentions: metrics cover the rest and
+    "Coverage" is the fraction answered.
+    """
+    probs, y_true = predictions["probs"], predictions["y_true"]
+    answered = probs.max(axis=1) >= threshold if len(probs) else np.zeros(0, bool)
+    y_true, y_pred = y_true[answered], np.argmax(probs[answered], axis=1)
+    labels = np.arange(len(predictions["classes"]))
+    if len(y_true):
+        scores = [accuracy_score(y_true, y_pred)] + [
+            fn(y_true, y_pred, average='weighted', zero_division=0) for fn in (precision_score, recall_score, f1_score)]
+    else:
+        scores = [0.0] * 4
+    metrics = dict(zip(["Accuracy", "Precision", "Recall", "F1 Score"], scores))
+    metrics["Coverage"] = float(answered.mean()) if len(answered) else 0.0
+    metrics["Inference Time / Img"] = predictions["inference_time_per_image"]
+    cm = confusion_matrix(y_true, y_pred, labels=labels) if len(y_true) else np.zeros((len(labels),) * 2, np.int64)
+    return metrics, cm
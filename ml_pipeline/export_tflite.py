@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import random
+import numpy as np
+import tensorflow as tf
+from dip_module import apply_dip_pipeline
+from dataset_cache import list_split, split_exists
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (keras artifact, uses DIP inputs)
+MODELS = {
+    "model_nodip": False,
+    "model_with_dip": True,
+}
+
+PRECISIONS = ("fp16", "int8")
+
+def list_images(directory):
+    paths, labels, _ = list_split(directory)
+    return list(zip(paths, labels))
+
+def representative_dataset(calib_dir, use_dip, num_samples=200):
+    """Calibration samples for post-training INT8 quantization, preprocessed exactly as in serving."""
+    items = list_images(calib_dir)
+    random.Random(42).shuffle(items)
+
+    def gen():
+        for path, _ in items[:num_samples]:
+            try:
+                x, _ = apply_dip_pipeline(path, use_dip=use_dip)
+            except Exception as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            yield [np.expand_dims(x, axis=0).astype(np.float32)]
+    return gen
+
+def convert(model, precision, calib_dir=None, use_dip=False):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if precision == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif precision == "int8":
+        # Full-integer weights/activations; float32 input/output keeps the serving code unchanged
+        converter.representative_dataset = representative_dataset(calib_dir, use_dip)
+    else:
+        raise ValueError(f"Unknown precision: {precision}")
+    return converter.convert()
+
+def _tflite_predict(interpreter, x):
+    inp = interpreter.get_input_details()[0]
+    out = interpreter.get_output_details()[0]
+    interpreter.set_tensor(inp["index"], x)
+    interpreter.invoke()
+    return interpreter.get_tensor(out["index"])
+
+def parity_report(model, tflite_paths, test_dir, use_dip, max_images=500):
+    """Top-1 agreement and batch-1 latency of each TFLite variant against the Keras model."""
+    items = list_images(test_dir)[:max_images]
+    interpreters = {}
+    for precision, path in tflite_paths.items():
+        interpreter = tf.lite.Interpreter(model_path=path)
+        interpreter.allocate_tensors()
+        interpreters[precision] = interpreter
+
+    keras_top1, labels = [], []
+    tflite_top1 = {p: [] for p in interpreters}
+    latency = {"keras": 0.0, **{p: 0.0 for p in interpreters}}
+
+    for path, label in items:
+        try:
+            x, _ = apply_dip_pipeline(path, use_dip=use_dip)
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        x = np.expand_dims(x, axis=0).astype(np.float32)
+
+        t0 = time.time()
+        keras_top1.append(int(np.argmax(model.predict_on_batch(x)[0])))
+        latency["keras"] += time.time() - t0
+
+        for precision, interpreter in interpreters.items():
+            t0 = time.time()
+            tflite_top1[precision].append(int(np.argmax(_tflite_predict(interpreter, x)[0])))
+            latency[precision] += time.time() - t0
+        labels.append(label)
+
+    n = len(labels)
+    if n == 0:
+        return {"images": 0}
+
+    keras_top1 = np.array(keras_top1)
+    labels = np.array(labels)
+    report = {
+        "images": n,
+        "keras": {
+            "accuracy": float(np.mean(keras_top1 == labels)),
+            "latency_ms": latency["keras"] / n * 1000,
+        },
+    }
+    for precision, preds in tflite_top1.items():
+        preds = np.array(preds)
+        report[precision] = {
+            "top1_agreement": float(np.mean(preds == keras_top1)),
+            "accuracy": float(np.mean(preds == labels)),
+            "latency_ms": latency[precision] / n * 1000,
+            "speedup": latency["keras"] / latency[precision] if latency[precision] else None,
+            "size_mb": os.path.getsize(tflite_paths[precision]) / 1e6,
+        }
+    return report
+
+def export_all(calib_dir, test_dir, max_images=500, report_path=None):
+    report = {}
+    for name, use_dip in MODELS.items():
+        keras_path = os.path.join(MODEL_DIR, f"{name}.keras")
+        if not os.path.exists(keras_path):
+            print(f"{keras_path} not found. Skipping.")
+            continue
+
+        print(f"--- Exporting {name} (USE_DIP={use_dip}) ---")
+        model = tf.keras.models.load_model(keras_path)
+        tflite_paths = {}
+        for precision in PRECISIONS:
+            if precision == "int8" and not split_exists(calib_dir):
+                print(f"Calibration directory {calib_dir} not found. Skipping INT8.")
+                continue
+            out_path = os.path.join(MODEL_DIR, f"{name}_{precision}.tflite")
+            with open(out_path, "wb") as f:
+                f.write(convert(model, precision, calib_dir, use_dip))
+            tflite_paths[precision] = out_path
+            print(f"  Saved {out_path} ({os.path.getsize(out_path) / 1e6:.2f} MB)")
+
+        if split_exists(test_dir):
+            report[name] = {
+                "keras_size_mb": os.path.getsize(keras_path) / 1e6,
+                **parity_report(model, tflite_paths, test_dir, use_dip, max_images),
+            }
+
+    report_path = report_path or os.path.join(MODEL_DIR, "export_parity_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n========= EXPORT PARITY REPORT =========")
+    for name, r in report.items():
+        print(f"{name} ({r.get('images', 0)} images) - Keras: {r['keras']['latency_ms']:.2f} ms/img" if "keras" in r else name)
+        for precision in PRECISIONS:
+            if precision in r:
+                p = r[precision]
+                print(f"  {precision}: agreement {p['top1_agreement'] * 100:.2f}%, "
+                      f"{p['latency_ms']:.2f} ms/img, {p['size_mb']:.2f} MB")
+    print(f"Report written to {report_path}")
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export float16 / INT8 TFLite engines and a parity report.")
+    parser.add_argument('--calib-dir', default='data_split/train', help="Images used for INT8 calibration")
+    parser.add_argument('--test-dir', default='data_split/test', help="Images used for the parity report")
+    parser.add_argument('--max-images', type=int, default=500)
+    args = parser.parse_args()
+
+    export_all(args.calib_dir, args.test_dir, max_images=args.max_images)
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import hashlib
+
+import numpy as np
+import tensorflow as tf
+from numpy.lib.format import open_memmap
+from tensorflow.keras.layers import GlobalAveragePooling2D
+
+from dataset_cache import list_split, file_list_hash, dip_version
+
+FEATURE_DIR = "feature_cache"
+
+
+def _pooled_index(model):
+    """Index of the GlobalAveragePooling2D that ends the frozen part of a build_model() model."""
+    return max(i for i, layer in enumerate(model.layers) if isinstance(layer, GlobalAveragePooling2D))
+
+def feature_extractor(model):
+    """The frozen backbone + pooling of `model`, as a model from images to pooled feature vectors."""
+    return tf.keras.Model(model.input, model.layers[_pooled_index(model)].output, name="pooled_features")
+
+def head_model(model):
+    """
+    The trainable head of `model` (everything after the pooling) called on a feature input.
+    The layers are shared with `model`, so training this trains the full model's head.
+    """
+    pooled = model.layers[_pooled_index(model)]
+    features = tf.keras.Input(shape=pooled.output.shape[1:], name="pooled_input")
+    x = features
+    for layer in model.layers[_pooled_index(model) + 1:]:
+        x = layer(x)
+    return tf.keras.Model(features, x, name="head")
+
+def backbone_fingerprint(model):
+    """Hash of the frozen layers' weights: features from a different backbone are never reused."""
+    h = hashlib.sha1()
+    for layer in model.layers[:_pooled_index(model) + 1]:
+        for w in layer.get_weights():
+            h.update(np.ascontiguousarray(w).tobytes())
+    return h.hexdigest()
+
+def cache_features(model, split_dir, generator, use_dip, feature_dir=FEATURE_DIR):
+    """
+    Pooled features of every image of a split through the frozen backbone, once: float16
+    (N, D) and int32 labels as .npy files opened memory-mapped, plus a meta file keyed by
+    the split's file list, the DIP code version (DIP inputs) and the backbone weights.
+    `generator` yields the split's (x, y) batches unshuffled (train.data_generator).
+    Returns (features, labels).
+    """
+    split = os.path.basename(os.path.normpath(split_dir))
+    name = os.path.join(feature_dir, f"{split}_{'dip' if use_dip else 'raw'}")
+    paths, _, _ = list_split(split_dir)
+    key = {
+        "file_list_hash": file_list_hash(split_dir, paths),
+        "dip_version": dip_version() if use_dip else None,
+        "backbone": backbone_fingerprint(model),
+    }
+    if os.path.exists(name + ".json"):
+        with open(name + ".json") as f:
+            meta = json.load(f)
+        if meta["key"] == key:
+            return np.load(name + ".npy", mmap_mode="r"), np.load(name + "_labels.npy")
+
+    os.makedirs(feature_dir, exist_ok=True)
+    extractor = feature_extractor(model)
+    features = open_memmap(name + ".npy.tmp", mode="w+", dtype=np.float16,
+                           shape=(len(paths), extractor.output.shape[-1]))
+    labels = np.empty(len(paths), np.int32)
+    count = 0
+    t0 = time.time()
+    for x, y in generator:
+        n = int(x.shape[0])
+        features[count:count + n] = extractor.predict_on_batch(x)
+        labels[count:count + n] = np.argmax(np.asarray(y), axis=1)
+        count += n
+    features.flush()
+    del features
+    print(f"  {split} ({'DIP' if use_dip else 'raw'}): {count} feature vectors in {time.time() - t0:.1f}s")
+
+    # Unreadable images are skipped by the loaders: keep only the rows that were written
+    features = np.load(name + ".npy.tmp", mmap_mode="r")[:count]
+    np.save(name + ".npy", features)
+    os.remove(name + ".npy.tmp")
+    np.save(name + "_labels.npy", labels[:count])
+    with open(name + ".json", "w") as f:
+        json.dump({"key": key, "count": count, "dim": int(features.shape[1])}, f)
+    return np.load(name + ".npy", mmap_mode="r"), labels[:count]
+
+def train_head(model, train_features, train_labels, val_features, val_labels, epochs=30, batch_size=256, callbacks=None):
+    """Fit the head of `model` on cached features; `model` itself ends up with the trained head."""
+    num_classes = model.output.shape[-1]
+    head = head_model(model)
+    # An epoch over cached features takes seconds, so a larger step than build_model's 1e-4 is affordable
+    head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=1e-3),
+                 loss='categorical_crossentropy',
+                 metrics=['accuracy'])
+    return head.fit(
+        train_features, tf.keras.utils.to_categorical(train_labels, num_classes=num_classes),
+        validation_data=(val_features, tf.keras.utils.to_categorical(val_labels, num_classes=num_classes)),
+        batch_size=batch_size, epochs=epochs, callbacks=callbacks, shuffle=True,
+    )
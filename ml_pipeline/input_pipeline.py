@@ -0,0 +1,120 @@
+import os
+import time
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+from dip_module import apply_dip_pipeline_batch, DIP_SIZE
+from dataset_cache import list_split, split_exists
+
+AUTOTUNE = tf.data.AUTOTUNE
+# Batches held by the post-cache shuffle: each is ~19 MB of float32 at batch size 32
+BATCH_SHUFFLE_BUFFER = 16
+
+
+def _load_batch(paths, labels, use_dip):
+    """numpy_function body: read + resize + (batch) DIP + preprocess_input for one batch of paths."""
+    x, kept, _ = apply_dip_pipeline_batch([p.decode() for p in paths], use_dip=bool(use_dip))
+    # Unreadable files are dropped from the batch together with their labels
+    return x.astype(np.float32), labels[kept].astype(np.int32)
+
+
+class TfDataLoader:
+    """
+    tf.data counterpart of CropDataGenerator: same files, same class_indices, same inputs.
+    Batches of paths are decoded and run through the batch DIP pipeline by map() with
+    num_parallel_calls=AUTOTUNE and prefetched. With `cache` ("" for memory, or a file
+    prefix) the preprocessed batches are kept after the first epoch and shuffling moves to
+    the batch level; without it the file order is reshuffled every epoch.
+    Pass `.dataset` to model.fit / model.predict; iterating yields (x, y) tensors.
+    """
+
+    def __init__(self, directory, batch_size=32, use_dip=True, shuffle=True, cache=None, seed=None):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.use_dip = use_dip
+        self.shuffle = shuffle
+
+        self.filepaths, labels, self.classes = list_split(directory)
+        self.labels = np.asarray(labels, np.int32)
+        self.num_classes = len(self.classes)
+        self.class_indices = dict(zip(self.classes, range(len(self.classes))))
+        self.dataset = self._build(cache, seed)
+
+    def _build(self, cache, seed):
+        w, h = DIP_SIZE
+        num_classes = self.num_classes
+        use_dip = self.use_dip
+
+        def load(paths, labels):
+            x, y = tf.numpy_function(_load_batch, [paths, labels, use_dip], [tf.float32, tf.int32], stateful=False)
+            x.set_shape((None, h, w, 3))
+            y.set_shape((None,))
+            return x, tf.one_hot(y, num_classes)
+
+        ds = tf.data.Dataset.from_tensor_slices((self.filepaths, self.labels))
+        if self.shuffle and len(self.filepaths):
+            # Cached batches keep their composition, so mix the classes once up front
+            ds = ds.shuffle(len(self.filepaths), seed=seed, reshuffle_each_iteration=cache is None)
+        ds = ds.batch(self.batch_size)
+        ds = ds.map(load, num_parallel_calls=AUTOTUNE, deterministic=not self.shuffle)
+        if cache is not None:
+            ds = ds.cache(cache)
+            if self.shuffle:
+                ds = ds.shuffle(BATCH_SHUFFLE_BUFFER, seed=seed, reshuffle_each_iteration=True)
+        return ds.prefetch(AUTOTUNE)
+
+    def __len__(self):
+        return int(np.ceil(len(self.filepaths) / float(self.batch_size)))
+
+    def __iter__(self):
+        return iter(self.dataset)
+
+
+def _images_per_sec(batches, max_batches):
+    """Images/sec over batches 2..max_batches of an iterable of (x, y); the first one is warmup (tracing, pool start)."""
+    count = 0
+    t0 = None
+    for i, (x, _) in enumerate(batches):
+        if t0 is None:
+            t0 = time.perf_counter()
+        else:
+            count += int(x.shape[0])
+        if i + 1 >= max_batches:
+            break
+    return count / max(time.perf_counter() - t0, 1e-9), count
+
+def main(directory="data_split/train", batch_size=32, use_dip=True, max_batches=50, with_cache=False):
+    from train import CropDataGenerator
+    if not split_exists(directory):
+        print(f"{directory} not found.")
+        return
+
+    sequence = CropDataGenerator(directory, batch_size=batch_size, use_dip=use_dip, shuffle=True)
+    loader = TfDataLoader(directory, batch_size=batch_size, use_dip=use_dip, shuffle=True)
+    assert loader.class_indices == sequence.class_indices, "tf.data labels differ from CropDataGenerator"
+
+    print(f"{directory}: {len(loader.filepaths)} images, batch {batch_size}, USE_DIP={use_dip}, "
+          f"first {max_batches} batches, {os.cpu_count()} CPUs")
+    rows = [("CropDataGenerator", *_images_per_sec(sequence, max_batches)),
+            ("tf.data", *_images_per_sec(loader, max_batches))]
+    if with_cache:
+        # The in-memory cache only pays off from the second epoch on: fill it with one full pass
+        cached = TfDataLoader(directory, batch_size=batch_size, use_dip=use_dip, shuffle=True, cache="")
+        _images_per_sec(cached, len(cached))
+        rows.append(("tf.data + cache (epoch 2)", *_images_per_sec(cached, max_batches)))
+    base = rows[0][1]
+    print(f"\n{'loader':<28} {'images/s':>10} {'speedup':>8}")
+    for name, ips, _ in rows:
+        print(f"{name:<28} {ips:>10.1f} {ips / base:>7.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Images/sec of the tf.data loader against CropDataGenerator.")
+    parser.add_argument("--dir", default="data_split/train")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--no-dip", action="store_true")
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--with-cache", action="store_true", help="Also time cache() after one full warm-up epoch.")
+    args = parser.parse_args()
+    main(args.dir, args.batch_size, not args.no_dip, args.batches, args.with_cache)
@@ -0,0 +1,81 @@
+import os
+import hashlib
+
+import pandas as pd
+
+from dedup import perceptual_hash
+
+SPLITS_DIR = "data_split"
+SPLITS = ("train", "val", "test")
+MANIFEST_NAMES = ("manifest.parquet", "manifest.csv")
+# hash: sha1 of the file; phash: 64-bit difference hash as hex; group: duplicate group id
+COLUMNS = ["path", "label", "split", "hash", "phash", "group", "size", "mtime_ns"]
+
+
+def manifest_path(splits_dir=SPLITS_DIR):
+    """The split manifest under splits_dir (Parquet preferred over CSV), or None."""
+    for name in MANIFEST_NAMES:
+        path = os.path.join(splits_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+def read_manifest(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, dtype={"hash": str, "phash": str})
+
+def write_manifest(df, path):
+    """Write atomically, as Parquet or CSV by extension (Parquet needs pyarrow)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    if path.endswith(".parquet"):
+        df[COLUMNS].to_parquet(tmp, index=False)
+    else:
+        df[COLUMNS].to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    # Only one manifest is authoritative
+    for name in MANIFEST_NAMES:
+        other = os.path.join(os.path.dirname(path), name)
+        if other != path and os.path.exists(other):
+            os.remove(other)
+
+def content_hash(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def hash_files(paths):
+    """
+    Work unit (runs in a pool process): [(path, size, mtime_ns, hash, phash, error)] per
+    path; phash is None for files that are not decodable images.
+    """
+    rows = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            phash = perceptual_hash(path)
+            rows.append((path, st.st_size, st.st_mtime_ns, content_hash(path),
+                         None if phash is None else f"{phash:016x}", None))
+        except Exception as e:
+            rows.append((path, None, None, None, None, str(e)))
+    return rows
+
+def split_files(split_dir):
+    """
+    (paths, labels, classes) of one split read from the manifest next to it
+    (data_split/train -> data_split/manifest.*, rows with split == "train"), or None when
+    there is no manifest. Class indices follow the sorted labels of the whole manifest, so
+    every split of one manifest shares them.
+    """
+    splits_dir, split = os.path.split(os.path.normpath(split_dir))
+    path = manifest_path(splits_dir or ".")
+    if path is None:
+        return None
+    df = read_manifest(path)
+    classes = sorted(df["label"].unique())
+    index = {c: i for i, c in enumerate(classes)}
+    rows = df[df["split"] == split].sort_values(["label", "path"])
+    return list(rows["path"]), [index[c] for c in rows["label"]], classes
@@ -0,0 +1,103 @@
+import os
+import csv
+import sys
+import time
+import multiprocessing
+from contextlib import contextmanager
+from importlib.machinery import ModuleSpec
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+# Images per work unit: small enough to keep every core busy to the end of a run, large
+# enough that pickling the unit and its result is noise next to the work itself
+UNIT_SIZE = 128
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def _init_worker():
+    # One process per core: OpenCV's own thread pool would only oversubscribe it
+    cv2.setNumThreads(1)
+
+@contextmanager
+def _main_not_reimported(fn):
+    """
+    Spawned workers re-run the caller's __main__ before any work, which for train.py /
+    finetune.py means importing TensorFlow in every worker. While the pool starts, __main__
+    is presented as the module "__main__", which multiprocessing leaves alone in workers;
+    fn comes from an importable module, so workers only import that (OpenCV, dip_module).
+    """
+    main = sys.modules["__main__"]
+    if fn.__module__ == "__main__":
+        yield
+        return
+    spec = getattr(main, "__spec__", None)
+    main.__spec__ = ModuleSpec("__main__", None)
+    try:
+        yield
+    finally:
+        main.__spec__ = spec
+
+def chunk_units(items, unit_size=UNIT_SIZE):
+    """Consecutive (start, stop) ranges of at most unit_size over a list of items."""
+    return [(i, min(i + unit_size, len(items))) for i in range(0, len(items), unit_size)]
+
+class Progress:
+    """Single-line progress with throughput and ETA on stdout."""
+
+    def __init__(self, total, label="images"):
+        self.total, self.label = total, label
+        self.done = 0
+        self.start = time.time()
+
+    def update(self, count):
+        self.done += count
+        elapsed = time.time() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0.0
+        sys.stdout.write(f"\r  {self.done}/{self.total} {self.label}  {rate:.1f}/s  ETA {eta:.0f}s   ")
+        sys.stdout.flush()
+
+    def close(self):
+        elapsed = time.time() - self.start
+        print(f"\r  {self.done}/{self.total} {self.label} in {elapsed:.1f}s ({self.done / max(elapsed, 1e-9):.1f}/s)   ")
+        return elapsed
+
+def run_units(fn, units, workers=None, sizes=None, label="images"):
+    """
+    Run fn(*unit) for every unit on a process pool and yield (unit, result) as units finish,
+    with progress in `label`s (sizes[i] per unit, default 1). The pool uses the spawn start
+    method so callers that already imported TensorFlow can fork no threads into workers,
+    and workers skip re-importing the caller's script; fn must be a module-level function.
+    workers=1 runs in-process.
+    """
+    workers = workers or default_workers()
+    sizes = sizes or [1] * len(units)
+    progress = Progress(sum(sizes), label)
+    if workers == 1 or len(units) <= 1:
+        for unit, size in zip(units, sizes):
+            result = fn(*unit)
+            progress.update(size)
+            yield unit, result
+    else:
+        context = multiprocessing.get_context("spawn")
+        with _main_not_reimported(fn), ProcessPoolExecutor(max_workers=min(workers, len(units)), mp_context=context,
+                                                           initializer=_init_worker) as pool:
+            futures = {pool.submit(fn, *unit): (unit, size) for unit, size in zip(units, sizes)}
+            for future in as_completed(futures):
+                unit, size = futures[future]
+                result = future.result()
+                progress.update(size)
+                yield unit, result
+    progress.close()
+
+def write_failures(path, failures):
+    """Failure manifest: one CSV row (path, stage, error) per file that could not be processed."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "stage", "error"])
+        writer.writerows(failures)
+    return path
@@ -1,12 +1,13 @@
-import os
 import tensorflow as tf
 from tensorflow.keras.applications import MobileNetV3Small
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, BatchNormalization, Dropout
 from tensorflow.keras.models import Model
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, ModelCheckpoint, TensorBoard
 import numpy as np
-import pandas as pd
-from dip_module import apply_dip_pipeline
+from dip_module import apply_dip_pipeline_batch
+from dataset_cache import ensure_cache, list_split, split_exists, CACHE_DIR
+
+LOADERS = ("cache", "tfdata", "sequence")
 
 class CropDataGenerator(tf.keras.utils.Sequence):
     def __init__(self, directory, batch_size=32, use_dip=True, shuffle=True):
@@ -15,18 +16,10 @@ class CropDataGenerator(tf.keras.utils.Sequence):
         self.use_dip = use_dip
         self.shuffle = shuffle
         
-        self.classes = sorted(os.listdir(directory))
+        # Split manifest (data_split/manifest.*) or class sub-directories
+        self.filepaths, self.labels, self.classes = list_split(directory)
         self.num_classes = len(self.classes)
         self.class_indices = dict(zip(self.classes, range(len(self.classes))))
-        
-        self.filepaths = []
-        self.labels = []
-        for c in self.classes:
-            c_dir = os.path.join(directory, c)
-            if os.path.isdir(c_dir):
-                for f in os.listdir(c_dir):
-                    self.filepaths.append(os.path.join(c_dir, f))
-                    self.labels.append(self.class_indices[c])
                     
         self.indices = np.arange(len(self.filepaths))
         if self.shuffle:
@@ -38,23 +31,76 @@ class CropDataGenerator(tf.keras.utils.Sequence):
     def __getitem__(self, idx):
         batch_indices = self.indices[idx * self.batch_size:(idx + 1) * self.batch_size]
         
-        batch_x = []
-        batch_y = []
-        
-        for i in batch_indices:
-            try:
-                img = apply_dip_pipeline(self.filepaths[i], use_dip=self.use_dip)
-                batch_x.append(img)
-                batch_y.append(self.labels[i])
-            except Exception as e:
-                print(f"Error processing {self.filepaths[i]}: {e}")
+        # The whole batch goes through DIP as one stack; unreadable files are skipped
+        batch_x, kept, _ = apply_dip_pipeline_batch([self.filepaths[i] for i in batch_indices], use_dip=self.use_dip)
+        batch_y = [self.labels[batch_indices[k]] for k in kept]
                 
-        return np.array(batch_x), tf.keras.utils.to_categorical(batch_y, num_classes=self.num_classes)
+        return batch_x, tf.keras.utils.to_categorical(batch_y, num_classes=self.num_classes)
         
     def on_epoch_end(self):
         if self.shuffle:
             np.random.shuffle(self.indices)
 
+class CachedDataGenerator(tf.keras.utils.Sequence):
+    """
+    CropDataGenerator over the precomputed dataset cache (dataset_cache.py): every batch is
+    a contiguous, zero-copy slice of one memory-mapped shard, so no image is decoded or run
+    through DIP during training. Shard rows are stored class-mixed; shuffle reorders the
+    batches every epoch. Same class_indices as CropDataGenerator for the same directory.
+    """
+
+    def __init__(self, directory, batch_size=32, use_dip=True, shuffle=True, cache_dir=CACHE_DIR):
+        self.cache = ensure_cache(directory, cache_dir)
+        self.batch_size = batch_size
+        self.kind = "dip" if use_dip else "raw"
+        self.shuffle = shuffle
+
+        self.classes = self.cache.classes
+        self.num_classes = len(self.classes)
+        self.class_indices = dict(zip(self.classes, range(len(self.classes))))
+        self.filepaths = self.cache.paths
+        self.labels = self.cache.labels
+
+        self.batch_ranges = self.cache.batches(batch_size)
+        self.indices = np.arange(len(self.batch_ranges))
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+    def __len__(self):
+        return len(self.batch_ranges)
+
+    def __getitem__(self, idx):
+        from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
+        images, labels = self.cache.slice(self.kind, *self.batch_ranges[self.indices[idx]])
+        # Rows of unreadable source images carry label -1
+        if labels.min(initial=0) < 0:
+            keep = labels >= 0
+            images, labels = images[keep], labels[keep]
+        batch_x = preprocess_input(images.astype(np.float32))
+        return batch_x, tf.keras.utils.to_categorical(labels, num_classes=self.num_classes)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+def data_generator(directory, batch_size=32, use_dip=True, shuffle=True, cache_dir=CACHE_DIR, loader="cache"):
+    """
+    Input batches for a split directory, all with CropDataGenerator's class_indices:
+    "cache" reads the precomputed dataset cache (built on first use; falls back to
+    "sequence" when cache_dir is None), "tfdata" is the parallel tf.data pipeline
+    (input_pipeline.TfDataLoader), "sequence" is CropDataGenerator itself.
+    """
+    if loader == "tfdata":
+        from input_pipeline import TfDataLoader
+        return TfDataLoader(directory, batch_size=batch_size, use_dip=use_dip, shuffle=shuffle)
+    if loader == "cache" and cache_dir:
+        return CachedDataGenerator(directory, batch_size=batch_size, use_dip=use_dip, shuffle=shuffle, cache_dir=cache_dir)
+    return CropDataGenerator(directory, batch_size=batch_size, use_dip=use_dip, shuffle=shuffle)
+
+def fit_input(generator):
+    """What model.fit / model.predict take for a data_generator() result."""
+    return getattr(generator, "dataset", generator)
+
 def build_model(num_classes):
     base_model = MobileNetV3Small(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
     
@@ -75,17 +121,17 @@ def build_model(num_classes):
                   metrics=['accuracy'])
     return model
 
-def train_model(use_dip=True):
+def train_model(use_dip=True, cache_dir=CACHE_DIR, loader="cache"):
     train_dir = 'data_split/train'
     val_dir = 'data_split/val'
     
-    if not os.path.exists(train_dir):
+    if not split_exists(train_dir):
         print("Training directory not found. Please run data_prep.py first.")
         return
 
     print(f"--- Starting Training Run (USE_DIP={use_dip}) ---")
-    train_gen = CropDataGenerator(train_dir, batch_size=32, use_dip=use_dip, shuffle=True)
-    val_gen = CropDataGenerator(val_dir, batch_size=32, use_dip=use_dip, shuffle=False)
+    train_gen = data_generator(train_dir, batch_size=32, use_dip=use_dip, shuffle=True, cache_dir=cache_dir, loader=loader)
+    val_gen = data_generator(val_dir, batch_size=32, use_dip=use_dip, shuffle=False, cache_dir=cache_dir, loader=loader)
     
     num_classes = train_gen.num_classes
     model = build_model(num_classes)
@@ -100,18 +146,62 @@ def train_model(use_dip=True):
     ]
     
     # Normally we do 20+ epochs, but this is a demo/baseline script so we limit it.
-    model.fit(train_gen,
-              validation_data=val_gen,
+    model.fit(fit_input(train_gen),
+              validation_data=fit_input(val_gen),
               epochs=2, 
               callbacks=callbacks)
               
     print(f"Training finished. Model saved as {model_name}.keras")
 
+def train_head_on_features(use_dip=True, cache_dir=CACHE_DIR, loader="cache", epochs=30):
+    """
+    Same model as train_model, trained in minutes: the frozen backbone runs once per split
+    (feature_cache.py), the head trains on the cached pooled features, and since the head
+    layers are shared with the full model, saving it gives the usual .keras artifact.
+    """
+    from feature_cache import cache_features, train_head
+    train_dir = 'data_split/train'
+    val_dir = 'data_split/val'
+
+    if not split_exists(train_dir):
+        print("Training directory not found. Please run data_prep.py first.")
+        return
+
+    print(f"--- Starting Head-Only Training Run on Cached Features (USE_DIP={use_dip}) ---")
+    train_gen = data_generator(train_dir, batch_size=64, use_dip=use_dip, shuffle=False, cache_dir=cache_dir, loader=loader)
+    val_gen = data_generator(val_dir, batch_size=64, use_dip=use_dip, shuffle=False, cache_dir=cache_dir, loader=loader)
+
+    model = build_model(train_gen.num_classes)
+    x_train, y_train = cache_features(model, train_dir, train_gen, use_dip)
+    x_val, y_val = cache_features(model, val_dir, val_gen, use_dip)
+
+    model_name = "model_with_dip" if use_dip else "model_without_dip"
+    callbacks = [
+        EarlyStopping(patience=5, restore_best_weights=True, monitor='val_loss'),
+        ReduceLROnPlateau(factor=0.5, patience=3, min_lr=1e-6, monitor='val_loss'),
+        TensorBoard(log_dir=f'./logs/{model_name}_head')
+    ]
+    train_head(model, x_train, y_train, x_val, y_val, epochs=epochs, callbacks=callbacks)
+
+    # The full model's own optimizer never stepped; build it so the artifact reloads cleanly for fine-tuning
+    model.optimizer.build(model.trainable_variables)
+    model.save(f'{model_name}.keras')
+    print(f"Training finished. Model saved as {model_name}.keras")
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--no-dip', action='store_true', help="Train without DIP")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="Dataset cache directory (built on first use)")
+    parser.add_argument('--no-cache', action='store_true', help="Decode and run DIP on every batch instead")
+    parser.add_argument('--loader', choices=LOADERS, default="cache", help="Input pipeline (see data_generator)")
+    parser.add_argument('--head-only', action='store_true', help="Train the head on cached backbone features")
+    parser.add_argument('--epochs', type=int, default=30, help="Head-only epochs (early stopping on val_loss)")
     args = parser.parse_args()
     
     use_dip = not args.no_dip
-    train_model(use_dip=use_dip)
+    cache_dir = None if args.no_cache else args.cache_dir
+    if args.head_only:
+        train_head_on_features(use_dip=use_dip, cache_dir=cache_dir, loader=args.loader, epochs=args.epochs)
+    else:
+        train_model(use_dip=use_dip, cache_dir=cache_dir, loader=args.loader)
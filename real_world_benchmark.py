@@ -1,12 +1,10 @@
 import os
 import shutil
-import numpy as np
-import tensorflow as tf
-from sklearn.metrics import accuracy_score
 import sys
 
 sys.path.append(os.path.abspath("ml_pipeline"))
-from dip_module import apply_dip_pipeline
+from dataset_cache import list_split
+from eval_engine import EvaluationEngine, compute_metrics
 
 def setup_real_world_benchmark():
     src_dir = "real_world_tests"
@@ -31,51 +29,43 @@ def setup_real_world_benchmark():
             os.makedirs(class_dir, exist_ok=True)
             shutil.copy(src_path, os.path.join(class_dir, filename))
 
-def evaluate_real_world():
-    print("Loading Baseline (Raw) and Production (DIP) Models...")
-    model_raw = tf.keras.models.load_model("ml_pipeline/model_nodip.keras")
-    model_dip = tf.keras.models.load_model("ml_pipeline/model_with_dip.keras")
-
+def evaluate_real_world(refresh=False):
     # Load classes from standard train data
     val_dir = "data_split/train"
-    classes = sorted(os.listdir(val_dir))
+    classes = list_split(val_dir)[2]
 
     test_dir = "data_split/real_world_benchmark"
     if not os.path.exists(test_dir):
         return
 
-    y_true = []
-    y_pred_raw = []
-    y_pred_dip = []
-
-    print(f"Beginning quantitative scoring over messy, unstructured real-world data...")
-    for c in os.listdir(test_dir):
+    paths = []
+    labels = []
+    for c in sorted(os.listdir(test_dir)):
         class_dir = os.path.join(test_dir, c)
         if not os.path.isdir(class_dir): continue
         if c not in classes:
             print(f"Warning: Class {c} not found in model schema.")
             continue
-        
-        class_idx = classes.index(c)
-
-        for f in os.listdir(class_dir):
-            img_path = os.path.join(class_dir, f)
+        for f in sorted(os.listdir(class_dir)):
             print(f"  -> Testing {f}")
+            paths.append(os.path.join(class_dir, f))
+            labels.append(classes.index(c))
 
-            # 1. Model A Evaluation (Raw CNN)
-            img_raw = apply_dip_pipeline(img_path, use_dip=False)
-            preds_raw = model_raw.predict(np.expand_dims(img_raw, axis=0), verbose=0)[0]
-            y_pred_raw.append(np.argmax(preds_raw))
-
-            # 2. Model B Evaluation (DIP + CNN)
-            img_dip = apply_dip_pipeline(img_path, use_dip=True)
-            preds_dip = model_dip.predict(np.expand_dims(img_dip, axis=0), verbose=0)[0]
-            y_pred_dip.append(np.argmax(preds_dip))
+    if not paths:
+        print("No labelled real-world images to score.")
+        return
 
-            y_true.append(class_idx)
+    # Both models score the same decode of each image; stored predictions skip inference on re-runs
+    print("Scoring Baseline (Raw) and Production (DIP) Models over messy, unstructured real-world data...")
+    engine = EvaluationEngine(classes)
+    engine.register("model_raw", "ml_pipeline/model_nodip.keras", "raw")
+    engine.register("model_dip", "ml_pipeline/model_with_dip.keras", "dip")
+    predictions = engine.run("real_world_benchmark", paths, labels, refresh=refresh)
+    if len(predictions) < 2:
+        return
 
-    acc_raw = accuracy_score(y_true, y_pred_raw)
-    acc_dip = accuracy_score(y_true, y_pred_dip)
+    acc_raw = compute_metrics(predictions["model_raw"])[0]["Accuracy"]
+    acc_dip = compute_metrics(predictions["model_dip"])[0]["Accuracy"]
 
     print("\n==========================================")
     print("   REAL-WORLD DOMAIN GAP BENCHMARK")